@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Cold start benchmark, the cost a new serverless (AWS Lambda) container adds to a webhook.
+
+Every run starts a fresh Python process which imports compliance_inspect and
+handles two webhooks with one file each by the Flask test client, against the
+local stand-ins of Webex and S3 (see fake_services.py). The first webhook pays
+for the first request work (S3 client, token load, connection setup), the second
+one shows the warm container reusing it. The runs are repeated with FAST_START
+false and true, the background token refresher is off like on Lambda.
+
+Reports the time from the process spawn to the first verdict, the import time, the first and
+the second webhook time percentiles and the heavy modules imported, as JSON.
+
+Usage:
+    python benchmarks/bench_cold_start.py [-n RUNS] [-l LATENCY] [--app-dir DIR] [-o FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from types import SimpleNamespace
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, APP_DIR)
+
+from fake_services import FakeWebex, FakeS3
+from bench_webhook import BENCH_BUCKET, percentiles, configure_environment
+
+HEAVY_MODULES = ("boto3", "botocore", "webexteamssdk", "coloredlogs")
+
+# runs in the fresh process: argv[1] time.time() of the spawn, argv[2] application directory, argv[3:] webhooks
+CHILD = r"""
+import sys, time, json, logging
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[2])
+import compliance_inspect as ci
+imported = time.perf_counter()
+logging.disable(logging.WARNING)
+client = ci.flask_app.test_client()
+requests = []
+for webhook in sys.argv[3:]:
+    request_start = time.perf_counter()
+    status = client.post("/", json = json.loads(webhook)).status_code
+    requests.append((time.perf_counter() - request_start, status))
+    if len(requests) == 1:
+        first_done = time.time() - float(sys.argv[1])
+print(json.dumps({"import_s": imported - start, "requests": requests, "first_done_s": first_done,
+    "modules": [name for name in %r if name in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+def store_tokens(s3):
+    """
+    Put the tokens directly to the S3 stand-in, the benchmark process doesn't import the application.
+    """
+    record = {"access_token": "bench-access-0", "refresh_token": "bench-refresh",
+        "expires_at": str(time.time() + 14 * 24 * 3600), "refresh_token_expires_at": str(time.time() + 90 * 24 * 3600)}
+    s3.buckets.setdefault(BENCH_BUCKET, {})["token_storage/webex_tokens_COMPLIANCE.json"] = json.dumps(record).encode()
+
+def make_webhook(webex, run, index):
+    return json.dumps({"id": "bench-webhook", "resource": "messages", "event": "created",
+        "data": {"id": "cold-{}-{}".format(run, index), "roomId": "bench-room", "roomType": "group",
+            "files": [webex.file_url("image", "cold-{}-{}".format(run, index))]}})
+
+def run_once(webex, run, fast_start, app_dir):
+    env = dict(os.environ, FAST_START = "true" if fast_start else "false", TOKEN_REFRESHER = "false")
+    output = subprocess.run([sys.executable, "-c", CHILD, repr(time.time()), app_dir, make_webhook(webex, run, 0), make_webhook(webex, run, 1)],
+        env = env, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, check = True).stdout
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    (first, first_status), (second, second_status) = result["requests"]
+    return {"first_verdict_s": result["first_done_s"], "import_s": result["import_s"], "first_s": first, "second_s": second,
+        "statuses": [first_status, second_status], "modules": result["modules"]}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--runs", type = int, default = 10, help = "fresh processes per mode")
+    parser.add_argument("-l", "--latency", type = float, default = 0.005, help = "seconds added to every request of the stand-ins")
+    parser.add_argument("--app-dir", default = APP_DIR, help = "directory of compliance_inspect.py, to compare with another checkout")
+    parser.add_argument("-o", "--output", help = "write the JSON results to a file")
+    args = parser.parse_args()
+
+    webex = FakeWebex(latency = args.latency)
+    s3 = FakeS3(latency = args.latency)
+    configure_environment(webex, s3, SimpleNamespace(use_async = False, orgs = 1))
+    store_tokens(s3)
+
+    results = []
+    run = 0
+    for fast_start in (False, True):
+        runs = []
+        for index in range(args.runs):
+            runs.append(run_once(webex, run, fast_start, args.app_dir))
+            run += 1
+        results.append({
+            "fast_start": fast_start,
+            "runs": args.runs,
+            "start_to_first_verdict_ms": percentiles([r["first_verdict_s"] for r in runs]),
+            "import_ms": percentiles([r["import_s"] for r in runs]),
+            "first_webhook_ms": percentiles([r["first_s"] for r in runs]),
+            "second_webhook_ms": percentiles([r["second_s"] for r in runs]),
+            "http_status": sorted(set(status for r in runs for status in r["statuses"])),
+            "modules_after_webhooks": runs[-1]["modules"],
+        })
+    output = json.dumps(results, indent = 2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    print(output)
+
+if __name__ == "__main__":
+    main()
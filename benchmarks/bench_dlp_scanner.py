@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Throughput benchmark of the streaming DLP content scanner.
+
+Scans generated text and binary data without any match (the worst case,
+the whole file is read) and reports MB/s on a single core.
+
+Usage:
+    python benchmarks/bench_dlp_scanner.py [-s SIZE_MB] [-k KEYWORDS]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import dlp_scanner
+from dlp_scanner import StreamScanner, default_rules, SCAN_CHUNK_SIZE
+
+WORDS = [b"invoice", b"meeting", b"the", b"quarterly", b"report", b"phone", b"order", b"id", b"2021-10-18"]
+
+def text_data(size, rnd):
+    out = bytearray()
+    while len(out) < size:
+        out += rnd.choice(WORDS) + b" "
+    return bytes(out[:size])
+
+def binary_data(size, rnd):
+    return rnd.randbytes(size)
+
+def bench(rules, data, chunk_size):
+    start = time.perf_counter()
+    scanner = StreamScanner(rules)
+    match = scanner.scan(data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+    elapsed = time.perf_counter() - start
+    assert match is None, match
+    return len(data) / elapsed / 1e6
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--size", type = int, default = 16, help = "data size in MB")
+    parser.add_argument("-k", "--keywords", type = int, default = 100, help = "number of keywords")
+    parser.add_argument("-c", "--chunk", type = int, default = SCAN_CHUNK_SIZE, help = "chunk size in bytes")
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    keywords = ["codename-{:04d}".format(i) for i in range(args.keywords)]
+    rules = default_rules(keywords)
+    size = args.size * 1000 * 1000
+    results = {
+        "aho_corasick": dlp_scanner.ahocorasick is not None,
+        "keywords": args.keywords,
+        "chunk_size": args.chunk,
+        "text_mb_per_s": round(bench(rules, text_data(size, rnd), args.chunk), 1),
+        "binary_mb_per_s": round(bench(rules, binary_data(size, rnd), args.chunk), 1),
+    }
+    print(json.dumps(results, indent = 2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of the logging cost paid by the request threads.
+
+Every mode runs in a fresh process which imports compliance_inspect with the
+logging settings of the mode and logs the per-file lines of an inspection
+(the file INFO line, the HEAD headers at DEBUG, the verdict) from several
+threads at a given rate of files. The log output goes to a pipe read by this
+process, with --drain limited to a number of KB/s like a slow log shipper,
+so that the pipe fills up. Reports the per-file logging time percentiles on
+the request thread, the lines logged, written and dropped or suppressed
+(dropped: queue full while running, the lines queued at the exit are
+dropped later if the output is stuck), as JSON.
+
+Modes:
+    text         coloredlogs, written by the logging thread (the default)
+    json         JSON lines, written by the logging thread
+    json_async   JSON lines, LOG_ASYNC background writer
+    json_limit   JSON lines, LOG_ASYNC and LOG_FILE_LINES_PER_SECOND 1000
+
+Usage:
+    python benchmarks/bench_logging.py [-n FILES] [-t THREADS] [-r RATE] [--drain KBPS] [-m MODE ...] [-o FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+MODES = {
+    "text": {"LOG_FORMAT": "text", "LOG_ASYNC": "false"},
+    "json": {"LOG_FORMAT": "json", "LOG_ASYNC": "false"},
+    "json_async": {"LOG_FORMAT": "json", "LOG_ASYNC": "true"},
+    "json_limit": {"LOG_FORMAT": "json", "LOG_ASYNC": "true", "LOG_FILE_LINES_PER_SECOND": "1000"},
+}
+
+# runs in the fresh process: argv[1] application directory, argv[2] files per thread, argv[3] threads, argv[4] files/s, argv[5] result file
+CHILD = r"""
+import sys, time, json, threading
+sys.path.insert(0, sys.argv[1])
+import compliance_inspect as ci
+from structured_log import log_context, short_id
+
+files, threads, rate, result_file = int(sys.argv[2]), int(sys.argv[3]), float(sys.argv[4]), sys.argv[5]
+interval = threads / rate
+url = "https://webexapis.com/v1/contents/Y2lzY29zcGFyazovL3VybjpURUFNOnVzLXdlc3QtMl9yL0NPTlRFTlQvNWI1NzAyZjAtMmJhNS0xMWVjLWIyYWUtNmQwNjAwMzBkYTg2LzA?allow=dlpEvaluating,dlpUnchecked"
+headers = {"Content-Type": "image/png", "Content-Length": "204800", "Content-Disposition": 'attachment; filename="image.png"',
+    "Date": "Mon, 18 Oct 2021 07:00:00 GMT", "Server": "Redacted", "TrackingID": "ROUTER_616D1A8E-0F2B-01BB-00C4", "Vary": "Accept-Encoding"}
+durations = [[] for index in range(threads)]
+
+def log_files(index):
+    next_file = time.perf_counter() + interval * index / threads
+    for number in range(files):
+        delay = next_file - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        next_file += interval
+        start = time.perf_counter()
+        with log_context(file = short_id((index, number))):
+            ci.file_logger.info("Message file: %s, type: %s, size: %s", url, "image/png", 204800)
+            ci.file_logger.debug("File headers: %s", headers)
+            ci.file_logger.info("Verdict %s sent for %s", "approve", url)
+        durations[index].append(time.perf_counter() - start)
+
+workers = [threading.Thread(target = log_files, args = (index,)) for index in range(threads)]
+start = time.perf_counter()
+for worker in workers:
+    worker.start()
+for worker in workers:
+    worker.join()
+elapsed = time.perf_counter() - start
+with open(result_file, "w") as output:
+    json.dump({"durations": sorted(d for thread in durations for d in thread), "elapsed": elapsed,
+        "dropped": ci.log_writer.dropped if ci.log_writer else 0,
+        "suppressed": ci.file_log_limit.suppressed if ci.file_log_limit else 0}, output)
+"""
+
+def percentiles_us(values):
+    if not values:
+        return {}
+    result = {name: round(values[min(len(values) - 1, int(q * len(values)))] * 1e6, 1)
+        for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))}
+    result["max"] = round(values[-1] * 1e6, 1)
+    return result
+
+def drain(stream, kbps, lines):
+    """
+    Read the log output, at most 'kbps' KB/s if set.
+    """
+    while True:
+        data = stream.read1(4096) if kbps else stream.read1(65536)
+        if not data:
+            return
+        lines[0] += data.count(b"\n")
+        if kbps:
+            time.sleep(len(data) / (kbps * 1024))
+
+def run_mode(name, args):
+    env = dict(os.environ, TOKEN_REFRESHER = "false", FAST_START = "false", LOG_LEVEL = "INFO", **MODES[name])
+    if "LOG_FILE_LINES_PER_SECOND" not in MODES[name]:
+        env.pop("LOG_FILE_LINES_PER_SECOND", None)
+    lines = [0]
+    with tempfile.NamedTemporaryFile(suffix = ".json") as result_file:
+        child = subprocess.Popen([sys.executable, "-c", CHILD, args.app_dir, str(args.files), str(args.threads), str(args.rate), result_file.name],
+            env = env, stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+        reader = threading.Thread(target = drain, args = (child.stdout, args.drain, lines))
+        reader.start()
+        child.wait()
+        reader.join()
+        with open(result_file.name) as result_input:
+            result = json.load(result_input)
+    return {
+        "mode": name,
+        "files": args.files * args.threads,
+        "threads": args.threads,
+        "per_file_us": percentiles_us(result["durations"]),
+        "files_per_s": round(args.files * args.threads / result["elapsed"]),
+        "lines_logged": args.files * args.threads * 2, # the file and the verdict lines, the headers are DEBUG
+        "lines_written": lines[0],
+        "lines_dropped": result["dropped"],
+        "lines_suppressed": result["suppressed"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--files", type = int, default = 5000, help = "files logged per thread")
+    parser.add_argument("-t", "--threads", type = int, default = 8, help = "logging threads")
+    parser.add_argument("-r", "--rate", type = float, default = 2000, help = "files per second of all threads")
+    parser.add_argument("--drain", type = float, default = 0, help = "KB/s the log output is read with, 0 for no limit")
+    parser.add_argument("-m", "--mode", action = "append", choices = sorted(MODES), help = "mode to run, all if not set")
+    parser.add_argument("--app-dir", default = APP_DIR, help = "directory of compliance_inspect.py")
+    parser.add_argument("-o", "--output", help = "write the JSON results to a file")
+    args = parser.parse_args()
+
+    results = [run_mode(name, args) for name in (args.mode or list(MODES))]
+    output = json.dumps(results, indent = 2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    print(output)
+
+if __name__ == "__main__":
+    main()
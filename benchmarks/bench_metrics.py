@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of the metrics instrumentation overhead.
+
+Measures the cost of a counter increment, a histogram observation and
+a timed block, which is what each instrumented stage pays per file.
+
+Usage:
+    python benchmarks/bench_metrics.py [-n NUMBER]
+"""
+
+import os
+import sys
+import json
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import metrics
+
+def bench(func, number):
+    seconds = min(timeit.repeat(func, number = number, repeat = 5))
+    return seconds / number * 1e9
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type = int, default = 100000, help = "iterations per repeat")
+    args = parser.parse_args()
+
+    registry = metrics.Registry()
+    counter = metrics.Counter("bench_total", "Benchmark counter", ["result"], registry = registry)
+    histogram = metrics.Histogram("bench_seconds", "Benchmark histogram", ["stage"], registry = registry)
+
+    def timed_block():
+        with histogram.time(stage = "head"):
+            pass
+
+    results = {
+        "counter_inc_ns": bench(lambda: counter.inc(result = "approve"), args.number),
+        "histogram_observe_ns": bench(lambda: histogram.observe(0.012, stage = "head"), args.number),
+        "histogram_time_ns": bench(timed_block, args.number),
+        "render_us": bench(registry.render, 1000) / 1000,
+    }
+    print(json.dumps({k: round(v, 1) for k, v in results.items()}, indent = 2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of the MIME type policy decision.
+
+Compares the original per-file loop over ALLOWED_MIME_TYPES_REGEX with
+the compiled MimePolicy, both with a cold (disabled) and warm memo cache.
+
+Usage:
+    python benchmarks/bench_mime_policy.py [-n NUMBER]
+"""
+
+import os
+import re
+import sys
+import json
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mime_policy import MimePolicy, APPROVE, REJECT
+
+# copies of the constants in compliance_inspect.py, importing it would start the whole application
+ALLOWED_MIME_TYPES_REGEX = [
+    r"image\/.*"
+]
+SUSPECT_MIME_TYPES = ["application/msword",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "application/vnd.ms-excel.sheet.macroEnabled.12",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    "application/pdf"]
+
+CONTENT_TYPES = ["image/png", "image/jpeg", "application/pdf", "text/plain; charset=utf-8",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document", "image/gif"]
+
+def legacy_decide(content_type):
+    for allowed_regex in ALLOWED_MIME_TYPES_REGEX:
+        if re.match(allowed_regex, content_type):
+            return APPROVE
+    return REJECT
+
+def bench(func, number):
+    def run():
+        for content_type in CONTENT_TYPES:
+            func(content_type)
+    seconds = min(timeit.repeat(run, number = number, repeat = 5))
+    return seconds / (number * len(CONTENT_TYPES)) * 1e9
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type = int, default = 20000, help = "iterations per repeat")
+    args = parser.parse_args()
+
+    allow_policy = MimePolicy(allowed = ALLOWED_MIME_TYPES_REGEX, denied = SUSPECT_MIME_TYPES)
+    cold_policy = MimePolicy(allowed = ALLOWED_MIME_TYPES_REGEX, denied = SUSPECT_MIME_TYPES, cache_size = 0)
+
+    results = {
+        "legacy_regex_loop_ns": bench(legacy_decide, args.number),
+        "policy_cold_ns": bench(cold_policy.decide, args.number),
+        "policy_memoized_ns": bench(allow_policy.decide, args.number),
+    }
+    print(json.dumps({k: round(v, 1) for k, v in results.items()}, indent = 2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""End-to-end webhook benchmark against local stand-ins of Webex and S3.
+
+Starts FakeWebex and FakeS3 (see fake_services.py), points the application
+to them by WEBEX_API_URL and AWS_ENDPOINT_URL, fires synthetic webhooks
+at spark_webhook() and reports webhooks/s, files/s and the verdict latency
+(from the webhook POST to the verdict PUT arrival) percentiles as JSON.
+
+Scenarios:
+    single_file        one image per message
+    multi_file         five files of different types per message
+    content_scan       text files scanned for sensitive data (denylist policy)
+    slow_host          half of the files served with SLOW_HOST_LATENCY
+    token_near_expiry  the stored Access Token expires within SAFE_TOKEN_DELTA, the first webhook refreshes it
+    noisy_org          all files of the first organization served with SLOW_HOST_LATENCY, use with --orgs
+    office             300 KB Word documents, clean, with a macro and with an OLE object (OOXML_POLICY inspect)
+    spaces             an image and a PDF per message in 20 spaces, PDFs approved in the spaces of a relaxed
+                       team, nothing approved in external spaces, one room lookup per space expected
+
+With --orgs N the application runs with MULTI_ORG, the messages are spread
+over N organizations and the verdict latency is reported per organization.
+With --rate-limit N the Webex stand-in answers the requests over N per second
+by 429, compare RATE_LIMIT=true and false to see the adaptive limiter.
+
+Usage:
+    python benchmarks/bench_webhook.py [-s SCENARIO ...] [-m MESSAGES] [-c CONCURRENCY] [-l LATENCY] [--orgs N] [--rate-limit N] [--async] [-o FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import importlib
+import concurrent.futures
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fake_services import FakeWebex, FakeS3
+from dlp_policy import compile_policy
+
+SLOW_HOST_LATENCY = 0.3 # seconds per request of the slow file host
+BENCH_BUCKET = "bench-dlp"
+
+SCENARIOS = {
+    "single_file": {"kinds": ["image"]},
+    "multi_file": {"kinds": ["image", "pdf", "docx", "text", "image"]},
+    "content_scan": {"kinds": ["text", "textcard"], "policy": {"mime_mode": "denylist"}},
+    "slow_host": {"kinds": ["image", "image"], "slow_files": 1},
+    "token_near_expiry": {"kinds": ["image"], "token_expires_in": 600},
+    "noisy_org": {"kinds": ["image", "image"], "slow_org": True},
+    "office": {"kinds": ["docx_image", "docx_macro", "docx_ole", "docx_image"], "policy": {"mime_mode": "denylist", "ooxml": "inspect", "content_scan": False}},
+    "spaces": {"kinds": ["image", "pdf"], "rooms": 20, "policy": {"spaces": [
+        {"team_ids": ["bench-team-relaxed"], "policy": {"allowed": ["image/.*", "application/pdf"]}},
+        {"external": True, "policy": {"allowed": []}}]}},
+}
+
+def bench_rooms(count):
+    """
+    Room details of the spaces scenario: every fourth space is in the relaxed team, the next one is external.
+    """
+    rooms = {}
+    for index in range(count):
+        rooms["bench-room-{}".format(index)] = {"id": "bench-room-{}".format(index), "type": "group",
+            "teamId": "bench-team-relaxed" if index % 4 == 0 else None,
+            "ownerId": "bench-external-org" if index % 4 == 1 else "bench-org-0"}
+    return rooms
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    def pick(q):
+        return values[min(len(values) - 1, int(q * len(values)))]
+    return {"p50": round(pick(0.5) * 1000, 2), "p95": round(pick(0.95) * 1000, 2),
+        "p99": round(pick(0.99) * 1000, 2), "max": round(values[-1] * 1000, 2)}
+
+def configure_environment(webex, s3, args):
+    """
+    Point the application to the stand-ins, must be done before compliance_inspect is imported.
+    """
+    os.environ.update({
+        "WEBEX_API_URL": webex.url + "/v1/",
+        "WEBEX_INTEGRATION_CLIENT_ID": "bench-client",
+        "WEBEX_INTEGRATION_CLIENT_SECRET": "bench-secret",
+        "AWS_ENDPOINT_URL": s3.url,
+        "AWS_REGION": "us-east-1",
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "S3_BUCKET": BENCH_BUCKET,
+        "WEBHOOK_ASYNC": "true" if args.use_async else "false",
+        "VERDICT_CACHE_PERSIST": "false",
+        "MULTI_ORG": "true" if args.orgs > 1 else "false",
+    })
+    os.environ.pop("AWS_PROFILE", None)
+
+def org_id(ci, index, orgs):
+    return "bench-org-{}".format(index % orgs)
+
+def store_tokens(ci, expires_in, org_ids):
+    for org in org_ids:
+        token_key = ci.get_token_key({"orgId": org})
+        tokens = ci.AccessTokenAbs({"access_token": "bench-access-0", "expires_in": expires_in,
+            "refresh_token": "bench-refresh", "refresh_token_expires_in": 90 * 24 * 3600})
+        ci.save_tokens(token_key, tokens)
+        ci.webex_client_cache.invalidate(token_key) # the first webhook loads the tokens from S3
+
+def verdict_sources(ci):
+    """
+    Returns:
+        dict: number of verdicts sent so far by their source (inspection or a fallback)
+    """
+    sources = {}
+    for suffix, labelnames, (result, source), value in ci.verdicts_total.samples():
+        sources[source] = sources.get(source, 0) + value
+    return sources
+
+def run_scenario(ci, client, webex, slow_webex, name, args):
+    scenario = SCENARIOS[name]
+    webex.reset()
+    slow_webex.reset()
+    ci.seen_events.clear()
+    ci.sent_verdicts.clear()
+    ci.room_cache.clear()
+    webex.rooms = bench_rooms(scenario.get("rooms", 0))
+    policy = ci.policy_store.current
+    ci.policy_store.swap(compile_policy(ci.builtin_policy(), scenario.get("policy")))
+    store_tokens(ci, scenario.get("token_expires_in", 14 * 24 * 3600), [org_id(ci, index, args.orgs) for index in range(args.orgs)])
+    sources_before = verdict_sources(ci)
+
+    sent_at = {} # file path -> perf_counter() of the webhook POST
+    file_orgs = {} # file path -> organization
+    response_times = []
+    statuses = {}
+
+    def send_message(index):
+        files = []
+        org = org_id(ci, index, args.orgs)
+        slow_org = scenario.get("slow_org") and index % args.orgs == 0
+        for position, kind in enumerate(scenario["kinds"]):
+            host = slow_webex if slow_org or position < scenario.get("slow_files", 0) else webex
+            files.append(host.file_url(kind, "{}-{}-{}".format(name, index, position)))
+        webhook = {"id": "bench-webhook", "resource": "messages", "event": "created", "orgId": org,
+            "data": {"id": "{}-message-{}".format(name, index), "roomType": "group", "files": files,
+                "roomId": "bench-room-{}".format(index % scenario["rooms"]) if scenario.get("rooms") else "bench-room"}}
+        start = time.perf_counter()
+        for url in files:
+            sent_at[urlparse(url).path] = start
+            file_orgs[urlparse(url).path] = org
+        response = client.post("/", json = webhook)
+        return response.status_code, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers = args.concurrency) as senders:
+        for status, elapsed in senders.map(send_message, range(args.messages)):
+            response_times.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+    webhooks_done = time.perf_counter()
+
+    expected = len(sent_at)
+    deadline = time.time() + ci.VERDICT_DEADLINE + 10
+    while time.time() < deadline and len(webex.verdicts) + len(slow_webex.verdicts) < expected:
+        time.sleep(0.01)
+    ci.policy_store.swap(policy)
+
+    verdicts = dict(webex.verdicts)
+    verdicts.update(slow_webex.verdicts)
+    last_verdict = max((arrived for result, arrived in verdicts.values()), default = webhooks_done)
+    duration = max(webhooks_done, last_verdict) - start
+    latencies = [arrived - sent_at[path] for path, (result, arrived) in verdicts.items() if path in sent_at]
+    results = {}
+    for result, arrived in verdicts.values():
+        results[result] = results.get(result, 0) + 1
+    sources = {source: count - sources_before.get(source, 0) for source, count in verdict_sources(ci).items()
+        if count > sources_before.get(source, 0)}
+
+    report = {
+        "scenario": name,
+        "messages": args.messages,
+        "files": expected,
+        "concurrency": args.concurrency,
+        "async": args.use_async,
+        "file_latency_s": webex.latency,
+        "duration_s": round(duration, 3),
+        "webhooks_per_s": round(args.messages / (webhooks_done - start), 1),
+        "files_per_s": round(len(verdicts) / duration, 1),
+        "webhook_response_ms": percentiles(response_times),
+        "verdict_latency_ms": percentiles(latencies),
+        "http_status": statuses,
+        "verdicts": results,
+        "verdict_sources": sources,
+        "missing_verdicts": expected - len(verdicts),
+        "token_refreshes": webex.token_refreshes,
+        "room_lookups": webex.room_lookups,
+        "rate_limited": webex.throttled,
+        "file_requests": dict(webex.requests, slow = sum(slow_webex.requests.values())),
+        "file_bytes_per_file": round((webex.bytes_sent + slow_webex.bytes_sent) / max(1, expected)),
+    }
+    if ci.MULTI_ORG:
+        report["verdict_latency_ms_by_org"] = {org: percentiles([arrived - sent_at[path]
+            for path, (verdict, arrived) in verdicts.items() if file_orgs.get(path) == org])
+            for org in sorted(set(file_orgs.values()))}
+    return report
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--scenario", action = "append", choices = sorted(SCENARIOS), help = "scenario to run, all if not set")
+    parser.add_argument("-m", "--messages", type = int, default = 200, help = "webhooks per scenario")
+    parser.add_argument("-c", "--concurrency", type = int, default = 8, help = "webhooks sent in parallel")
+    parser.add_argument("-l", "--latency", type = float, default = 0.005, help = "seconds added to every file request")
+    parser.add_argument("--orgs", type = int, default = 1, help = "number of organizations, more than one runs with MULTI_ORG")
+    parser.add_argument("--rate-limit", type = int, default = 0, help = "file and verdict requests per second the Webex stand-in allows, 0 for no limit")
+    parser.add_argument("--async", dest = "use_async", action = "store_true", help = "run with WEBHOOK_ASYNC")
+    parser.add_argument("-o", "--output", help = "write the JSON results to a file")
+    parser.add_argument("-v", "--verbose", action = "store_true", help = "keep the application logging")
+    args = parser.parse_args()
+
+    webex = FakeWebex(latency = args.latency, rate_limit = args.rate_limit)
+    slow_webex = FakeWebex(latency = SLOW_HOST_LATENCY)
+    s3 = FakeS3()
+    configure_environment(webex, s3, args)
+
+    ci = importlib.import_module("compliance_inspect")
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+    ci.create_bucket(BENCH_BUCKET)
+    client = ci.flask_app.test_client()
+
+    results = [run_scenario(ci, client, webex, slow_webex, name, args) for name in (args.scenario or list(SCENARIOS))]
+    output = json.dumps(results, indent = 2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""Local stand-ins for the Webex API and AWS S3 used by the offline benchmarks.
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+FakeWebex serves the file HEAD/GET, the verdict PUT ?result=, the room
+details and the Access Token refresh. FakeS3 implements the few S3 REST calls the application makes
+(HeadBucket, CreateBucket, PutObject, GetObject, DeleteObject and the If-Match /
+If-None-Match conditions of the objects) with path-style addressing,
+it's used through AWS_ENDPOINT_URL. Both run in a background thread of the
+benchmark process, so their timestamps can be compared with the sender's.
+"""
+
+import io
+import re
+import json
+import time
+import hashlib
+import zipfile
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+def make_docx(parts = ()):
+    """
+    Build a Word document, 'parts' are (name, data) added uncompressed, like images are.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as package:
+        package.writestr("[Content_Types].xml", "<Types/>" * 20)
+        package.writestr("word/document.xml", "<w:t>quarterly report</w:t>" * 2000)
+        for name, data in parts:
+            package.writestr(name, data, zipfile.ZIP_STORED)
+    return buffer.getvalue()
+
+DOCX_IMAGE = ("word/media/image1.png", b"\x89PNG\r\n\x1a\n" + bytes(300 * 1024))
+
+def make_text(size, sensitive = False):
+    line = b"Meeting notes, the order was shipped on time and the invoice is attached.\n"
+    data = line * (size // len(line))
+    if sensitive:
+        middle = len(data) // 2
+        data = data[:middle] + b" card 4111 1111 1111 1111 " + data[middle:]
+    return data
+
+# file kind -> (content, Content-Type)
+FILE_KINDS = {
+    "image": (b"\x89PNG\r\n\x1a\n" + bytes(200 * 1024), "image/png"),
+    "pdf": (b"%PDF-1.4\n" + bytes(100 * 1024), "application/pdf"),
+    "docx": (make_docx(), "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    "docx_image": (make_docx([DOCX_IMAGE]), "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    "docx_macro": (make_docx([DOCX_IMAGE, ("word/vbaProject.bin", bytes(20 * 1024))]),
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    "docx_ole": (make_docx([DOCX_IMAGE, ("word/embeddings/oleObject1.bin", bytes(20 * 1024))]),
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    "text": (make_text(100 * 1024), "text/plain; charset=utf-8"),
+    "textcard": (make_text(100 * 1024, sensitive = True), "text/plain; charset=utf-8"),
+}
+
+def file_url(base_url, kind, file_id):
+    """
+    Build the URL of a FakeWebex file, 'kind' is a key of FILE_KINDS.
+    """
+    return "{}/v1/contents/{}-{}?allow=dlpEvaluating".format(base_url, kind, file_id)
+
+class FakeServer:
+    """
+    HTTP server running in a daemon thread.
+
+    Attributes:
+        url (str): base URL of the server
+        latency (float): seconds added to every response
+        requests (dict): number of requests by method
+        bytes_sent (int): response body bytes sent
+    """
+    def __init__(self, latency = 0):
+        self.latency = latency
+        self.requests = {}
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.url = "http://127.0.0.1:{}".format(self.httpd.server_port)
+        threading.Thread(target = self.httpd.serve_forever, daemon = True).start()
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def handle_method(self):
+                with server.lock:
+                    server.requests[self.command] = server.requests.get(self.command, 0) + 1
+                if server.latency:
+                    time.sleep(server.latency)
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+                status, headers, data = server.handle(self.command, self.path, self.headers, body)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(data)
+                    with server.lock:
+                        server.bytes_sent += len(data)
+
+            do_HEAD = do_GET = do_PUT = do_POST = do_DELETE = handle_method
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def handle(self, method, path, headers, body):
+        """
+        Returns:
+            tuple: (status, headers, body)
+        """
+        return 404, {}, b""
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class FakeWebex(FakeServer):
+    """
+    Webex files API and Access Token endpoint.
+
+    File URLs have the form <url>/v1/contents/<kind>-<id>, the content is
+    taken from FILE_KINDS and made unique by appending the id.
+
+    With 'rate_limit', file and verdict requests over the limit in a one-second
+    window are answered by 429 with Retry-After, like the Webex API does.
+
+    Attributes:
+        verdicts (dict): file path -> (result, perf_counter() of the PUT arrival)
+        token_refreshes (int): number of Access Token refreshes
+        rate_limit (int): max file and verdict requests per second, 0 for no limit
+        throttled (int): number of 429 responses
+        rooms (dict): room id -> room details served by GET /v1/rooms/<id>, other rooms are not found
+        room_lookups (int): number of room details requests
+    """
+    def __init__(self, latency = 0, token_lifetime = 14 * 24 * 3600, rate_limit = 0):
+        super().__init__(latency)
+        self.token_lifetime = token_lifetime
+        self.rate_limit = rate_limit
+        self.verdicts = {}
+        self.token_refreshes = 0
+        self.throttled = 0
+        self.rooms = {}
+        self.room_lookups = 0
+        self._window = (0, 0) # (second, requests in it)
+
+    def over_limit(self):
+        if not self.rate_limit:
+            return False
+        second = int(time.time())
+        with self.lock:
+            window, count = self._window
+            count = count + 1 if window == second else 1
+            self._window = (second, count)
+            if count > self.rate_limit:
+                self.throttled += 1
+                return True
+        return False
+
+    def file_url(self, kind, file_id):
+        return file_url(self.url, kind, file_id)
+
+    def reset(self):
+        with self.lock:
+            self.verdicts.clear()
+            self.requests.clear()
+            self.token_refreshes = 0
+            self.throttled = 0
+            self.bytes_sent = 0
+            self.room_lookups = 0
+
+    def handle(self, method, path, headers, body):
+        url = urlparse(path)
+        if method == "POST" and url.path == "/v1/access_token":
+            with self.lock:
+                self.token_refreshes += 1
+                count = self.token_refreshes
+            token = {"access_token": "bench-access-{}".format(count), "expires_in": self.token_lifetime,
+                "refresh_token": "bench-refresh", "refresh_token_expires_in": 90 * 24 * 3600}
+            return 200, {"Content-Type": "application/json"}, json.dumps(token).encode()
+
+        match = re.match(r"^/v1/rooms/([\w=-]+)$", url.path)
+        if method == "GET" and match:
+            with self.lock:
+                self.room_lookups += 1
+                room = self.rooms.get(match.group(1))
+            if room is None:
+                return 404, {"Content-Type": "application/json"}, b'{"message": "not found"}'
+            return 200, {"Content-Type": "application/json"}, json.dumps(room).encode()
+
+        match = re.match(r"^/v1/contents/(\w+)-([\w-]+)$", url.path)
+        if not match or match.group(1) not in FILE_KINDS:
+            return 404, {}, b""
+        if self.over_limit():
+            return 429, {"Retry-After": "1"}, b""
+        content, content_type = FILE_KINDS[match.group(1)]
+        content = content + match.group(2).encode()
+        if method == "PUT":
+            result = parse_qs(url.query).get("result", [None])[0]
+            with self.lock:
+                self.verdicts[url.path] = (result, time.perf_counter())
+            return 204, {}, b""
+        if method == "HEAD":
+            return 200, {"Content-Type": content_type}, content
+        range_header = headers.get("Range")
+        if range_header:
+            start, end = re.match(r"bytes=(\d*)-(\d*)", range_header).groups()
+            if start == "":
+                start, end = max(0, len(content) - int(end)), len(content) - 1
+            else:
+                start, end = int(start), int(end) if end else len(content) - 1
+            return 206, {"Content-Type": content_type,
+                "Content-Range": "bytes {}-{}/{}".format(start, end, len(content))}, content[start:end + 1]
+        return 200, {"Content-Type": content_type}, content
+
+class FakeS3(FakeServer):
+    """
+    Minimal in-memory S3 with path-style addressing.
+
+    Attributes:
+        buckets (dict): bucket name -> {key: bytes}
+    """
+    def __init__(self, latency = 0):
+        super().__init__(latency)
+        self.buckets = {}
+
+    def error(self, status, code):
+        body = "<?xml version=\"1.0\" encoding=\"UTF-8\"?><Error><Code>{}</Code><Message>{}</Message></Error>".format(code, code)
+        return status, {"Content-Type": "application/xml"}, body.encode()
+
+    def handle(self, method, path, headers, body):
+        url = urlparse(path)
+        bucket, _, key = url.path.lstrip("/").partition("/")
+        with self.lock:
+            objects = self.buckets.get(bucket)
+            if not key:
+                if method == "PUT":
+                    self.buckets.setdefault(bucket, {})
+                    return 200, {}, b""
+                if objects is None:
+                    return self.error(404, "NoSuchBucket")
+                return 200, {}, b""
+            if objects is None:
+                return self.error(404, "NoSuchBucket")
+            data = objects.get(key)
+            etag = '"{}"'.format(hashlib.md5(data).hexdigest()) if data is not None else None
+            if headers.get("If-None-Match") == "*" and data is not None:
+                return self.error(412, "PreconditionFailed")
+            if headers.get("If-Match") and headers.get("If-Match") != etag:
+                return self.error(412, "PreconditionFailed")
+            if method == "PUT":
+                objects[key] = body
+                return 200, {"ETag": '"{}"'.format(hashlib.md5(body).hexdigest())}, b""
+            if method == "DELETE":
+                objects.pop(key, None)
+                return 204, {}, b""
+            if data is None:
+                return self.error(404, "NoSuchKey")
+            if headers.get("If-None-Match") == etag:
+                return 304, {"ETag": etag}, b""
+            return 200, {"ETag": etag, "Content-Type": "application/octet-stream"}, data
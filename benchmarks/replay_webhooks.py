@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Replay captured webhooks with their original timing.
+
+Reads captures written with WEBHOOK_CAPTURE_FILE (see webhook_capture.py)
+and sends the webhooks again, keeping the gaps between their arrivals
+divided by --speed (--speed 0 sends them as fast as possible). The file
+hashes of the capture are turned into files of a stand-in Webex file host,
+so the inspection runs the real hot path with the real burst pattern.
+
+By default the webhooks are passed to compliance_inspect.handle_webhook_event()
+in this process, pointed to local stand-ins of Webex and S3 like bench_webhook.py.
+With --http the webhooks are POSTed to a running application instead; the file
+URLs in the webhooks still point to the stand-in file host, so the verdict
+latency is measured too. --webex-url and --s3-url use already running
+stand-ins instead of starting local ones, the verdict latency is then not known.
+
+Reports the webhooks/s, files/s, the send lag (how late the webhooks were sent
+against the capture timing), the webhook handling or response time and the verdict
+latency percentiles as JSON.
+
+Usage:
+    python benchmarks/replay_webhooks.py CAPTURE [CAPTURE ...] [--speed N] [--http URL] [-c CONCURRENCY]
+        [-l LATENCY] [--file-kind KIND] [--webex-url URL] [--s3-url URL] [--async] [-o FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import importlib
+import threading
+import concurrent.futures
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import requests
+
+from fake_services import FakeWebex, FakeS3, FILE_KINDS, file_url
+from bench_webhook import BENCH_BUCKET, percentiles, configure_environment, store_tokens
+from webhook_capture import read_capture
+
+VERDICT_WAIT = 20 # max seconds to wait for the verdicts after the last webhook
+
+def load_webhooks(paths, webex_url, file_kind, run_id):
+    """
+    Read the capture and point its files to the stand-in file host.
+
+    The event and file ids get the run id, so that a repeated replay
+    isn't ignored by the duplicate detection of the application.
+
+    Returns:
+        list: (seconds since the first webhook, webhook)
+    """
+    webhooks = []
+    first = None
+    for at, webhook in read_capture(paths):
+        if first is None:
+            first = at
+        data = webhook.get("data")
+        if isinstance(data, dict):
+            if data.get("id"):
+                data["id"] = "{}-{}".format(data["id"], run_id)
+            if isinstance(data.get("files"), list):
+                data["files"] = [file_url(webex_url, file_kind, "{}-{}".format(file_id, run_id)) for file_id in data["files"]]
+        webhooks.append((at - first, webhook))
+    return webhooks
+
+class StandIn:
+    """
+    Endpoints the application talks to during the replay.
+
+    Attributes:
+        webex_url (str): base URL of the Webex stand-in
+        s3_url (str): URL of the S3 stand-in
+        webex (FakeWebex): local Webex stand-in, None if an external one is used
+    """
+    def __init__(self, args):
+        self.webex = None if args.webex_url else FakeWebex(latency = args.latency)
+        self.s3 = None if args.s3_url else FakeS3()
+        self.webex_url = args.webex_url or self.webex.url
+        self.s3_url = args.s3_url or self.s3.url
+
+    def verdicts(self):
+        return dict(self.webex.verdicts) if self.webex else None
+
+def start_application(stand_in, args, org_ids):
+    """
+    Import compliance_inspect pointed to the stand-ins, with tokens for all organizations of the capture.
+    """
+    configure_environment(SimpleNamespace(url = stand_in.webex_url), SimpleNamespace(url = stand_in.s3_url),
+        SimpleNamespace(use_async = args.use_async, orgs = len(org_ids)))
+    os.environ.pop("WEBHOOK_CAPTURE_FILE", None)
+    ci = importlib.import_module("compliance_inspect")
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+    ci.create_bucket(BENCH_BUCKET)
+    store_tokens(ci, 14 * 24 * 3600, org_ids)
+    return ci
+
+def make_sender(args, ci):
+    """
+    Returns:
+        callable: send(webhook) -> HTTP status
+    """
+    if args.http:
+        local = threading.local()
+
+        def send_http(webhook):
+            if not hasattr(local, "session"):
+                local.session = requests.Session()
+            return local.session.post(args.http, json = webhook, timeout = 30).status_code
+        return send_http
+
+    def send_local(webhook):
+        if not ci.is_valid_webhook(webhook):
+            return 400
+        ci.handle_webhook_event(webhook, time.monotonic())
+        return 200
+    return send_local
+
+def replay(webhooks, send, stand_in, args):
+    sent_at = {} # file path -> perf_counter() of the webhook send
+    lags = []
+    response_times = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def send_webhook(webhook):
+        start = time.perf_counter()
+        for url in webhook.get("data", {}).get("files", []):
+            sent_at[urlparse(url).path] = start
+        try:
+            status = send(webhook)
+        except Exception as e:
+            logging.getLogger(__name__).error("Webhook send failed: {}".format(e))
+            status = "error"
+        with lock:
+            response_times.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers = args.concurrency) as senders:
+        for offset, webhook in webhooks:
+            if args.speed > 0:
+                delay = start + offset / args.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                lags.append(max(0.0, time.perf_counter() - start - offset / args.speed))
+            senders.submit(send_webhook, webhook)
+    webhooks_done = time.perf_counter()
+
+    expected = len(sent_at)
+    if stand_in.webex:
+        deadline = time.time() + VERDICT_WAIT
+        while time.time() < deadline and len(stand_in.webex.verdicts) < expected:
+            time.sleep(0.01)
+    verdicts = stand_in.verdicts()
+
+    report = {
+        "webhooks": len(webhooks),
+        "files": expected,
+        "mode": "http" if args.http else "in_process",
+        "speed": args.speed,
+        "async": args.use_async,
+        "capture_duration_s": round(webhooks[-1][0], 3) if webhooks else 0,
+        "webhooks_per_s": round(len(webhooks) / max(webhooks_done - start, 1e-9), 1),
+        "send_lag_ms": percentiles(lags),
+        "webhook_response_ms": percentiles(response_times),
+        "http_status": statuses,
+    }
+    if verdicts is not None:
+        last_verdict = max((arrived for result, arrived in verdicts.values()), default = webhooks_done)
+        duration = max(webhooks_done, last_verdict) - start
+        results = {}
+        for result, arrived in verdicts.values():
+            results[result] = results.get(result, 0) + 1
+        report.update({
+            "duration_s": round(duration, 3),
+            "files_per_s": round(len(verdicts) / duration, 1),
+            "verdict_latency_ms": percentiles([arrived - sent_at[path] for path, (result, arrived) in verdicts.items() if path in sent_at]),
+            "verdicts": results,
+            "missing_verdicts": expected - len(verdicts),
+        })
+    else:
+        report["duration_s"] = round(webhooks_done - start, 3)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture", nargs = "+", help = "capture files, several are merged by the arrival time")
+    parser.add_argument("--speed", type = float, default = 1, help = "replay speed multiplier, 0 for as fast as possible")
+    parser.add_argument("--http", help = "POST the webhooks to this URL instead of calling handle_webhook_event()")
+    parser.add_argument("-c", "--concurrency", type = int, default = 64, help = "webhooks sent in parallel at most")
+    parser.add_argument("-l", "--latency", type = float, default = 0.005, help = "seconds added to every request of the local Webex stand-in")
+    parser.add_argument("--file-kind", default = "image", choices = sorted(FILE_KINDS), help = "content served for the captured files")
+    parser.add_argument("--webex-url", help = "base URL of a running Webex stand-in instead of the local one")
+    parser.add_argument("--s3-url", help = "URL of a running S3 stand-in instead of the local one")
+    parser.add_argument("--async", dest = "use_async", action = "store_true", help = "run the in-process application with WEBHOOK_ASYNC")
+    parser.add_argument("-o", "--output", help = "write the JSON results to a file")
+    parser.add_argument("-v", "--verbose", action = "store_true", help = "keep the application logging")
+    args = parser.parse_args()
+
+    stand_in = StandIn(args)
+    webhooks = load_webhooks(args.capture, stand_in.webex_url, args.file_kind, int(time.time()))
+    ci = None
+    if not args.http:
+        org_ids = sorted(set(webhook.get("orgId") for offset, webhook in webhooks), key = str)
+        ci = start_application(stand_in, args, org_ids or [None])
+    result = replay(webhooks, make_sender(args, ci), stand_in, args)
+    output = json.dumps(result, indent = 2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    print(output)
+
+if __name__ == "__main__":
+    main()
@@ -27,7 +27,6 @@ __license__ = "Cisco Sample Code License, Version 1.1"
 import os
 import sys
 import logging
-import coloredlogs
 from dotenv import load_dotenv, find_dotenv
 dotenv_file = os.getenv("DOT_ENV_FILE")
 if dotenv_file:
@@ -37,8 +36,13 @@ else:
 
 from urllib.parse import urlparse, quote, parse_qsl, urlencode, urlunparse
 
-from webexteamssdk import WebexTeamsAPI, ApiError, AccessToken
-webex_api = WebexTeamsAPI(access_token="12345")
+# webexteamssdk and boto3 are imported where they are used, the webhook processing needs only boto3
+WEBEX_API_URL = os.getenv("WEBEX_API_URL", "https://webexapis.com/v1/") # Webex API base URL, can point to a local stand-in
+FAST_START = os.getenv("FAST_START", "true" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else "false").lower() in ("true", "yes", "1") # serverless cold start: plain logging, no S3 bucket check on the first request
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text") # "text" or "json" - a compact JSON object per line with the event and file correlation ids
+LOG_ASYNC = os.getenv("LOG_ASYNC", "false").lower() in ("true", "yes", "1") # format and write the log by a background thread, request threads never wait for the log output
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000)) # max log records waiting for the LOG_ASYNC writer, more are dropped
+LOG_FILE_LINES_PER_SECOND = float(os.getenv("LOG_FILE_LINES_PER_SECOND", 0)) # max per-file INFO/DEBUG log lines per second, 0 for no limit
 
 """
 # avoid using a proxy for DynamoDB communication
@@ -57,8 +61,12 @@ from flask import Flask, request, redirect, url_for, Response, make_response
 from flask.logging import default_handler
 
 import concurrent.futures
+import threading
+import queue
+import itertools
 import signal
 import re
+import tempfile
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -69,11 +77,26 @@ logging.basicConfig(
         logging.StreamHandler(sys.stdout)
     ]
 )
-coloredlogs.install(
-    level=os.getenv("LOG_LEVEL", "INFO"),
-    fmt="%(asctime)s  [%(levelname)7s]  [%(module)s.%(name)s.%(funcName)s]:%(lineno)s %(message)s",
-    logger=logger
-)
+from structured_log import JsonFormatter, RateLimitFilter, install_record_factory, write_in_background, log_context, short_id
+install_record_factory()
+if LOG_FORMAT == "json":
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(JsonFormatter())
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+elif FAST_START:
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO")) # the Lambda log doesn't show colors
+else:
+    import coloredlogs
+    coloredlogs.install(
+        level=os.getenv("LOG_LEVEL", "INFO"),
+        fmt="%(asctime)s  [%(levelname)7s]  [%(module)s.%(name)s.%(funcName)s]:%(lineno)s %(message)s",
+        logger=logger
+    )
+file_logger = logging.getLogger(__name__ + ".files") # per-file lines, the high-volume part of the log
+file_log_limit = RateLimitFilter(LOG_FILE_LINES_PER_SECOND) if LOG_FILE_LINES_PER_SECOND > 0 else None
+if file_log_limit:
+    file_logger.addFilter(file_log_limit)
+log_writer = write_in_background([logging.getLogger(), logger], LOG_QUEUE_SIZE) if LOG_ASYNC else None
 # logger.addHandler(default_handler)
 
 from logging.config import dictConfig
@@ -98,8 +121,22 @@ flask_app = Flask(__name__)
 flask_app.config["DEBUG"] = True
 requests.packages.urllib3.disable_warnings()
 
-import boto3, botocore
-from botocore.client import ClientError
+from webex_http import WebexFileSession, RateLimitTimeout
+from rate_limiter import default_limiter, WEBHOOKS, RATE_LIMIT_RETRIES, RATE_LIMIT_MAX_WAIT
+from mime_policy import APPROVE, REJECT, normalize_mime_type
+from file_sniff import sniff_remote, checked_mime_type, OLE2_MIME_TYPE
+from dlp_scanner import scan_remote
+from dlp_policy import PolicyStore, resolve_space
+from room_cache import RoomCache, parse_room
+from ttl_cache import TTLCache
+from verdict_cache import VerdictCache, sample_digest
+from zip_inspect import inspect_zip_remote, is_zip_file
+from deadline_scheduler import DeadlineScheduler
+from token_refresher import TokenRefresher
+from token_lease import Lease, FileLease, S3Lease
+from webhook_spool import WebhookSpool, claim_spool_directory
+from webhook_capture import WebhookCapture
+import metrics
 
 # Webex integration scopes
 ADMIN_SCOPE = ["audit:events_read"]
@@ -143,8 +180,6 @@ SUSPECT_MIME_TYPES = ["application/msword",
     "application/vnd.openxmlformats-officedocument.wordprocessingml.template",
     "application/vnd.ms-word.document.macroEnabled.12",
     "application/vnd.ms-word.template.macroEnabled.12",
-    "application/vnd.ms-word.document.macroEnabled.12",
-    "application/vnd.ms-word.template.macroEnabled.12",
     "application/msexcel",
     "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
     "application/vnd.openxmlformats-officedocument.spreadsheetml.template",
@@ -160,28 +195,118 @@ SUSPECT_MIME_TYPES = ["application/msword",
     "application/vnd.ms-powerpoint.presentation.macroEnabled.12",
     "application/vnd.ms-powerpoint.slideshow.macroEnabled.12",
     "application/vnd.ms-powerpoint.template.macroEnabled.12",
+    OLE2_MIME_TYPE, # legacy Office file detected by content sniffing
     "application/pdf"]
     
 ALLOWED_MIME_TYPES_REGEX = [
     "image\/.*"
 ]
 
+# "allowlist" - approve only ALLOWED_MIME_TYPES_REGEX, "denylist" - reject only SUSPECT_MIME_TYPES
+MIME_POLICY_MODE = os.getenv("MIME_POLICY_MODE", "allowlist")
+# "reject" - Office Open XML types are rejected as SUSPECT_MIME_TYPES, "inspect" - approved if ZIP_INSPECT finds no macros, embedded objects or encryption
+OOXML_POLICY = os.getenv("OOXML_POLICY", "reject")
+POLICY_KEY = os.getenv("POLICY_KEY") # S3_BUCKET key of the DLP policy document which overrides the policy settings, reloaded when it changes, not used if not set
+POLICY_CHECK_INTERVAL = int(os.getenv("POLICY_CHECK_INTERVAL", 30)) # seconds between the checks (by ETag) of the policy document
+POLICY_POLLER = os.getenv("POLICY_POLLER", "false" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else "true").lower() in ("true", "yes", "1") # check the policy document by a background thread, otherwise by the webhooks when due
+ROOM_CACHE_SIZE = int(os.getenv("ROOM_CACHE_SIZE", 10000)) # max spaces whose team and owner are cached for the "spaces" policy rules
+ROOM_CACHE_TTL = int(os.getenv("ROOM_CACHE_TTL", 3600)) # seconds the metadata of a space is cached
+ROOM_CACHE_NEGATIVE_TTL = int(os.getenv("ROOM_CACHE_NEGATIVE_TTL", 300)) # seconds a space not found (or not accessible) is cached
+ROOM_CACHE_REFRESH = os.getenv("ROOM_CACHE_REFRESH", "true").lower() in ("true", "yes", "1") # refresh the cached spaces used by the traffic in the background before they expire
+ROOM_LOOKUP_WORKERS = int(os.getenv("ROOM_LOOKUP_WORKERS", 4)) # threads of the space lookups and refreshes
+ROOM_LOOKUP_TIMEOUT = float(os.getenv("ROOM_LOOKUP_TIMEOUT", 2)) # max seconds a file waits for the lookup of its space, the policy without the team and owner rules is used after that
+
 STATE_CHECK = "webex is great" # integrity test phrase
 
 # timers
 SAFE_TOKEN_DELTA = 3600 # safety seconds before access token expires - renew if smaller
+TOKEN_REFRESH_RETRY = int(os.getenv("TOKEN_REFRESH_RETRY", 60)) # seconds before a failed token refresh is retried
+TOKEN_REFRESHER = os.getenv("TOKEN_REFRESHER", "false" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else "true").lower() in ("true", "yes", "1") # renew tokens by a background thread, webhooks never wait for the refresh
+TOKEN_REFRESH_AHEAD = int(os.getenv("TOKEN_REFRESH_AHEAD", 24 * 3600)) # seconds before the Access Token expiration when the background refresher renews it
+TOKEN_REFRESH_RETRY_MAX = int(os.getenv("TOKEN_REFRESH_RETRY_MAX", 1800)) # max seconds between the background refresh retries
+TOKEN_CHECK_INTERVAL = int(os.getenv("TOKEN_CHECK_INTERVAL", 60)) # seconds between the checks (by ETag) of the stored tokens, picks up tokens renewed by other processes
+TOKEN_LEASE = os.getenv("TOKEN_LEASE", "file") # election of the process which refreshes the tokens: "file" - lock file (processes of one host), "s3" - marker object in S3_BUCKET (several hosts), "none"
+TOKEN_LEASE_DIR = os.getenv("TOKEN_LEASE_DIR", os.path.join(tempfile.gettempdir(), "webex_dlp_leases")) # directory of the lock files of the "file" lease
+TOKEN_LEASE_TTL = int(os.getenv("TOKEN_LEASE_TTL", 120)) # max seconds the "s3" lease is held, a lease of a dead process is taken over after that
+
+# webhook processing
+WEBHOOK_ASYNC = os.getenv("WEBHOOK_ASYNC", "false").lower() in ("true", "yes", "1") # acknowledge webhooks immediately, process them by workers
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 4)) # number of worker threads in async mode
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 100)) # max webhooks waiting for a worker
+WEBHOOK_QUEUE_FULL_ACTION = os.getenv("WEBHOOK_QUEUE_FULL_ACTION", "503") # "503" - ask Webex to retry, "default_verdict" - send DEFAULT_VERDICT right away
+DEFAULT_VERDICT = os.getenv("DEFAULT_VERDICT", "reject") # verdict used if a file cannot be inspected: "reject", "approve" or "policy" - approve if the MIME policy approves the file type
+VERDICT_DEADLINE = float(os.getenv("VERDICT_DEADLINE", 8)) # seconds after the webhook arrival by which the verdict must be sent
+FALLBACK_MARGIN = float(os.getenv("FALLBACK_MARGIN", 1)) # seconds before the deadline when DEFAULT_VERDICT is sent instead of waiting for the inspection
+FALLBACK_WORKERS = int(os.getenv("FALLBACK_WORKERS", 4)) # threads sending the verdicts of the files which missed the deadline
+BUSY_RETRY_AFTER = 5 # Retry-After seconds in the 503 response
+DEDUP_CACHE_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", 10000)) # max remembered webhook events and file verdicts
+DEDUP_TTL = int(os.getenv("DEDUP_TTL", 600)) # seconds a webhook event or a file verdict is remembered
+WEBHOOK_SPOOL_DIR = os.getenv("WEBHOOK_SPOOL_DIR") # directory of the overflow spool for webhooks which don't fit the queue (WEBHOOK_ASYNC only), not used if not set
+WEBHOOK_SPOOL_SEGMENT_BYTES = int(os.getenv("WEBHOOK_SPOOL_SEGMENT_BYTES", 4 * 1024 * 1024)) # size of a spool segment file
+WEBHOOK_SPOOL_FSYNC = os.getenv("WEBHOOK_SPOOL_FSYNC", "false").lower() in ("true", "yes", "1") # fsync every spooled webhook, so it survives a system crash, not only a process crash
+WEBHOOK_SPOOL_ALL = os.getenv("WEBHOOK_SPOOL_ALL", "false").lower() in ("true", "yes", "1") # spool every webhook, not only the overflow, so that a crash loses none of them
+WEBHOOK_SPOOL_INFLIGHT = int(os.getenv("WEBHOOK_SPOOL_INFLIGHT", 50)) # max spooled webhooks dispatched and waiting for their verdicts
+WEBHOOK_CAPTURE_FILE = os.getenv("WEBHOOK_CAPTURE_FILE") # gzip JSONL file capturing the redacted webhooks for benchmarks/replay_webhooks.py, "{pid}" is replaced by the process id, not used if not set
+WEBHOOK_CAPTURE_KEY = os.getenv("WEBHOOK_CAPTURE_KEY") # key of the identifier hashes in the capture, random per process if not set
+
+# file inspection
+FILE_INSPECT_WORKERS = int(os.getenv("FILE_INSPECT_WORKERS", 16)) # threads shared by all messages
+MESSAGE_FILE_CONCURRENCY = int(os.getenv("MESSAGE_FILE_CONCURRENCY", 4)) # max files of a single message inspected in parallel
+FILE_INSPECT_TIMEOUT = float(os.getenv("FILE_INSPECT_TIMEOUT", 7)) # seconds, DEFAULT_VERDICT is sent if the inspection of a file takes longer
+MULTI_ORG = os.getenv("MULTI_ORG", "false").lower() in ("true", "yes", "1") # tokens per Webex organization, the organization is taken from the webhook orgId
+ORG_FILE_CONCURRENCY = int(os.getenv("ORG_FILE_CONCURRENCY", FILE_INSPECT_WORKERS // 2 if MULTI_ORG else FILE_INSPECT_WORKERS)) # max files of an organization inspected in parallel
+ORG_QUEUE_LIMIT = int(os.getenv("ORG_QUEUE_LIMIT", 500)) # max files of an organization waiting for inspection, new webhooks get WEBHOOK_QUEUE_FULL_ACTION or go to the spool
+FILE_QUEUE_LIMIT = int(os.getenv("FILE_QUEUE_LIMIT", 1000)) # max files waiting for inspection before new webhooks go to the spool (WEBHOOK_SPOOL_DIR only)
+CONTENT_SNIFF = os.getenv("CONTENT_SNIFF", "true").lower() in ("true", "yes", "1") # verify Content-Type by the file magic bytes
+SNIFF_BYTES = int(os.getenv("SNIFF_BYTES", 4096)) # max bytes read from the file beginning by a Range request
+ZIP_INSPECT = os.getenv("ZIP_INSPECT", "true").lower() in ("true", "yes", "1") # check the central directory of approved ZIP based files (Office documents) by Range requests
+ZIP_MAX_RATIO = float(os.getenv("ZIP_MAX_RATIO", 100)) # max compression ratio of a ZIP member, higher is a zip bomb
+ZIP_MAX_UNCOMPRESSED = int(os.getenv("ZIP_MAX_UNCOMPRESSED", 1024 * 1024 * 1024)) # max total uncompressed size of a ZIP file
+ZIP_MAX_MEMBERS = int(os.getenv("ZIP_MAX_MEMBERS", 10000)) # max number of members of a ZIP file
+CONTENT_SCAN = os.getenv("CONTENT_SCAN", "true").lower() in ("true", "yes", "1") # scan approved files for sensitive data
+CONTENT_SCAN_MAX_BYTES = int(os.getenv("CONTENT_SCAN_MAX_BYTES", 20 * 1024 * 1024)) # larger files are not scanned
+CONTENT_SCAN_SKIP_RE = re.compile(os.getenv("CONTENT_SCAN_SKIP_REGEX", r"(image|video|audio)/")) # file types not scanned
+DLP_KEYWORDS = [k.strip() for k in os.getenv("DLP_KEYWORDS", "").split(",") if k.strip()] # e.g. project code names
+VERDICT_CACHE = os.getenv("VERDICT_CACHE", "true").lower() in ("true", "yes", "1") # reuse content scan rejections of the same file
+VERDICT_CACHE_MAX_BYTES = int(os.getenv("VERDICT_CACHE_MAX_BYTES", 16 * 1024 * 1024)) # memory limit of the verdict cache
+VERDICT_CACHE_PERSIST = os.getenv("VERDICT_CACHE_PERSIST", "false").lower() in ("true", "yes", "1") # save the verdict cache to S3_BUCKET
+VERDICT_CACHE_SAVE_INTERVAL = int(os.getenv("VERDICT_CACHE_SAVE_INTERVAL", 300)) # min seconds between the verdict cache saves
 
 AWS_REGION = os.getenv("AWS_REGION")
 AWS_PROFILE = os.getenv("AWS_PROFILE")
 ENDPOINT_URL = os.getenv("AWS_ENDPOINT_URL")
 S3_BUCKET = os.getenv("S3_BUCKET")
+BOTO_POOL_SIZE = int(os.getenv("BOTO_POOL_SIZE", 10)) # max connections of a Boto3 client
 
+def builtin_policy():
+    """
+    DLP policy of the settings, used until the POLICY_KEY document is loaded
+    and for the fields missing in the document, see dlp_policy.py.
+    
+    Returns:
+        dict: policy fields
+    """
+    return {
+        "mime_mode": MIME_POLICY_MODE,
+        "allowed": ALLOWED_MIME_TYPES_REGEX,
+        "suspect": SUSPECT_MIME_TYPES,
+        "ooxml": OOXML_POLICY,
+        "content_sniff": CONTENT_SNIFF,
+        "zip_inspect": ZIP_INSPECT,
+        "zip_max_ratio": ZIP_MAX_RATIO,
+        "zip_max_uncompressed": ZIP_MAX_UNCOMPRESSED,
+        "zip_max_members": ZIP_MAX_MEMBERS,
+        "content_scan": CONTENT_SCAN,
+        "keywords": DLP_KEYWORDS
+    }
+    
 def sigterm_handler(_signo, _stack_frame):
     "When sysvinit sends the TERM signal, cleanup before exiting."
 
     logger.info("Received signal {}, exiting...".format(_signo))
     
-    thread_executor._threads.clear()
+    for executor in (thread_executor, fallback_executor, room_executor):
+        executor._threads.clear()
     concurrent.futures.thread._threads_queues.clear()
     sys.exit(0)
 
@@ -190,12 +315,56 @@ signal.signal(signal.SIGINT, sigterm_handler)
 
 STORAGE_PATH = "token_storage"
 WEBEX_TOKEN_FILE = "webex_tokens_{}.json"
+VERDICT_CACHE_FILE = "verdict_cache/verdicts.json"
 
 thread_executor = concurrent.futures.ThreadPoolExecutor()
-wxt_token_key = "COMPLIANCE"
+# the deadline verdicts and the space lookups don't wait behind the other tasks or each other
+fallback_executor = concurrent.futures.ThreadPoolExecutor(max_workers = FALLBACK_WORKERS, thread_name_prefix = "fallback_verdict")
+room_executor = concurrent.futures.ThreadPoolExecutor(max_workers = ROOM_LOOKUP_WORKERS, thread_name_prefix = "room_lookup")
+webhook_queue = queue.PriorityQueue(maxsize = WEBHOOK_QUEUE_SIZE) # (arrival time, sequence, webhook), the earliest deadline first
+webhook_sequence = itertools.count()
+webhook_spool = WebhookSpool(claim_spool_directory(WEBHOOK_SPOOL_DIR), WEBHOOK_SPOOL_SEGMENT_BYTES, WEBHOOK_SPOOL_FSYNC) if WEBHOOK_SPOOL_DIR and WEBHOOK_ASYNC else None
+webhook_capture = WebhookCapture(WEBHOOK_CAPTURE_FILE.format(pid = os.getpid()), WEBHOOK_CAPTURE_KEY) if WEBHOOK_CAPTURE_FILE else None
+spool_commit_queue = queue.Queue(maxsize = WEBHOOK_SPOOL_INFLIGHT) # (spool position, verdicts) of the dispatched spooled webhooks
+org_sessions = {} # token key -> WebexFileSession, keep-alive connections for the file HEAD and verdict PUT
+org_sessions_lock = threading.Lock()
+verdict_cache = VerdictCache(VERDICT_CACHE_MAX_BYTES)
+verdict_cache_loaded = False
+verdict_cache_saved_at = time.time()
+verdict_cache_lock = threading.Lock()
+webhook_workers_started = False
+webhook_workers_lock = threading.Lock()
+seen_events = TTLCache(DEDUP_CACHE_SIZE, DEDUP_TTL) # events already accepted, Webex redelivers webhooks on timeout
+sent_verdicts = TTLCache(DEDUP_CACHE_SIZE, DEDUP_TTL) # file URL -> verdict already sent
+wxt_token_key = "COMPLIANCE" # token key in the single organization mode
+ORG_ID_RE = re.compile(r"^[\w=+-]{1,256}$")
 token_refreshed = False
 
-class AccessTokenAbs(AccessToken):
+# instrumentation, exposed on /metrics
+stage_seconds = metrics.Histogram("dlp_stage_seconds", "Duration of the verdict processing stages", ["stage"])
+verdicts_total = metrics.Counter("dlp_verdicts_total", "File verdicts sent to Webex", ["result", "source"])
+verdict_slack_seconds = metrics.Histogram("dlp_verdict_slack_seconds", "Time left before the verdict deadline when the verdict was sent", ["source"])
+errors_total = metrics.Counter("dlp_errors_total", "Failures of the verdict processing", ["kind"])
+webhooks_total = metrics.Counter("dlp_webhooks_total", "Webhooks received", ["outcome"])
+files_in_flight = metrics.Gauge("dlp_files_in_flight", "Files being inspected")
+webhooks_in_flight = metrics.Gauge("dlp_webhooks_in_flight", "Webhooks being processed")
+token_expires_seconds = metrics.Gauge("dlp_token_expires_seconds", "Seconds until the Access Token expires", ["token"])
+token_refresh_due_seconds = metrics.Gauge("dlp_token_refresh_due_seconds", "Seconds until the next background token refresh", ["token"])
+token_refresh_success = metrics.Gauge("dlp_token_refresh_success", "1 if the last background token refresh succeeded, 0 if it failed", ["token"])
+webhook_queue_depth = metrics.Gauge("dlp_webhook_queue_depth", "Webhooks waiting for a worker")
+file_queue_depth = metrics.Gauge("dlp_file_queue_depth", "Files waiting for an inspection worker")
+webhook_spool_depth = metrics.Gauge("dlp_webhook_spool_depth", "Webhooks in the overflow spool not dispatched yet")
+rate_limited_total = metrics.Counter("dlp_rate_limited_total", "Webex API responses 429 Too Many Requests", ["call"])
+rate_limit_window = metrics.Gauge("dlp_rate_limit_window", "Max Webex API calls in flight allowed by the adaptive limiter", ["token"])
+room_cache_stats = metrics.Gauge("dlp_room_cache", "Space metadata cache statistics since the start", ["stat"])
+policy_checks = metrics.Gauge("dlp_policy_checks", "Checks of the DLP policy document since the start", ["outcome"])
+policy_check_age_seconds = metrics.Gauge("dlp_policy_check_age_seconds", "Seconds since the last successful check of the DLP policy document")
+log_records_dropped = metrics.Gauge("dlp_log_records_dropped", "Log records not written since the start", ["reason"])
+zip_findings_total = metrics.Counter("dlp_zip_findings_total", "Risky structures found in ZIP based files", ["finding"])
+zip_inspect_bytes = metrics.Histogram("dlp_zip_inspect_bytes", "Bytes read by a ZIP structure inspection",
+    buckets = (1024, 4096, 16384, 65536, 262144, 1048576))
+
+class AccessTokenAbs:
     """
     Store Access Token with a real timestamp.
     
@@ -204,12 +373,15 @@ class AccessTokenAbs(AccessToken):
     Note that Refresh Token expiration is not important. As long as it's being used
     to generate new Access Tokens, its validity is extended even beyond the original expiration date.
     
+    Holds the same data as webexteamssdk AccessToken, but doesn't need the SDK,
+    so that loading the stored tokens doesn't import it.
+    
     Attributes:
         expires_at (float): When the access token expires
         refresh_token_expires_at (float): When the refresh token expires.
     """
     def __init__(self, access_token_json):
-        super().__init__(access_token_json)
+        self._json_data = dict(json.loads(access_token_json) if isinstance(access_token_json, str) else access_token_json)
         if not "expires_at" in self._json_data.keys():
             self._json_data["expires_at"] = str((datetime.now(timezone.utc) + timedelta(seconds = self.expires_in)).timestamp())
         logger.debug("Access Token expires in: {}s, at: {}".format(self.expires_in, datetime.fromtimestamp(float(self.expires_at))))
@@ -223,6 +395,26 @@ class AccessTokenAbs(AccessToken):
         tr["refresh_token_expires_at"] = str(datetime.fromtimestamp(float(tr["refresh_token_expires_at"])))
         return json.dumps(tr)
         
+    @property
+    def access_token(self):
+        return self._json_data.get("access_token")
+        
+    @property
+    def expires_in(self):
+        return self._json_data.get("expires_in")
+        
+    @property
+    def refresh_token(self):
+        return self._json_data.get("refresh_token")
+        
+    @property
+    def refresh_token_expires_in(self):
+        return self._json_data.get("refresh_token_expires_in")
+        
+    @property
+    def json_data(self):
+        return dict(self._json_data)
+        
     @property
     def expires_at(self):
         return self._json_data["expires_at"]
@@ -242,30 +434,64 @@ class AccessTokenAbs(AccessToken):
 
         return tr
         
+boto3_session = None
+boto3_clients = {} # (service, region, endpoint URL) -> client
+boto3_clients_lock = threading.Lock()
+
 def get_boto3_client(service):
     """
-    Initialize Boto3 client.
+    Get Boto3 client.
+    
+    Creating a client loads the service model and resolves the endpoint, which is slow.
+    Clients are thread-safe, so they are created once per service, region and endpoint
+    and reused, also by the next invocations of a warm Lambda container. Boto3 sessions
+    are not thread-safe, the client creation is serialized. Boto3 is imported by the first
+    call, not by the application import.
     """
-    boto3.setup_default_session(profile_name=AWS_PROFILE)
     # logger.info(f"AWS region: {AWS_REGION}, URL: {ENDPOINT_URL}, service: {service}")
     # aws_key_id = os.getenv("AWS_S3_KEY_ID")
     # aws_key = os.getenv("AWS_S3_SECRET_KEY")
     # logger.info(f"AWS keys: {aws_key_id}  {aws_key}")
-    try:
-        if ENDPOINT_URL:
-            boto_client = boto3.client(service, region_name=AWS_REGION, endpoint_url=ENDPOINT_URL)
-        else:
-            # boto_resource = boto3.resource(service)
-            # aws_id = os.getenv("AWS_ACCESS_KEY_ID")
-            # aws_key = os.getenv("AWS_SECRET_ACCESS_KEY")
-            # aws_token = os.getenv("AWS_SESSION_TOKEN")
-            # logger.info(f"runtime id: {aws_id}, key: {aws_key}, token: {aws_token}")
-            boto_client = boto3.client(service)
-    except Exception as e:
-        logger.exception(f'Error while creating Boto client: {e}')
-        raise e
-    else:
+    region = AWS_REGION if ENDPOINT_URL else None
+    client_key = (service, region, ENDPOINT_URL)
+    boto_client = boto3_clients.get(client_key)
+    if boto_client:
+        return boto_client
+        
+    global boto3_session
+    with boto3_clients_lock:
+        boto_client = boto3_clients.get(client_key)
+        if boto_client:
+            return boto_client
+        try:
+            import boto3, botocore.config
+            
+            if boto3_session is None:
+                boto3_session = boto3.session.Session(profile_name=AWS_PROFILE)
+            config = botocore.config.Config(max_pool_connections=BOTO_POOL_SIZE)
+            if ENDPOINT_URL:
+                boto_client = boto3_session.client(service, region_name=region, endpoint_url=ENDPOINT_URL, config=config)
+            else:
+                # aws_id = os.getenv("AWS_ACCESS_KEY_ID")
+                # aws_key = os.getenv("AWS_SECRET_ACCESS_KEY")
+                # aws_token = os.getenv("AWS_SESSION_TOKEN")
+                # logger.info(f"runtime id: {aws_id}, key: {aws_key}, token: {aws_token}")
+                boto_client = boto3_session.client(service, config=config)
+        except Exception as e:
+            logger.exception(f'Error while creating Boto client: {e}')
+            raise e
+        boto3_clients[client_key] = boto_client
         return boto_client
+        
+def reset_boto3_clients():
+    """
+    Drop the cached Boto3 session and clients, for example after the AWS configuration change or in tests.
+    """
+    global boto3_session
+    
+    with boto3_clients_lock:
+        boto3_clients.clear()
+        boto3_session = None
 
 def create_bucket(bucket_name):
     """
@@ -275,11 +501,12 @@ def create_bucket(bucket_name):
     # session = boto3.Session()
     # # ddb = session.resource('dynamodb')
     # s3 = session.client('s3')
+    from botocore.exceptions import ClientError
+    
     try:
-        s3_resource = boto3.resource('s3')
         s3_client = get_boto3_client('s3')
         try:
-            s3_resource.meta.client.head_bucket(Bucket=bucket_name)
+            s3_client.head_bucket(Bucket=bucket_name)
             logger.info(f"Bucket \"{bucket_name}\" already exists")
         except ClientError:
             logger.info(f"Creating bucket \"{bucket_name}\"...")
@@ -305,7 +532,8 @@ def save_tokens(token_key, tokens):
     token_record = tokens.token_record
     file_destination = get_webex_token_file(token_key)
     logger.debug("Saving Webex tokens to: {}:{}".format(s3_client, file_destination))
-    s3_client.put_object(Body=json.dumps(token_record), Bucket=S3_BUCKET, Key=file_destination)
+    response = s3_client.put_object(Body=json.dumps(token_record), Bucket=S3_BUCKET, Key=file_destination)
+    webex_client_cache.store(token_key, tokens, response.get("ETag"))
 
     token_refreshed = True # indicate to the main loop that the Webex token has been refreshed
     
@@ -322,17 +550,43 @@ def get_tokens_for_key(token_key):
     Returns:
         AccessTokenAbs: Access & Refresh Token object or None
     """
+    return load_tokens(token_key)[0]
+    
+def load_tokens(token_key, etag = None):
+    """
+    Load tokens if they changed.
+    
+    The tokens are read by a conditional GET, if their ETag matches,
+    S3 responds just 304 Not Modified.
+    
+    Parameters:
+        token_key (str): A key to the storage of the token
+        etag (str): ETag of the tokens already loaded, None to load them anyway
+        
+    Returns:
+        tuple: (AccessTokenAbs, ETag), (None, etag) if not modified, (None, None) if not available
+    """
+    from botocore.exceptions import ClientError
+    
     try:
         file_source = get_webex_token_file(token_key)
         s3_client = get_boto3_client('s3')
         logger.debug("Loading Webex tokens from: {}:{}".format(s3_client, file_source))
-        result = s3_client.get_object(Bucket=S3_BUCKET, Key=file_source)
+        if etag:
+            result = s3_client.get_object(Bucket=S3_BUCKET, Key=file_source, IfNoneMatch=etag)
+        else:
+            result = s3_client.get_object(Bucket=S3_BUCKET, Key=file_source)
         token_data = json.loads(result["Body"].read().decode())
         tokens = AccessTokenAbs(token_data)
-        return tokens
+        return tokens, result.get("ETag")
+    except ClientError as e:
+        if etag and e.response.get("Error", {}).get("Code") in ("304", "NotModified"):
+            return None, etag
+        logger.info("Webex token load exception: {}".format(e))
+        return None, None
     except Exception as e:
         logger.info("Webex token load exception: {}".format(e))
-        return None
+        return None, None
 
     """
     db_tokens = ddb.get_db_record(token_key, "TOKENS")
@@ -348,7 +602,7 @@ def get_tokens_for_key(token_key):
         return None
     """
 
-def refresh_tokens_for_key(token_key):
+def refresh_tokens_for_key(token_key, tokens=None):
     """
     Run the Webex 'get new token by using refresh token' operation.
     
@@ -358,40 +612,386 @@ def refresh_tokens_for_key(token_key):
     
     Parameters:
         token_key (str): A key to the storage of the token
+        tokens (AccessTokenAbs): current tokens, loaded from the storage if not provided
         
     Returns:
         str: message indicating the result of the operation
     """
-    tokens = get_tokens_for_key(token_key)
+    if tokens is None:
+        tokens = get_tokens_for_key(token_key)
     client_id = os.getenv("WEBEX_INTEGRATION_CLIENT_ID")
     client_secret = os.getenv("WEBEX_INTEGRATION_CLIENT_SECRET")
-    integration_api = WebexTeamsAPI(access_token="12345")
+    from webexteamssdk import WebexTeamsAPI, ApiError
+    
+    integration_api = WebexTeamsAPI(access_token="12345", base_url=WEBEX_API_URL)
     try:
-        new_tokens = AccessTokenAbs(integration_api.access_tokens.refresh(client_id, client_secret, tokens.refresh_token).json_data)
-        save_tokens(token_key, new_tokens)
+        with stage_seconds.time(stage = "token_refresh"):
+            new_tokens = AccessTokenAbs(integration_api.access_tokens.refresh(client_id, client_secret, tokens.refresh_token).json_data)
+            save_tokens(token_key, new_tokens)
         logger.info("Tokens refreshed for key {}".format(token_key))
     except ApiError as e:
+        errors_total.inc(kind = "token_refresh")
         logger.error("Client Id and Secret loading error: {}".format(e))
         return "Error refreshing an access token. Client Id and Secret loading error: {}".format(e)
         
     return "Tokens refreshed for {}".format(token_key)
     
-def get_webex_client():
-    tokens = get_tokens_for_key(wxt_token_key)
-    if not tokens:
-        return None
+class WebexClientCache:
+    """
+    Process-wide cache of Webex tokens and API clients.
+    
+    Tokens are loaded from S3 once per token lifetime instead of once per webhook.
+    The cached client is reused until the Access Token gets within SAFE_TOKEN_DELTA
+    of its expiration. Only one thread loads or refreshes the tokens for a key,
+    other threads wait for its result (single-flight).
+    
+    With a refresher, the tokens are renewed by its background thread. A request
+    which finds the tokens about to expire keeps using them and asks the refresher
+    to hurry, so it never waits for the OAuth call.
+    
+    Attributes:
+        safe_delta (int): seconds before the token expiration when the tokens are renewed
+        retry_interval (int): seconds before a failed refresh is attempted again
+        refresher (TokenRefresher): background refresher, None to refresh by the requests
+    """
+    def __init__(self, safe_delta=SAFE_TOKEN_DELTA, retry_interval=TOKEN_REFRESH_RETRY, refresher=None):
+        self.safe_delta = safe_delta
+        self.retry_interval = retry_interval
+        self.refresher = refresher
+        self._lock = threading.Lock()
+        self._entries = {} # token_key -> {"tokens", "client", "valid_until"}
+        self._inflight = {} # token_key -> threading.Event of the running load/refresh
+        
+    def _valid_entry(self, token_key):
+        entry = self._entries.get(token_key)
+        if entry and time.time() < entry["valid_until"]:
+            return entry
+            
+    def store(self, token_key, tokens, etag=None):
+        """
+        Cache new tokens, the client for them is created by the first get_client().
+        
+        Parameters:
+            token_key (str): A key to the storage of the token
+            tokens (AccessTokenAbs): Access & Refresh Token object
+            etag (str): ETag of the stored tokens, used to check if they changed
+        """
+        with self._lock:
+            self._entries[token_key] = {
+                "tokens": tokens,
+                "client": None,
+                "valid_until": float(tokens.expires_at) - self.safe_delta,
+                "etag": etag
+            }
+        if self.refresher:
+            self.refresher.schedule(token_key, float(tokens.expires_at))
+            
+    def invalidate(self, token_key):
+        """
+        Drop the cached tokens, next request loads them from the storage.
+        """
+        with self._lock:
+            self._entries.pop(token_key, None)
+            
+    def peek(self, token_key):
+        """
+        Get cached tokens without loading or refreshing them.
+        
+        Returns:
+            AccessTokenAbs: Access & Refresh Token object or None if not cached or about to expire
+        """
+        entry = self._valid_entry(token_key)
+        return entry["tokens"] if entry else None
+        
+    def etag(self, token_key):
+        """
+        Returns:
+            str: ETag of the cached tokens, None if not known
+        """
+        entry = self._entries.get(token_key)
+        return entry["etag"] if entry else None
+        
+    def expires_at(self, token_key):
+        """
+        Returns:
+            float: expiration of the cached Access Token, None if not cached
+        """
+        entry = self._entries.get(token_key)
+        return float(entry["tokens"].expires_at) if entry else None
+        
+    def get_tokens(self, token_key):
+        """
+        Get cached tokens, load or refresh them if needed.
+        
+        Returns:
+            AccessTokenAbs: Access & Refresh Token object or None
+        """
+        entry = self._get_entry(token_key)
+        return entry["tokens"] if entry else None
+        
+    def get_client(self, token_key):
+        """
+        Get cached Webex client, load or refresh the tokens if needed.
+        
+        Returns:
+            WebexTeamsAPI: Webex client or None
+        """
+        entry = self._get_entry(token_key)
+        if not entry:
+            return None
+        if entry["client"] is None:
+            # the file inspection doesn't use the client, the SDK is imported only for the webhook management
+            from webexteamssdk import WebexTeamsAPI
+            
+            # rate limits are handled by call_webex_api(), the client mustn't sleep on them
+            entry["client"] = WebexTeamsAPI(access_token = entry["tokens"].access_token, base_url = WEBEX_API_URL, wait_on_rate_limit = False)
+        return entry["client"]
+        
+    def _get_entry(self, token_key):
+        entry = self._valid_entry(token_key)
+        if entry:
+            return entry
+            
+        with self._lock:
+            entry = self._valid_entry(token_key)
+            if entry:
+                return entry
+            event = self._inflight.get(token_key)
+            leader = event is None
+            if leader:
+                event = self._inflight[token_key] = threading.Event()
+                
+        if leader:
+            try:
+                with stage_seconds.time(stage = "token_load"):
+                    self._load(token_key)
+            finally:
+                with self._lock:
+                    del self._inflight[token_key]
+                event.set()
+        else:
+            event.wait()
+            
+        return self._entries.get(token_key)
         
-    token_delta = datetime.fromtimestamp(float(tokens.expires_at)) - datetime.utcnow()
-    if token_delta.total_seconds() < SAFE_TOKEN_DELTA:
-        logger.info("Access token is about to expire, renewing...")
-        refresh_tokens_for_key(wxt_token_key)
-        tokens = get_tokens_for_key(wxt_token_key)
+    def _load(self, token_key):
+        tokens, etag = load_tokens(token_key)
+        if not tokens:
+            self.invalidate(token_key)
+            return
+            
+        now = time.time()
+        if float(tokens.expires_at) <= now and self.refresher:
+            logger.error("Access token for {} expired, waiting for the background refresh".format(token_key))
+            self.invalidate(token_key)
+            self.refresher.refresh_soon(token_key)
+        elif float(tokens.expires_at) - now < self.safe_delta:
+            if self.refresher:
+                logger.info("Access token is about to expire, background refresh requested")
+                self.refresher.refresh_soon(token_key)
+            else:
+                with token_lease.hold(token_key) as elected:
+                    if elected:
+                        logger.info("Access token is about to expire, renewing...")
+                        # save_tokens() stores the new tokens in the cache
+                        refresh_tokens_for_key(token_key, tokens)
+                        entry = self._entries.get(token_key)
+                        if entry and float(entry["tokens"].expires_at) > float(tokens.expires_at):
+                            return
+                        logger.warning(f"Token refresh failed, using the current token for {self.retry_interval}s")
+                    else:
+                        logger.info(f"Tokens being refreshed by another process, using the current token for {self.retry_interval}s")
+            self.store(token_key, tokens, etag)
+            with self._lock:
+                entry = self._entries.get(token_key)
+                if entry:
+                    entry["valid_until"] = min(now + self.retry_interval, float(tokens.expires_at))
+        else:
+            self.store(token_key, tokens, etag)
+            
+def refresh_in_background(token_key):
+    """
+    Check and renew the tokens of a key, called by the token_refresher thread.
     
-    try:
-        client = WebexTeamsAPI(access_token = tokens.access_token)
-        return client
-    except ApiError as e:
-        logger.error(f"Error creating Webex client: {e}")
+    The stored tokens are checked by their ETag first, if they were renewed
+    by another process, they are only cached. Of several processes only the one
+    holding the token lease refreshes the tokens, the others defer and pick up
+    the new tokens at the next check.
+    
+    Returns:
+        bool: True if the cached tokens are valid or renewed, False if the refresh failed,
+        None if another process is refreshing them
+    """
+    tokens, etag = load_tokens(token_key, webex_client_cache.etag(token_key))
+    if tokens:
+        webex_client_cache.store(token_key, tokens, etag)
+    expires_at = webex_client_cache.expires_at(token_key)
+    if expires_at is None:
+        logger.error("No tokens to refresh for {}".format(token_key))
+        return False
+    if expires_at - time.time() > TOKEN_REFRESH_AHEAD:
+        return True
+        
+    with token_lease.hold(token_key) as elected:
+        if not elected:
+            logger.info("Tokens for {} are being refreshed by another process".format(token_key))
+            return None
+        # the previous lease holder may have just saved new tokens
+        tokens, etag = load_tokens(token_key)
+        if not tokens:
+            return False
+        if float(tokens.expires_at) - time.time() > TOKEN_REFRESH_AHEAD:
+            webex_client_cache.store(token_key, tokens, etag)
+            return True
+        # save_tokens() stores the new tokens in the cache and schedules their refresh
+        refresh_tokens_for_key(token_key, tokens)
+        expires_at = webex_client_cache.expires_at(token_key)
+        return expires_at is not None and expires_at > float(tokens.expires_at)
+        
+def create_token_lease(kind):
+    """
+    Create the lease electing the process which refreshes the tokens, see TOKEN_LEASE.
+    """
+    if kind == "s3":
+        return S3Lease(lambda: get_boto3_client('s3'), S3_BUCKET, STORAGE_PATH, TOKEN_LEASE_TTL)
+    if kind == "file":
+        try:
+            return FileLease(TOKEN_LEASE_DIR)
+        except (ImportError, OSError) as e:
+            logger.error("File lease not available, tokens are refreshed without election: {}".format(e))
+    return Lease()
+    
+def start_token_refresher():
+    """
+    Schedule the refresh of the tokens known at startup, other organizations
+    are scheduled when their tokens are first loaded.
+    """
+    if token_refresher and not MULTI_ORG:
+        token_refresher.schedule(wxt_token_key, None)
+        
+def update_token_metrics():
+    if not token_refresher:
+        return
+    now = time.time()
+    for token_key, status in token_refresher.status().items():
+        token_refresh_due_seconds.set(status.next_refresh_at - now, token = token_key)
+        if status.expires_at is not None:
+            token_expires_seconds.set(status.expires_at - now, token = token_key)
+        if status.last_success is not None:
+            token_refresh_success.set(1 if status.last_success else 0, token = token_key)
+            
+token_lease = create_token_lease(TOKEN_LEASE)
+token_refresher = TokenRefresher(refresh_in_background, TOKEN_REFRESH_AHEAD, TOKEN_REFRESH_RETRY, TOKEN_REFRESH_RETRY_MAX,
+    check_interval = TOKEN_CHECK_INTERVAL) if TOKEN_REFRESHER else None
+webex_client_cache = WebexClientCache(refresher = token_refresher)
+
+def get_webex_client(token_key = wxt_token_key):
+    return webex_client_cache.get_client(token_key)
+    
+def get_token_key(webhook):
+    """
+    Get the key of the tokens authorized for the webhook's organization.
+    
+    Returns:
+        str: token key, None if MULTI_ORG is set and the webhook has no valid orgId
+    """
+    if not MULTI_ORG:
+        return wxt_token_key
+    org_id = webhook.get("orgId")
+    if isinstance(org_id, str) and ORG_ID_RE.match(org_id):
+        return org_id
+        
+def get_authorized_token_key(tokens):
+    """
+    Get the key for newly issued tokens, in MULTI_ORG mode it's the organization of the authorizing user.
+    """
+    if not MULTI_ORG:
+        return wxt_token_key
+    from webexteamssdk import WebexTeamsAPI
+    
+    return WebexTeamsAPI(access_token = tokens.access_token, base_url = WEBEX_API_URL).people.me().orgId
+    
+def get_file_session(token_key):
+    """
+    Get the HTTP session of an organization.
+    
+    Each organization has its own connection pool, so that slow file hosts
+    or a burst of files of one organization don't use up the connections of others.
+    """
+    session = org_sessions.get(token_key)
+    if session is None:
+        with org_sessions_lock:
+            session = org_sessions.get(token_key)
+            if session is None:
+                session = org_sessions[token_key] = WebexFileSession(limiter = default_limiter(count_rate_limited))
+    return session
+    
+def count_rate_limited(call_class):
+    rate_limited_total.inc(call = call_class)
+    
+def call_webex_api(token_key, api_call):
+    """
+    Call the Webex API through the rate limiter of an organization.
+    
+    The webhook management shares the limits with the file requests of the same
+    Access Token, but it has the lowest priority. A 429 response is retried
+    after its Retry-After up to RATE_LIMIT_RETRIES times.
+    
+    Parameters:
+        token_key (str): key of the tokens used by the call
+        api_call (callable): function making the call, it must consume any paginated result
+        
+    Returns:
+        result of the api_call
+    """
+    from webexteamssdk import ApiError, RateLimitError
+    
+    limiter = get_file_session(token_key).limiter
+    if not limiter:
+        return api_call()
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        if not limiter.acquire(WEBHOOKS, RATE_LIMIT_MAX_WAIT):
+            raise RateLimitTimeout("Webex API call not admitted in {}s".format(RATE_LIMIT_MAX_WAIT))
+        status, retry_after = None, None
+        try:
+            result = api_call()
+            status = 200
+            return result
+        except RateLimitError as e:
+            status, retry_after = 429, e.retry_after
+            if attempt == RATE_LIMIT_RETRIES:
+                raise
+        except ApiError as e:
+            status = e.response.status_code
+            raise
+        finally:
+            limiter.release(WEBHOOKS, status, retry_after)
+            
+def update_rate_limit_metrics():
+    for token_key, session in list(org_sessions.items()):
+        if session.limiter:
+            rate_limit_window.set(session.limiter.window, token = token_key)
+    
+def update_log_metrics():
+    if log_writer:
+        log_records_dropped.set(log_writer.dropped, reason = "queue_full")
+    if file_log_limit:
+        log_records_dropped.set(file_log_limit.suppressed, reason = "rate_limit")
+    
+def get_org_session(token_key):
+    """
+    Get the HTTP session of an organization bound to its current Access Token.
+    
+    Returns:
+        WebexFileSession: session or None if there are no valid tokens
+    """
+    with stage_seconds.time(stage = "token"):
+        tokens = webex_client_cache.get_tokens(token_key)
+    if not tokens:
+        return None
+    session = get_file_session(token_key)
+    session.bind_token(tokens.access_token)
+    return session
             
 def secure_scheme(scheme):
     return re.sub(r"^http$", "https", scheme)
@@ -405,6 +1005,9 @@ def secure_scheme(scheme):
 @flask_app.before_first_request
 def startup():
     logger.debug("Startup...")
+    start_background_threads()
+    if FAST_START:
+        return # the bucket is created at deploy time by --create-bucket
     logger.info(f"Creating S3 bucket \"{S3_BUCKET}\"")
     create_bucket(S3_BUCKET)
 
@@ -418,18 +1021,29 @@ def authdone():
     
     Used to hide the OAuth response URL parameters.
     """
-    webex_client = get_webex_client()
+    myUrlParts = urlparse(request.url)
+    logger.debug(f"URL parts: {myUrlParts}")
+    webhook_url = secure_scheme(myUrlParts.scheme) + "://" + myUrlParts.netloc + url_for("spark_webhook")
+    token_key = get_token_key({"orgId": request.args.get("org")})
+    if not token_key:
+        return "Missing organization."
+    return register_webhook(webhook_url, token_key)
+    
+def register_webhook(webhook_url, token_key = wxt_token_key):
+    """
+    Create the webhook using the authorized Webex client.
+    
+    Parameters:
+        webhook_url (str): target URL of the webhook
+        token_key (str): key of the authorized tokens
+        
+    Returns:
+        str: message for the user
+    """
+    webex_client = get_webex_client(token_key)
     if webex_client:
-        webhooks = webex_client.webhooks.list()
-        logger.info("Existing webhooks:")
-        for wh in webhooks:
-            logger.info(wh)
-            
-        myUrlParts = urlparse(request.url)
-        logger.debug(f"URL parts: {myUrlParts}")
-        webhook_url = secure_scheme(myUrlParts.scheme) + "://" + myUrlParts.netloc + url_for("spark_webhook")
         logger.info("New webhook URL: {}".format(webhook_url))
-        if create_webhook(webex_client, webhook_url):
+        if create_webhook(webex_client, webhook_url, token_key):
             logger.info("Webhook created")
             return "Thank you for providing the authorization. You may close this browser window."
         else:
@@ -437,14 +1051,16 @@ def authdone():
     else:
         return "Webex client creation failed. Check the application log."
 
-def create_webhook(webex_api, target_url):
+def create_webhook(webex_api, target_url, token_key = wxt_token_key):
     """create a set of webhooks for the Bot
     webhooks are defined according to the resource_events dict
     
     arguments:
     target_url -- full URL to be set for the webhook
+    token_key -- key of the tokens used by webex_api, selects the rate limiter
     """    
     logger.debug("Create new webhook to URL: {}".format(target_url))
+    from webexteamssdk import ApiError
     
     resource_events = {
         "messages": ["created"],
@@ -452,27 +1068,30 @@ def create_webhook(webex_api, target_url):
     status = None
         
     try:
-        check_webhook = webex_api.webhooks.list()
+        check_webhook = call_webex_api(token_key, lambda: list(webex_api.webhooks.list()))
+        logger.info("Existing webhooks:")
+        for webhook in check_webhook:
+            logger.info(webhook)
         for webhook in check_webhook:
             int_id = os.getenv("WEBEX_INTEGRATION_ID")
             if webhook.appId == int_id:
                 logger.debug("Deleting webhook {}, '{}', target URL: {}".format(webhook.id, webhook.name, webhook.targetUrl))
                 try:
                     if not flask_app.testing:
-                        webex_api.webhooks.delete(webhook.id)
-                except ApiError as e:
+                        call_webex_api(token_key, lambda: webex_api.webhooks.delete(webhook.id))
+                except (ApiError, RateLimitTimeout) as e:
                     logger.error("Webhook {} delete failed: {}.".format(webhook.id, e))
-    except ApiError as e:
+    except (ApiError, RateLimitTimeout) as e:
         logger.error("Webhook list failed: {}.".format(e))
         
     for resource, events in resource_events.items():
         for event in events:
             try:
                 if not flask_app.testing:
-                    wh = webex_api.webhooks.create(name="Webhook for event \"{}\" on resource \"{}\"".format(event, resource), targetUrl=target_url, resource=resource, event=event, ownedBy="org")
+                    wh = call_webex_api(token_key, lambda: webex_api.webhooks.create(name="Webhook for event \"{}\" on resource \"{}\"".format(event, resource), targetUrl=target_url, resource=resource, event=event, ownedBy="org"))
                 status = True
                 logger.debug("Webhook for {}/{} was successfully created: {}".format(resource, event, wh.id))
-            except ApiError as e:
+            except (ApiError, RateLimitTimeout) as e:
                 logger.error("Webhook create failed: {}.".format(e))
             
     return status
@@ -491,15 +1110,23 @@ def authorize():
         full_redirect_uri = secure_scheme(myUrlParts.scheme) + "://" + myUrlParts.netloc + url_for("manager")
     logger.info("Authorize redirect URL: {}".format(full_redirect_uri))
 
+    return redirect(get_authorize_url(full_redirect_uri))
+    
+def get_authorize_url(full_redirect_uri):
+    """
+    Build the Webex OAuth authorization URL.
+    
+    Parameters:
+        full_redirect_uri (str): URL of the "/manager" endpoint
+    """
     client_id = os.getenv("WEBEX_INTEGRATION_CLIENT_ID")
     redirect_uri = quote(full_redirect_uri, safe="")
     scope = FILES_COMPLIANCE_SCOPE + DEFAULT_SCOPE    
     scope_uri = quote(" ".join(scope), safe="")
     logger.info(f"Requested scope: {scope}")
     
-    join_url = webex_api.base_url+"authorize?client_id={}&response_type=code&redirect_uri={}&scope={}&state={}".format(client_id, redirect_uri, scope_uri, STATE_CHECK)
-
-    return redirect(join_url)
+    join_url = WEBEX_API_URL+"authorize?client_id={}&response_type=code&redirect_uri={}&scope={}&state={}".format(client_id, redirect_uri, scope_uri, STATE_CHECK)
+    return join_url
     
 @flask_app.route("/manager", methods=["GET"])
 def manager():
@@ -526,18 +1153,43 @@ def manager():
         full_redirect_uri = secure_scheme(myUrlParts.scheme) + "://" + myUrlParts.netloc + url_for("manager")
     logger.debug("Manager redirect URI: {}".format(full_redirect_uri))
     
+    token_key, error = issue_tokens(input_code, full_redirect_uri)
+    if error:
+        return error
+        
+    # hide the original redirect URL and its parameters from the user's browser
+    return redirect(get_authdone_path(token_key))
+    
+def get_authdone_path(token_key):
+    """
+    Path of the authdone page, in MULTI_ORG mode it carries the authorized organization.
+    """
+    if MULTI_ORG:
+        return url_for("authdone", org = token_key)
+    return url_for("authdone")
+    
+def issue_tokens(input_code, full_redirect_uri):
+    """
+    Get access and refresh tokens for the OAuth grant flow code and save them.
+    
+    Returns:
+        tuple: (token key, None) or (None, error message)
+    """
+    from webexteamssdk import WebexTeamsAPI, ApiError
+    
     try:
         client_id = os.getenv("WEBEX_INTEGRATION_CLIENT_ID")
         client_secret = os.getenv("WEBEX_INTEGRATION_CLIENT_SECRET")
+        webex_api = WebexTeamsAPI(access_token="12345", base_url=WEBEX_API_URL)
         tokens = AccessTokenAbs(webex_api.access_tokens.get(client_id, client_secret, input_code, full_redirect_uri).json_data)
         logger.debug(f"Access info: {tokens}")
-        save_tokens(wxt_token_key, tokens)
+        token_key = get_authorized_token_key(tokens)
+        save_tokens(token_key, tokens)
+        logger.info("Tokens saved for key {}".format(token_key))
+        return token_key, None
     except ApiError as e:
         logger.error("Client Id and Secret loading error: {}".format(e))
-        return "Error issuing an access token. Client Id and Secret loading error: {}".format(e)
-        
-    # hide the original redirect URL and its parameters from the user's browser
-    return redirect(url_for("authdone"))
+        return None, "Error issuing an access token. Client Id and Secret loading error: {}".format(e)
     
 """
 Bot setup. Used mainly for webhook creation and gathering a dynamic Bot URL.
@@ -546,13 +1198,724 @@ Bot setup. Used mainly for webhook creation and gathering a dynamic Bot URL.
 @flask_app.route("/", methods=["GET", "POST"])
 def spark_webhook():
     if request.method == "POST":
+        received_at = time.monotonic()
         webhook = request.get_json(silent=True)
-        logger.debug("Webhook received: {}".format(webhook))
-        handle_webhook_event(webhook)        
+        logger.debug("Webhook received: %s", webhook)
+        capture_webhook(webhook)
+        if not is_valid_webhook(webhook):
+            logger.error("Invalid webhook payload")
+            webhooks_total.inc(outcome = "invalid")
+            return make_response("Invalid webhook", 400)
+        event_key = get_event_key(webhook)
+        if event_key and not seen_events.add(event_key):
+            logger.info("Duplicate webhook event %s ignored", event_key)
+            webhooks_total.inc(outcome = "duplicate")
+            return "OK"
+        webhooks_total.inc(outcome = "accepted")
+        token_key = get_token_key(webhook)
+        org_overflow = file_scheduler.pending(token_key) >= ORG_QUEUE_LIMIT
+        if org_overflow:
+            logger.warning("Too many files of {} waiting for inspection".format(token_key))
+        if webhook_spool:
+            # once the webhooks overflow to the spool, the next ones follow them to keep the order
+            accepted = not (org_overflow or is_overflowing()) and enqueue_webhook(webhook, received_at)
+            if not accepted:
+                accepted = spool_webhook(webhook, received_at)
+        elif org_overflow:
+            accepted = False
+        elif WEBHOOK_ASYNC:
+            accepted = enqueue_webhook(webhook, received_at)
+            if not accepted:
+                logger.warning("Webhook queue full ({} items)".format(webhook_queue.qsize()))
+        else:
+            handle_webhook_event(webhook, received_at)
+            accepted = True
+        if not accepted:
+            errors_total.inc(kind = "queue_full")
+            if WEBHOOK_QUEUE_FULL_ACTION == "default_verdict":
+                send_default_verdicts(webhook, received_at = received_at)
+            else:
+                forget_event(webhook) # accept the redelivery
+                response = make_response("Busy", 503)
+                response.headers["Retry-After"] = str(BUSY_RETRY_AFTER)
+                return response
     elif request.method == "GET":
         pass
     return "OK"
     
+@flask_app.route("/metrics")
+def metrics_endpoint():
+    """
+    Processing metrics in the Prometheus text format.
+    """
+    webhook_queue_depth.set(webhook_queue.qsize())
+    file_queue_depth.set(file_scheduler.pending())
+    if webhook_spool:
+        webhook_spool_depth.set(webhook_spool.backlog())
+    update_token_metrics()
+    update_rate_limit_metrics()
+    update_log_metrics()
+    update_policy_metrics()
+    update_room_cache_metrics()
+    return Response(metrics.REGISTRY.render(), content_type = metrics.CONTENT_TYPE)
+    
+def capture_webhook(webhook):
+    """
+    Add the webhook to the capture if WEBHOOK_CAPTURE_FILE is set.
+    """
+    if webhook_capture and isinstance(webhook, dict) and not webhook_capture.record(webhook):
+        errors_total.inc(kind = "capture")
+        
+def is_valid_webhook(webhook):
+    """
+    Check the webhook payload contains the data needed by handle_webhook_event().
+    """
+    return isinstance(webhook, dict) and isinstance(webhook.get("data"), dict) \
+        and "resource" in webhook and "roomId" in webhook["data"] and get_token_key(webhook) is not None
+        
+def get_event_key(webhook):
+    """
+    Identify the webhook event. Redelivered webhooks have the same key.
+    
+    Returns:
+        tuple: (resource, event, resource id) or None if the resource id is missing
+    """
+    resource_id = webhook["data"].get("id")
+    if resource_id:
+        return (webhook["resource"], webhook.get("event"), resource_id)
+        
+def forget_event(webhook):
+    """
+    Remove the event from the duplicate detection, so that its redelivery is processed.
+    """
+    event_key = get_event_key(webhook)
+    if event_key:
+        seen_events.pop(event_key)
+    
+def get_dlp_files(webhook):
+    """
+    Get URLs of files waiting for the DLP verdict.
+    
+    see https://developer.webex.com/docs/api/guides/webex-real-time-file-dlp-basics
+    
+    Returns:
+        list: file URLs, empty if the webhook doesn't carry any file to inspect
+    """
+    if webhook["resource"] == "messages" and webhook["data"].get("files") and webhook["data"].get("roomType") == "group":
+        return webhook["data"]["files"]
+    return []
+    
+def get_result_url(url, result):
+    """
+    Build the URL for the verdict PUT.
+    
+    Parameters:
+        url (str): file URL
+        result (str): "approve" or "reject"
+    """
+    file_url_parts = urlparse(url)
+    res_params = [("result", result)]
+    return urlunparse((file_url_parts.scheme, file_url_parts.netloc, file_url_parts.path, '', urlencode(res_params), ''))
+    
+"""
+Asynchronous webhook processing. Webhooks are acknowledged immediately
+and processed by a pool of worker threads, the earliest received (and so
+the earliest deadline) first. The workers are daemon threads, unlike
+the thread_executor they don't block the interpreter exit.
+"""
+def start_webhook_workers():
+    global webhook_workers_started
+    
+    with webhook_workers_lock:
+        if webhook_workers_started:
+            return
+        for i in range(WEBHOOK_WORKERS):
+            threading.Thread(target = webhook_worker, name = "webhook_worker_{}".format(i), daemon = True).start()
+        if webhook_spool:
+            threading.Thread(target = spool_drainer, name = "spool_drainer", daemon = True).start()
+            threading.Thread(target = spool_committer, name = "spool_committer", daemon = True).start()
+        webhook_workers_started = True
+        logger.info("Started {} webhook workers".format(WEBHOOK_WORKERS))
+        
+def webhook_worker():
+    while True:
+        received_at, sequence, webhook = webhook_queue.get()
+        stage_seconds.observe(time.monotonic() - received_at, stage = "queue_wait")
+        try:
+            handle_webhook_event(webhook, received_at)
+        except Exception as e:
+            logger.exception("Webhook processing failed: {}".format(e))
+        finally:
+            webhook_queue.task_done()
+            
+def enqueue_webhook(webhook, received_at):
+    """
+    Queue the webhook for processing.
+    
+    Parameters:
+        webhook (dict): webhook payload
+        received_at (float): time.monotonic() of the webhook arrival
+        
+    Returns:
+        bool: False if the queue is full
+    """
+    start_webhook_workers()
+    try:
+        webhook_queue.put_nowait((received_at, next(webhook_sequence), webhook))
+        return True
+    except queue.Full:
+        return False
+        
+"""
+Overflow spool. Webhooks which don't fit the queue are appended to a disk spool
+(only the fields needed for the file inspection), so the memory stays flat during bursts.
+The drainer dispatches them in the arrival order, at most WEBHOOK_SPOOL_INFLIGHT at a time.
+A spooled webhook is committed once all its files have verdicts, after a restart
+the uncommitted ones are dispatched again.
+"""
+def is_overflowing():
+    """
+    Check if a new webhook has to go to the spool.
+    
+    The webhook workers only hand the files to the file_scheduler, so the webhook queue
+    stays short and the backlog builds up in the scheduler. Both count as the overflow.
+    """
+    return WEBHOOK_SPOOL_ALL or webhook_spool.backlog() > 0 or file_scheduler.pending() >= FILE_QUEUE_LIMIT
+    
+def spool_webhook(webhook, received_at):
+    """
+    Append the webhook to the overflow spool.
+    
+    Returns:
+        bool: False if the webhook cannot be stored
+    """
+    start_webhook_workers()
+    files = get_dlp_files(webhook)
+    if not files:
+        return True # nothing to inspect
+    data = webhook["data"]
+    record = {
+        "resource": webhook["resource"],
+        "event": webhook.get("event"),
+        "orgId": webhook.get("orgId"),
+        "id": data.get("id"),
+        "roomId": data["roomId"],
+        "roomType": data.get("roomType"),
+        "files": files,
+        "received": time.time() - (time.monotonic() - received_at) # wall clock time survives a restart
+    }
+    try:
+        webhook_spool.append(json.dumps(record, separators = (",", ":")).encode())
+        return True
+    except OSError as e:
+        logger.error("Webhook spool write failed: {}".format(e))
+        errors_total.inc(kind = "spool")
+        return False
+        
+def restore_webhook(payload):
+    """
+    Rebuild the webhook from its spool record.
+    
+    Returns:
+        tuple: (webhook, received_at as time.monotonic())
+    """
+    record = json.loads(payload)
+    webhook = {"resource": record["resource"], "event": record["event"], "orgId": record["orgId"],
+        "data": {"id": record["id"], "roomId": record["roomId"], "roomType": record["roomType"], "files": record["files"]}}
+    received_at = time.monotonic() - max(0, time.time() - record["received"])
+    return webhook, received_at
+    
+def spool_drainer():
+    while True:
+        entry = webhook_spool.read()
+        if entry is None:
+            continue
+        position, payload = entry
+        verdicts = []
+        try:
+            webhook, received_at = restore_webhook(payload)
+            event_key = get_event_key(webhook)
+            if event_key:
+                seen_events.add(event_key) # ignore a redelivery after a restart
+            stage_seconds.observe(time.monotonic() - received_at, stage = "queue_wait")
+            verdicts = inspect_files(get_dlp_files(webhook), received_at, get_token_key(webhook), event_key,
+                webhook["data"].get("roomId"), webhook.get("orgId"))
+        except Exception as e:
+            logger.exception("Spooled webhook processing failed: {}".format(e))
+        spool_commit_queue.put((position, verdicts)) # blocks if WEBHOOK_SPOOL_INFLIGHT webhooks wait for verdicts
+        
+def spool_committer():
+    while True:
+        position, verdicts = spool_commit_queue.get()
+        wait_for_verdicts(verdicts)
+        try:
+            webhook_spool.commit(position)
+        except OSError as e:
+            logger.error("Webhook spool commit failed: {}".format(e))
+            errors_total.inc(kind = "spool")
+            
+def send_default_verdicts(webhook, result = None, received_at = None):
+    """
+    Send a verdict to all files of the webhook without inspecting them.
+    
+    Parameters:
+        webhook (dict): webhook payload
+        result (str): verdict, fallback_verdict() if not set
+        received_at (float): time.monotonic() of the webhook arrival
+    """
+    files = get_dlp_files(webhook)
+    if not files:
+        return
+    token_key = get_token_key(webhook)
+    session = get_org_session(token_key)
+    if not session:
+        logger.error("No valid Webex token for {}, Webex posts the files as not scanned after its timeout".format(token_key))
+        return
+    for url in files:
+        if url in sent_verdicts:
+            continue
+        file_verdict = FileVerdict(url, received_at, token_key, room_id = webhook["data"].get("roomId"), org_id = webhook.get("orgId"))
+        file_verdict.session = session
+        file_result = result or fallback_verdict(file_verdict)
+        with log_context(**file_verdict.log_ids):
+            file_logger.info("Default verdict \"%s\" for file: %s", file_result, url)
+        file_verdict.send(file_result, "default")
+        
+class FileVerdict:
+    """
+    A file waiting for the DLP verdict.
+    
+    The verdict can be sent either by the inspection or by the deadline fallback,
+    whichever comes first. Only the first one is sent to Webex.
+    
+    Attributes:
+        url (str): file URL from the webhook
+        deadline (float): time.monotonic() by which the verdict must be sent
+        token_key (str): key of the organization's tokens
+        event_key (tuple): webhook event of the file, forgotten if there is no valid token
+        room_id (str): space of the file, selects the "spaces" rules of the policy
+        org_id (str): organization of the webhook, spaces of other owners are external
+        session (WebexFileSession): organization's HTTP session, None if not bound yet
+        content_type (str): Content-Type claimed by the file HEAD, None if not known yet
+        result (str): the verdict sent, None if not decided yet
+        policy_version (str): version of the DLP policy which decided the verdict
+        done (threading.Event): set when the verdict has been sent or cannot be sent
+        log_ids (dict): correlation ids of the file and its event in the log
+    """
+    def __init__(self, url, received_at = None, token_key = wxt_token_key, event_key = None, room_id = None, org_id = None):
+        self.url = url
+        if received_at is None:
+            received_at = time.monotonic()
+        self.deadline = received_at + VERDICT_DEADLINE
+        self.token_key = token_key
+        self.event_key = event_key
+        self.room_id = room_id
+        self.org_id = org_id
+        self.session = None
+        self.content_type = None
+        self.result = None
+        self.policy_version = None
+        self.done = threading.Event()
+        self.log_ids = {"file": short_id(url)}
+        if event_key:
+            self.log_ids["event"] = short_id(event_key)
+        self._lock = threading.Lock()
+        
+    @property
+    def unchecked_url(self):
+        return self.url + ",dlpUnchecked" # dlpRejected, dlpRejectedByDefault
+        
+    def send(self, result, source = "inspection"):
+        """
+        Send the verdict PUT unless a verdict has been already sent.
+        
+        Parameters:
+            result (str): "approve" or "reject"
+            source (str): what decided the verdict, used in metrics
+            
+        Returns:
+            bool: True if this call sent the verdict
+        """
+        with self._lock:
+            if self.result is not None:
+                return False
+            self.result = result
+            
+        res_url = get_result_url(self.url, result)
+        with log_context(**self.log_ids):
+            file_logger.debug("Result URL: %s", res_url)
+            try:
+                session = self.session or get_org_session(self.token_key)
+                if not session:
+                    errors_total.inc(kind = "verdict_put")
+                    logger.error("Verdict for %s failed: no valid Webex token for %s, Webex posts the file as not scanned after its timeout",
+                        self.url, self.token_key)
+                    return True
+                with stage_seconds.time(stage = "verdict_put"):
+                    response = session.put(res_url)
+                if response.ok:
+                    sent_verdicts.put(self.url, result)
+                    file_logger.info("Verdict %s sent for %s, policy %s", result, self.url, self.policy_version)
+                    verdicts_total.inc(result = result, source = source)
+                    verdict_slack_seconds.observe(self.deadline - time.monotonic(), source = source)
+                else:
+                    errors_total.inc(kind = "verdict_put")
+                    logger.error("Verdict for %s failed: %s %s", self.url, response.status_code, response.reason)
+            except Exception as e: # also the token errors of get_org_session()
+                errors_total.inc(kind = "verdict_put")
+                logger.error("Verdict for %s failed: %s", self.url, e)
+            finally:
+                self.done.set()
+        return True
+        
+def zip_structure_ok(url, report):
+    """
+    Record the result of a ZIP structure inspection.
+    
+    Returns:
+        bool: False if the file must be rejected
+    """
+    zip_inspect_bytes.observe(report.bytes_read)
+    for finding in report.findings:
+        zip_findings_total.inc(finding = finding.kind)
+    if report.findings:
+        file_logger.info("ZIP structure of %s: %s", url, ", ".join("{} ({})".format(finding.kind, finding.detail) for finding in report.findings))
+        return False
+    return True
+    
+def fallback_verdict(file_verdict):
+    """
+    Verdict for a file which cannot be inspected in time or whose inspection failed.
+    
+    With DEFAULT_VERDICT "policy", files of a type approved by the MIME policy are approved.
+    The type claimed by the HEAD is used, so a file whose HEAD didn't finish is rejected.
+    No I/O, the current policy is used without checking its document and only a cached space.
+    """
+    policy = get_space_policy(policy_store.current, file_verdict, wait = False)
+    file_verdict.policy_version = policy.version
+    if DEFAULT_VERDICT == "policy":
+        if file_verdict.content_type is not None and policy.mime_policy.decide(file_verdict.content_type) == APPROVE:
+            return APPROVE
+        return REJECT
+    return DEFAULT_VERDICT
+    
+        
+def inspect_file(url, session, file_verdict = None):
+    """
+    Decide the verdict for a file.
+    
+    Parameters:
+        url (str): file URL with the dlpUnchecked parameter
+        session (WebexFileSession): organization's HTTP session
+        file_verdict (FileVerdict): records the claimed file type for the fallback verdict and the policy version
+        
+    Returns:
+        str: "approve" or "reject"
+    """
+    # one policy snapshot for the whole file, even if a new one is loaded meanwhile
+    policy = policy_store.get()
+    with stage_seconds.time(stage = "head"):
+        file_info = session.head(url)
+    content_type = file_info.headers.get("Content-Type", "")
+    content_length = int(file_info.headers.get("Content-Length", 0) or 0)
+    if file_verdict:
+        file_verdict.content_type = content_type
+        # the lookup of a new space was started with the webhook, it ran during the HEAD
+        policy = get_space_policy(policy, file_verdict)
+        file_verdict.policy_version = policy.version
+    file_logger.info("Message file: %s, type: %s, size: %s", url, content_type, content_length)
+    file_logger.debug("File headers: %s", file_info.headers)
+    
+    with stage_seconds.time(stage = "policy"):
+        result = policy.mime_policy.decide(content_type)
+    if result == REJECT:
+        file_logger.debug("File type \"%s\" not permitted", content_type)
+        return result
+        
+    # Content-Type is claimed by the sender's client, check the real type by the file content
+    file_type = normalize_mime_type(content_type)
+    head = b""
+    sniffed_type = None
+    if policy.content_sniff and content_length > 0:
+        with stage_seconds.time(stage = "sniff"):
+            sniffed_type, head = sniff_remote(session, url, min(SNIFF_BYTES, content_length))
+        checked_type = checked_mime_type(file_type, sniffed_type)
+        if checked_type != file_type:
+            file_logger.info("File type \"%s\" detected as \"%s\"", content_type, checked_type)
+            file_type = checked_type
+            result = policy.mime_policy.decide(checked_type)
+            if result == REJECT:
+                file_logger.debug("File type \"%s\" not permitted", checked_type)
+                return result
+                
+    # macros, embedded objects and encryption don't show in the file type, but in the ZIP central directory
+    tail = b""
+    if policy.zip_inspect and content_length > 0 and is_zip_file(file_type, head):
+        with stage_seconds.time(stage = "zip"):
+            report = inspect_zip_remote(session, url, content_length, head, **policy.zip_limits)
+        if not zip_structure_ok(url, report):
+            return REJECT
+        tail = report.tail
+        
+    # look for sensitive data in the file content, only a type confirmed by the content skips the scan
+    if policy.content_scan and content_length > 0 and not (sniffed_type and CONTENT_SCAN_SKIP_RE.match(sniffed_type)):
+        if content_length > CONTENT_SCAN_MAX_BYTES:
+            file_logger.info("File size %s exceeds the content scan limit, not scanned", content_length)
+        else:
+            digest = None
+            if VERDICT_CACHE:
+                with stage_seconds.time(stage = "digest"):
+                    digest = sample_digest(session, url, content_length, file_type, head, tail = tail)
+                cached_result = get_cached_verdict(digest, policy.version)
+                if cached_result:
+                    file_logger.info("Cached verdict for digest %s: %s", digest, cached_result)
+                    return cached_result
+            with stage_seconds.time(stage = "scan"):
+                match, bytes_read = scan_remote(session, url, policy.dlp_rules)
+            if match:
+                file_logger.info("Sensitive data \"%s\" found at offset %s", match.rule, match.offset)
+                result = REJECT
+            if digest and result == REJECT:
+                store_cached_verdict(digest, policy.version, result)
+        
+    return result
+    
+"""
+Content verdict cache, optionally persisted in S3_BUCKET. The verdicts are kept per policy version,
+so a changed policy doesn't use the verdicts of the previous one.
+"""
+def get_cached_verdict(digest, version):
+    load_verdict_cache()
+    return verdict_cache.get(digest, version)
+    
+def store_cached_verdict(digest, version, result):
+    global verdict_cache_saved_at
+    
+    verdict_cache.put(digest, version, result)
+    if VERDICT_CACHE_PERSIST and time.time() - verdict_cache_saved_at > VERDICT_CACHE_SAVE_INTERVAL:
+        verdict_cache_saved_at = time.time()
+        thread_executor.submit(save_verdict_cache)
+        
+def load_verdict_cache():
+    """
+    Load the saved verdicts of the current policy version, only once per process.
+    """
+    global verdict_cache_loaded
+    
+    if verdict_cache_loaded or not VERDICT_CACHE_PERSIST:
+        return
+    with verdict_cache_lock:
+        if verdict_cache_loaded:
+            return
+        try:
+            s3_client = get_boto3_client('s3')
+            result = s3_client.get_object(Bucket=S3_BUCKET, Key=VERDICT_CACHE_FILE)
+            records = json.loads(result["Body"].read().decode())
+            count = verdict_cache.load(records, policy_store.current.version)
+            logger.info("Loaded {} cached verdicts".format(count))
+        except Exception as e:
+            logger.info("Verdict cache load exception: {}".format(e))
+        verdict_cache_loaded = True
+        
+def save_verdict_cache():
+    if not verdict_cache.dirty:
+        return
+    try:
+        verdict_cache.dirty = False
+        records = verdict_cache.records()
+        s3_client = get_boto3_client('s3')
+        s3_client.put_object(Body=json.dumps(records), Bucket=S3_BUCKET, Key=VERDICT_CACHE_FILE)
+        logger.debug("Saved {} cached verdicts".format(len(records)))
+    except Exception as e:
+        verdict_cache.dirty = True
+        logger.error("Verdict cache save exception: {}".format(e))
+        
+"""
+DLP policy, the POLICY_KEY document in S3_BUCKET is checked every POLICY_CHECK_INTERVAL
+by the policy_poller thread (or by a request thread if the poller is not started, e.g. on AWS Lambda).
+"""
+def load_policy_document(etag = None):
+    """
+    Load the policy document if it changed, the PolicyStore 'load' callback.
+    
+    Parameters:
+        etag (str): ETag of the document already seen, None to load it anyway
+        
+    Returns:
+        tuple: (document bytes, ETag), (None, etag) if not modified, (None, None) if there is no document
+    """
+    from botocore.exceptions import ClientError
+    
+    s3_client = get_boto3_client('s3')
+    try:
+        if etag:
+            result = s3_client.get_object(Bucket=S3_BUCKET, Key=POLICY_KEY, IfNoneMatch=etag)
+        else:
+            result = s3_client.get_object(Bucket=S3_BUCKET, Key=POLICY_KEY)
+        return result["Body"].read(), result.get("ETag")
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code")
+        if etag and code in ("304", "NotModified"):
+            return None, etag
+        if code in ("404", "NoSuchKey"):
+            return None, None
+        raise
+        
+def lookup_room(token_key, room_id):
+    """
+    Get the metadata of a space by the Webex API, the RoomCache 'lookup' callback.
+    
+    The call goes through the keep-alive session and the rate limiter of the file requests.
+    
+    Returns:
+        RoomInfo: metadata, None if the space is not found or not accessible
+    """
+    session = get_org_session(token_key)
+    if not session:
+        raise RuntimeError("no valid Webex token for {}".format(token_key))
+    with stage_seconds.time(stage = "room"):
+        response = session.get(WEBEX_API_URL.rstrip("/") + "/rooms/" + quote(room_id, safe = ""))
+    if response.status_code in (403, 404):
+        return None
+    response.raise_for_status()
+    return parse_room(response.json())
+    
+def get_space_policy(policy, file_verdict, wait = True):
+    """
+    Policy of the space of a file, see dlp_policy.resolve_space().
+    
+    The space is looked up only if a rule needs its team or owner, a cached space
+    costs a memory lookup.
+    
+    Parameters:
+        wait (bool): wait up to ROOM_LOOKUP_TIMEOUT for the lookup of a space not cached, otherwise use only the cache
+    """
+    if not policy.spaces or not file_verdict.room_id:
+        return policy
+    room = None
+    if policy.room_lookup:
+        if wait:
+            room = room_cache.get(file_verdict.room_id, file_verdict.token_key, ROOM_LOOKUP_TIMEOUT)
+        else:
+            room = room_cache.peek(file_verdict.room_id)[1]
+    return resolve_space(policy, file_verdict.room_id, room, file_verdict.org_id)
+    
+def prefetch_room(room_id, token_key):
+    """
+    Start the lookup of the space of a webhook, so that it runs while its files wait and get their HEAD.
+    """
+    if room_id and policy_store.current.room_lookup:
+        room_cache.prefetch(room_id, token_key)
+        
+def update_room_cache_metrics():
+    for stat, value in room_cache.stats.items():
+        room_cache_stats.set(value, stat = stat)
+    room_cache_stats.set(len(room_cache), stat = "size")
+    
+def update_policy_metrics():
+    for outcome, count in policy_store.checks.items():
+        policy_checks.set(count, outcome = outcome)
+    if policy_store.checked_at is not None:
+        policy_check_age_seconds.set(time.time() - policy_store.checked_at)
+        
+policy_store = PolicyStore(builtin_policy(), load_policy_document if POLICY_KEY else None, POLICY_CHECK_INTERVAL)
+room_cache = RoomCache(lookup_room, ROOM_CACHE_SIZE, ROOM_CACHE_TTL, ROOM_CACHE_NEGATIVE_TTL, ROOM_CACHE_REFRESH, room_executor)
+
+def inspect_and_send(file_verdict):
+    """
+    Inspect a file and send its verdict as soon as it's decided.
+    
+    Any inspection error results in the fallback verdict, so that a failing file
+    doesn't affect the other files of the message. The log records of the inspection
+    get the correlation ids of the file.
+    """
+    with log_context(**file_verdict.log_ids):
+        source = "inspection"
+        try:
+            # a token refresh or the token storage can fail too, the file gets the fallback verdict
+            file_verdict.session = get_org_session(file_verdict.token_key)
+            if not file_verdict.session:
+                logger.error("No valid Webex token for %s", file_verdict.token_key)
+                errors_total.inc(kind = "token")
+                if file_verdict.event_key:
+                    seen_events.pop(file_verdict.event_key) # accept the redelivery
+                # send() tries to get the token once more, if it fails, the file is left to the Webex timeout
+                file_verdict.send(fallback_verdict(file_verdict), "token")
+                return
+            with files_in_flight.track_inprogress(), stage_seconds.time(stage = "inspect"):
+                result = inspect_file(file_verdict.unchecked_url, file_verdict.session, file_verdict)
+        except Exception as e:
+            logger.error("Inspection of %s failed: %s", file_verdict.url, e)
+            errors_total.inc(kind = "inspection")
+            result = fallback_verdict(file_verdict)
+            source = "error"
+        file_verdict.send(result, source)
+    
+def expire_file(file_verdict):
+    """
+    Send the fallback verdict for a file which missed its deadline.
+    
+    Called by the scheduler watchdog, the PUT is sent from the fallback_executor.
+    The inspection thread keeps running, but its verdict won't be sent.
+    """
+    if file_verdict.result is not None:
+        return
+    with log_context(**file_verdict.log_ids):
+        logger.warning("Inspection of %s missed the deadline", file_verdict.url)
+    errors_total.inc(kind = "deadline")
+    fallback_executor.submit(send_fallback_verdict, file_verdict, "deadline")
+    
+def send_fallback_verdict(file_verdict, source):
+    file_verdict.send(fallback_verdict(file_verdict), source)
+    
+"""
+Files of all messages are inspected earliest deadline first by FILE_INSPECT_WORKERS threads.
+A file which is not decided FALLBACK_MARGIN before its deadline (or within FILE_INSPECT_TIMEOUT
+since its inspection started) gets the fallback verdict. The Access Token is obtained
+by the inspection thread, so a slow token refresh of an organization holds
+at most ORG_FILE_CONCURRENCY threads.
+"""
+file_scheduler = DeadlineScheduler(FILE_INSPECT_WORKERS, run = inspect_and_send, expire = expire_file,
+    run_timeout = FILE_INSPECT_TIMEOUT, name = "file_inspect")
+    
+def inspect_files(files, received_at = None, token_key = wxt_token_key, event_key = None, room_id = None, org_id = None):
+    """
+    Schedule the inspection of the files of a message.
+    
+    At most MESSAGE_FILE_CONCURRENCY files of the message and ORG_FILE_CONCURRENCY
+    files of the organization are inspected at the same time.
+    
+    Parameters:
+        files (list): file URLs
+        received_at (float): time.monotonic() of the webhook arrival, the verdict deadline is counted from it
+        token_key (str): key of the organization's tokens
+        event_key (tuple): webhook event, forgotten if there is no valid token
+        room_id (str): space of the message
+        org_id (str): organization of the webhook
+        
+    Returns:
+        list: FileVerdict objects, use wait_for_verdicts() to wait for the results
+    """
+    verdicts = [FileVerdict(url, received_at, token_key, event_key, room_id, org_id) for url in files]
+    groups = ((object(), MESSAGE_FILE_CONCURRENCY), (token_key, ORG_FILE_CONCURRENCY))
+    for file_verdict in verdicts:
+        previous_result = sent_verdicts.get(file_verdict.url)
+        if previous_result:
+            with log_context(**file_verdict.log_ids):
+                file_logger.info("Verdict for %s already sent: %s", file_verdict.url, previous_result)
+            file_verdict.result = previous_result
+            file_verdict.done.set()
+        else:
+            file_scheduler.submit(file_verdict, file_verdict.deadline - FALLBACK_MARGIN, groups)
+    if any(file_verdict.result is None for file_verdict in verdicts):
+        prefetch_room(room_id, token_key)
+            
+    return verdicts
+    
+def wait_for_verdicts(verdicts):
+    for file_verdict in verdicts:
+        file_verdict.done.wait()
+    
 """
 Main function which handles the webhook events. It reacts both on messages and button&card events
 
@@ -560,7 +1923,7 @@ Look at the 'msg +=' for workflow explanation
 """
 
 # @task
-def handle_webhook_event(webhook):
+def handle_webhook_event(webhook, received_at = None):
     action_list = []
     msg = ""
     attach = []
@@ -570,49 +1933,22 @@ def handle_webhook_event(webhook):
         
 # handle messages with files
     if webhook["resource"] == "messages":
-        webex_api = get_webex_client()
-        if not webex_api:
-            logger.error("Failed to create Webex client")
-            return "No action"
-
         # see https://developer.webex.com/docs/api/guides/webex-real-time-file-dlp-basics
-        if webhook["data"].get("files") and webhook["data"]["roomType"] == "group":
-            hdr = {"Authorization": "Bearer " + webex_api.access_token}
-            for url in webhook["data"]["files"]:
-                url += ",dlpUnchecked" # dlpRejected, dlpRejectedByDefault
-                file_info = requests.head(url, headers = hdr)
-                file_url_parts = urlparse(url)
-                logger.debug(f"File URL parts: {file_url_parts}")
-                logger.info("Message file: {}\ninfo: {}".format(url, file_info.headers))
-                
-                # check for disallowed MIME types
-                """
-                allowed_found = True
-                if file_info.headers["Content-Type"] in SUSPECT_MIME_TYPES:
-                    allowed_found = False
-                """
-                
-                # check for allowed MIME types
-                allowed_found = False
-                content_type = file_info.headers["Content-Type"]
-                for allowed_regex in ALLOWED_MIME_TYPES_REGEX:
-                    if re.match(allowed_regex, content_type):
-                        allowed_found = True
-                        break
-
-                result = "approve"
-                if not allowed_found:
-                    logger.debug(f"File type \"{content_type}\" not permitted")
-                    result = "reject"
-                
-                res_params = [("result", result)]
-                res_url = urlunparse((file_url_parts.scheme, file_url_parts.netloc, file_url_parts.path, '', urlencode(res_params), ''))
-                logger.debug(f"Result URL: {res_url}")
-                requests.put(res_url, headers = hdr)
-                    
+        files = get_dlp_files(webhook)
+        if files:
+            with webhooks_in_flight.track_inprogress():
+                verdicts = inspect_files(files, received_at, get_token_key(webhook), get_event_key(webhook),
+                    webhook["data"].get("roomId"), webhook.get("orgId"))
+                # webhook workers only dispatch the files, otherwise wait for the verdicts before responding
+                if not WEBHOOK_ASYNC:
+                    with stage_seconds.time(stage = "webhook"):
+                        wait_for_verdicts(verdicts)
         
     return json.dumps(action_list)
                 
+if webhook_spool and webhook_spool.pending():
+    start_webhook_workers() # dispatch the webhooks spooled before a restart
+    
 """
 Startup procedure used to initiate @flask_app.before_first_request
 """
@@ -621,6 +1957,29 @@ Startup procedure used to initiate @flask_app.before_first_request
 def startup():
     return "Hello World!"
     
+background_threads_started = False
+background_threads_lock = threading.Lock()
+
+def start_background_threads():
+    """
+    Start the token refresher and the policy poller of this process, once.
+    
+    Called before the first request, so that they run in every worker process
+    of a pre-fork server (gunicorn doesn't run __main__), and by start_runner().
+    The first policy check runs in the thread_executor, the request doesn't wait for S3.
+    """
+    global background_threads_started
+    
+    if background_threads_started:
+        return
+    with background_threads_lock:
+        if background_threads_started:
+            return
+        background_threads_started = True
+    start_token_refresher()
+    if POLICY_POLLER:
+        thread_executor.submit(policy_store.start)
+        
 """
 Independent thread startup, see:
 https://networklore.com/start-task-with-flask/
@@ -635,6 +1994,7 @@ def start_runner():
                 if r.status_code == 200:
                     logger.info('Server started, quiting start_loop')
                     not_started = False
+                    start_background_threads()
                 logger.debug("Status code: {}".format(r.status_code))
             except:
                 logger.info('Server not yet started')
@@ -648,8 +2008,12 @@ if __name__ == "__main__":
     
     parser = argparse.ArgumentParser()
     parser.add_argument('-v', '--verbose', action='count', help="Set logging level by number of -v's, -v=WARN, -vv=INFO, -vvv=DEBUG")
+    parser.add_argument('--create-bucket', action='store_true', help="create S3_BUCKET and exit, run at deploy time with FAST_START")
     
     args = parser.parse_args()
+    if args.create_bucket:
+        create_bucket(S3_BUCKET)
+        sys.exit(0)
     if args.verbose:
         if args.verbose > 2:
             logging.basicConfig(level=logging.DEBUG)
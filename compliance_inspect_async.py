@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+"""Real-time file DLP for Webex example, asyncio server.
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+Serves the same routes as compliance_inspect.py on an aiohttp server. The file
+inspection runs on the event loop with an async HTTP client, so a single process
+can keep thousands of verdicts in flight. Configuration, policy, caches and
+the token storage are shared with compliance_inspect.py. Blocking calls (S3,
+OAuth, webhook management) run in a thread pool.
+
+Requires the aiohttp package, not needed by compliance_inspect.py and left out of requirements.txt:
+    pip install -r requirements-async.txt
+"""
+
+import os
+import time
+import asyncio
+import logging
+import contextlib
+import contextvars
+from urllib.parse import urlencode
+
+import aiohttp
+from aiohttp import web
+
+import compliance_inspect as ci
+import metrics
+from mime_policy import REJECT, normalize_mime_type
+from file_sniff import sniff_mime_type, checked_mime_type, is_conclusive, SNIFF_STEP
+from zip_inspect import inspect_zip, is_zip_file
+from dlp_scanner import StreamScanner, SCAN_CHUNK_SIZE
+from verdict_cache import compute_digest, DIGEST_SAMPLE_BYTES
+from webex_http import FILE_HTTP_CONNECT_TIMEOUT, FILE_HTTP_READ_TIMEOUT, FILE_HTTP_RETRIES, RETRY_STATUS, RateLimitTimeout
+from rate_limiter import FILE, VERDICT, RATE_LIMIT_RETRIES, RATE_LIMIT_MAX_WAIT, parse_retry_after
+from structured_log import log_context
+
+logger = logging.getLogger(__name__)
+file_logger = ci.file_logger
+
+ASYNC_MAX_INFLIGHT = int(os.getenv("ASYNC_MAX_INFLIGHT", 1000)) # max files inspected at the same time
+ASYNC_PORT = int(os.getenv("ASYNC_PORT", 5005))
+
+http_session = None # aiohttp.ClientSession, created at the application startup
+inflight = None # asyncio.Semaphore limiting the files inspected at the same time
+background_tasks = set() # webhooks being processed after the acknowledgement
+org_semaphores = {} # token key -> asyncio.Semaphore limiting the files of an organization inspected at the same time
+org_files = {} # token key -> number of files of an organization waiting or being inspected
+# RateLimiter of the organization whose files the task inspects, None without RATE_LIMIT
+request_limiter = contextvars.ContextVar("request_limiter", default = None)
+
+async def run_blocking(func, *args):
+    """
+    Run a blocking function in the default thread pool.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+async def get_auth_headers(token_key = ci.wxt_token_key):
+    """
+    Get the Authorization header with the current Access Token of an organization.
+
+    The cached token is used directly, only loading or refreshing it runs in a thread.
+
+    Returns:
+        dict: headers or None if there is no valid token
+    """
+    tokens = ci.webex_client_cache.peek(token_key)
+    if tokens is None:
+        with ci.stage_seconds.time(stage = "token"):
+            tokens = await run_blocking(ci.webex_client_cache.get_tokens, token_key)
+    if tokens:
+        return {"Authorization": "Bearer " + tokens.access_token}
+
+def use_limiter(token_key):
+    """
+    Send the requests of the current task through the rate limiter of an organization.
+
+    The limiter is the one of the organization's WebexFileSession, so the async requests
+    share the limits with the webhook management calls of the same Access Token.
+    """
+    request_limiter.set(ci.get_file_session(token_key).limiter)
+
+@contextlib.asynccontextmanager
+async def open_request(method, url, headers):
+    """
+    Send HTTP request, retry on connection errors and 502/503/504 responses.
+
+    With RATE_LIMIT, the request waits for its admission by the request_limiter and holds
+    its place in the limiter window until the "async with" block ends. A 429 response
+    is retried after the Retry-After pause of the limiter up to RATE_LIMIT_RETRIES times.
+
+    Yields:
+        aiohttp.ClientResponse: response
+    """
+    call_class = VERDICT if method == "PUT" else FILE
+    limiter = request_limiter.get()
+    attempt, throttled = 0, 0
+    while True:
+        last_attempt = attempt == FILE_HTTP_RETRIES
+        if limiter and not await limiter.acquire_async(call_class, RATE_LIMIT_MAX_WAIT):
+            raise RateLimitTimeout("{} {} not admitted in {}s".format(method, url, RATE_LIMIT_MAX_WAIT))
+        status, retry_after = None, None
+        try:
+            try:
+                response = await http_session.request(method, url, headers = headers)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if last_attempt:
+                    raise
+            else:
+                status = response.status
+                if status == 429:
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if status == 429 and limiter and throttled < RATE_LIMIT_RETRIES:
+                    throttled += 1
+                elif status not in RETRY_STATUS or last_attempt:
+                    async with response:
+                        yield response
+                    return
+                response.release()
+        finally:
+            if limiter:
+                limiter.release(call_class, status, retry_after)
+        if status != 429: # a 429 is retried after the limiter pause
+            await asyncio.sleep(0.1 * 2 ** attempt)
+            attempt += 1
+
+async def fetch_range(url, headers, range_spec, max_bytes):
+    """
+    Read a byte range of a remote file, at most 'max_bytes'.
+    """
+    data = b""
+    async with open_request("GET", url, dict(headers, Range = "bytes=" + range_spec)) as response:
+        response.raise_for_status()
+        while len(data) < max_bytes:
+            chunk = await response.content.read(max_bytes - len(data))
+            if not chunk:
+                break
+            data += chunk
+    return data
+
+async def sniff_file(url, headers, max_bytes):
+    """
+    Detect type of a remote file by reading only its beginning, see file_sniff.sniff_remote().
+
+    Returns:
+        tuple: (MIME type or None, bytes read)
+    """
+    data = b""
+    mime_type = None
+    async with open_request("GET", url, dict(headers, Range = "bytes=0-{}".format(max_bytes - 1))) as response:
+        response.raise_for_status()
+        while len(data) < max_bytes:
+            chunk = await response.content.read(min(SNIFF_STEP, max_bytes - len(data)))
+            if not chunk:
+                break
+            data += chunk
+            mime_type = sniff_mime_type(data)
+            if is_conclusive(mime_type):
+                break
+    logger.debug("Sniffed %s bytes of %s: %s", len(data), url, mime_type)
+    return mime_type, data
+
+async def file_digest(url, headers, size, mime_type, head, tail = b""):
+    """
+    Content digest of a remote file, see verdict_cache.sample_digest().
+    """
+    sample = DIGEST_SAMPLE_BYTES
+    if size <= 2 * sample:
+        data = head if len(head) >= size else await fetch_range(url, headers, "0-{}".format(size - 1), size)
+        return compute_digest(size, mime_type, data[:size])
+    data = head if len(head) >= sample else await fetch_range(url, headers, "0-{}".format(sample - 1), sample)
+    if len(tail) >= sample:
+        tail = tail[-sample:]
+    else:
+        tail = await fetch_range(url, headers, "-{}".format(sample), sample)
+    return compute_digest(size, mime_type, data[:sample], tail)
+
+async def zip_structure(url, headers, size, head, limits):
+    """
+    Inspect the structure of a remote ZIP file, see zip_inspect.inspect_zip_remote().
+
+    Parameters:
+        limits (dict): zip_inspect.inspect_zip() limits of the policy
+
+    Returns:
+        ZipReport: findings empty if the structure is fine
+    """
+    steps = inspect_zip(size, head, **limits)
+    data = None
+    try:
+        while True:
+            range_spec, max_bytes = steps.send(data)
+            data = await fetch_range(url, headers, range_spec, max_bytes)
+    except StopIteration as done:
+        return done.value
+
+async def scan_file(url, headers, rules):
+    """
+    Stream a remote file through the DLP scanner, see dlp_scanner.scan_remote().
+
+    Scanning is CPU bound, the chunks are scanned in a thread to keep the event loop responsive.
+
+    Parameters:
+        rules (list): scanner rules of the policy
+
+    Returns:
+        ScanMatch: the first match or None
+    """
+    scanner = StreamScanner(rules)
+    async with open_request("GET", url, headers) as response:
+        response.raise_for_status()
+        async for chunk in response.content.iter_chunked(SCAN_CHUNK_SIZE):
+            match = await run_blocking(scanner.feed, chunk)
+            if match:
+                return match
+    return scanner.feed(b"", True)
+
+async def get_space_policy(policy, file_verdict):
+    """
+    Policy of the space of a file, see compliance_inspect.get_space_policy().
+
+    A space not cached is looked up in a thread, the lookup started with the webhook is joined.
+    """
+    if policy.room_lookup and file_verdict.room_id and not ci.room_cache.peek(file_verdict.room_id)[0]:
+        await run_blocking(ci.room_cache.get, file_verdict.room_id, file_verdict.token_key, ci.ROOM_LOOKUP_TIMEOUT)
+    return ci.get_space_policy(policy, file_verdict, wait = False)
+
+async def inspect_file(url, headers, file_verdict = None):
+    """
+    Decide the verdict for a file, see compliance_inspect.inspect_file().
+
+    Parameters:
+        url (str): file URL with the dlpUnchecked parameter
+        headers (dict): Authorization header
+        file_verdict (FileVerdict): records the claimed file type for the fallback verdict and the policy version
+
+    Returns:
+        str: "approve" or "reject"
+    """
+    # the poller is started with the server, get() doesn't call S3
+    policy = ci.policy_store.get()
+    with ci.stage_seconds.time(stage = "head"):
+        async with open_request("HEAD", url, headers) as file_info:
+            content_type = file_info.headers.get("Content-Type", "")
+            content_length = int(file_info.headers.get("Content-Length", 0) or 0)
+    if file_verdict:
+        file_verdict.content_type = content_type
+        policy = await get_space_policy(policy, file_verdict)
+        file_verdict.policy_version = policy.version
+    file_logger.info("Message file: %s, type: %s, size: %s", url, content_type, content_length)
+
+    with ci.stage_seconds.time(stage = "policy"):
+        result = policy.mime_policy.decide(content_type)
+    if result == REJECT:
+        file_logger.debug("File type \"%s\" not permitted", content_type)
+        return result
+
+    file_type = normalize_mime_type(content_type)
+    head = b""
+    sniffed_type = None
+    if policy.content_sniff and content_length > 0:
+        with ci.stage_seconds.time(stage = "sniff"):
+            sniffed_type, head = await sniff_file(url, headers, min(ci.SNIFF_BYTES, content_length))
+        checked_type = checked_mime_type(file_type, sniffed_type)
+        if checked_type != file_type:
+            file_logger.info("File type \"%s\" detected as \"%s\"", content_type, checked_type)
+            file_type = checked_type
+            result = policy.mime_policy.decide(checked_type)
+            if result == REJECT:
+                file_logger.debug("File type \"%s\" not permitted", checked_type)
+                return result
+
+    tail = b""
+    if policy.zip_inspect and content_length > 0 and is_zip_file(file_type, head):
+        with ci.stage_seconds.time(stage = "zip"):
+            report = await zip_structure(url, headers, content_length, head, policy.zip_limits)
+        if not ci.zip_structure_ok(url, report):
+            return REJECT
+        tail = report.tail
+
+    # only a type confirmed by the content skips the scan, a claimed one can hide any data
+    if policy.content_scan and content_length > 0 and not (sniffed_type and ci.CONTENT_SCAN_SKIP_RE.match(sniffed_type)):
+        if content_length > ci.CONTENT_SCAN_MAX_BYTES:
+            file_logger.info("File size %s exceeds the content scan limit, not scanned", content_length)
+        else:
+            digest = None
+            if ci.VERDICT_CACHE:
+                with ci.stage_seconds.time(stage = "digest"):
+                    digest = await file_digest(url, headers, content_length, file_type, head, tail)
+                if ci.VERDICT_CACHE_PERSIST and not ci.verdict_cache_loaded:
+                    await run_blocking(ci.load_verdict_cache)
+                cached_result = ci.get_cached_verdict(digest, policy.version)
+                if cached_result:
+                    file_logger.info("Cached verdict for digest %s: %s", digest, cached_result)
+                    return cached_result
+            with ci.stage_seconds.time(stage = "scan"):
+                match = await scan_file(url, headers, policy.dlp_rules)
+            if match:
+                file_logger.info("Sensitive data \"%s\" found at offset %s", match.rule, match.offset)
+                result = REJECT
+            if digest and result == REJECT:
+                ci.store_cached_verdict(digest, policy.version, result)
+
+    return result
+
+async def send_verdict(file_verdict, result, headers, source = "inspection"):
+    """
+    Send the verdict PUT and remember it for the duplicate detection.
+    """
+    url = file_verdict.url
+    file_verdict.result = result
+    res_url = ci.get_result_url(url, result)
+    file_logger.debug("Result URL: %s", res_url)
+    try:
+        with ci.stage_seconds.time(stage = "verdict_put"):
+            async with open_request("PUT", res_url, headers) as response:
+                status, reason = response.status, response.reason
+        if status < 400:
+            ci.sent_verdicts.put(url, result)
+            file_logger.info("Verdict %s sent for %s, policy %s", result, url, file_verdict.policy_version)
+            ci.verdicts_total.inc(result = result, source = source)
+            ci.verdict_slack_seconds.observe(file_verdict.deadline - time.monotonic(), source = source)
+        else:
+            ci.errors_total.inc(kind = "verdict_put")
+            logger.error("Verdict for %s failed: %s %s", url, status, reason)
+    except (aiohttp.ClientError, asyncio.TimeoutError, RateLimitTimeout) as e:
+        ci.errors_total.inc(kind = "verdict_put")
+        logger.error("Verdict for %s failed: %s", url, e)
+
+def get_org_semaphore(token_key):
+    semaphore = org_semaphores.get(token_key)
+    if semaphore is None:
+        semaphore = org_semaphores[token_key] = asyncio.Semaphore(ci.ORG_FILE_CONCURRENCY)
+    return semaphore
+
+async def inspect_and_send(file_verdict, headers, semaphores):
+    """
+    Inspect a file and send its verdict as soon as it's decided.
+
+    The inspection is cancelled and the fallback verdict is sent if it fails, takes
+    longer than FILE_INSPECT_TIMEOUT or isn't finished FALLBACK_MARGIN before
+    the verdict deadline (including the wait for a free inspection slot).
+    The log records of the task get the correlation ids of the file.
+
+    Parameters:
+        file_verdict (FileVerdict): the file, its webhook event and space
+        semaphores (tuple): message and organization semaphores limiting the parallel inspections
+    """
+    url = file_verdict.url
+    with log_context(**file_verdict.log_ids):
+        source = "inspection"
+        try:
+            time_left = file_verdict.deadline - ci.FALLBACK_MARGIN - time.monotonic()
+            result = await asyncio.wait_for(inspect_limited(file_verdict, headers, semaphores), time_left)
+        except asyncio.TimeoutError:
+            logger.warning("Inspection of %s missed the deadline", url)
+            ci.errors_total.inc(kind = "deadline")
+            result = ci.fallback_verdict(file_verdict)
+            source = "deadline"
+        except Exception as e:
+            logger.error("Inspection of %s failed: %s", url, e)
+            ci.errors_total.inc(kind = "inspection")
+            result = ci.fallback_verdict(file_verdict)
+            source = "error"
+        await send_verdict(file_verdict, result, headers, source)
+
+async def inspect_limited(file_verdict, headers, semaphores):
+    message_semaphore, org_semaphore = semaphores
+    async with message_semaphore, org_semaphore, inflight:
+        with ci.files_in_flight.track_inprogress(), ci.stage_seconds.time(stage = "inspect"):
+            return await asyncio.wait_for(inspect_file(file_verdict.unchecked_url, headers, file_verdict), ci.FILE_INSPECT_TIMEOUT)
+
+async def handle_webhook_event(webhook, received_at):
+    """
+    Inspect the files of a message, see compliance_inspect.handle_webhook_event().
+    """
+    if webhook["resource"] != "messages":
+        return
+    with ci.webhooks_in_flight.track_inprogress():
+        await inspect_message(webhook, received_at)
+
+async def inspect_message(webhook, received_at):
+    token_key = ci.get_token_key(webhook)
+    use_limiter(token_key)
+    headers = await get_auth_headers(token_key)
+    if not headers:
+        logger.error("Failed to get Webex access token, Webex posts the files as not scanned after its timeout")
+        ci.errors_total.inc(kind = "token")
+        ci.forget_event(webhook)
+        return
+
+    files = []
+    for url in ci.get_dlp_files(webhook):
+        previous_result = ci.sent_verdicts.get(url)
+        if previous_result:
+            file_logger.info("Verdict for %s already sent: %s", url, previous_result)
+        else:
+            files.append(url)
+    event_key = ci.get_event_key(webhook)
+    room_id, org_id = webhook["data"].get("roomId"), webhook.get("orgId")
+    verdicts = [ci.FileVerdict(url, received_at, token_key, event_key, room_id, org_id) for url in files]
+    if verdicts:
+        ci.prefetch_room(room_id, token_key)
+    semaphores = (asyncio.Semaphore(ci.MESSAGE_FILE_CONCURRENCY), get_org_semaphore(token_key))
+    org_files[token_key] = org_files.get(token_key, 0) + len(files)
+    try:
+        with ci.stage_seconds.time(stage = "webhook"):
+            await asyncio.gather(*(inspect_and_send(file_verdict, headers, semaphores) for file_verdict in verdicts))
+    finally:
+        org_files[token_key] -= len(files)
+
+async def send_default_verdicts(webhook, received_at):
+    use_limiter(ci.get_token_key(webhook))
+    headers = await get_auth_headers(ci.get_token_key(webhook))
+    if not headers:
+        logger.error("Failed to get Webex access token, Webex posts the files as not scanned after its timeout")
+        return
+    for url in ci.get_dlp_files(webhook):
+        if url not in ci.sent_verdicts:
+            file_verdict = ci.FileVerdict(url, received_at, ci.get_token_key(webhook), room_id = webhook["data"].get("roomId"),
+                org_id = webhook.get("orgId"))
+            result = ci.fallback_verdict(file_verdict)
+            file_logger.info("Default verdict \"%s\" for file: %s", result, url)
+            await send_verdict(file_verdict, result, headers, "default")
+
+def start_background(coroutine):
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+# aiohttp part of the code
+
+def external_url(request, path):
+    return ci.secure_scheme(request.scheme) + "://" + request.host + path
+
+async def spark_webhook(request):
+    if request.method == "POST":
+        received_at = time.monotonic()
+        try:
+            webhook = await request.json()
+        except ValueError:
+            webhook = None
+        logger.debug("Webhook received: %s", webhook)
+        ci.capture_webhook(webhook)
+        if not ci.is_valid_webhook(webhook):
+            logger.error("Invalid webhook payload")
+            ci.webhooks_total.inc(outcome = "invalid")
+            return web.Response(status = 400, text = "Invalid webhook")
+        event_key = ci.get_event_key(webhook)
+        if event_key and not ci.seen_events.add(event_key):
+            logger.info("Duplicate webhook event %s ignored", event_key)
+            ci.webhooks_total.inc(outcome = "duplicate")
+            return web.Response(text = "OK")
+        ci.webhooks_total.inc(outcome = "accepted")
+        token_key = ci.get_token_key(webhook)
+        if org_files.get(token_key, 0) >= ci.ORG_QUEUE_LIMIT:
+            logger.warning("Too many files of {} waiting for inspection".format(token_key))
+            accepted = False
+        elif ci.WEBHOOK_ASYNC:
+            accepted = len(background_tasks) < ci.WEBHOOK_QUEUE_SIZE
+            if accepted:
+                start_background(handle_webhook_event(webhook, received_at))
+            else:
+                logger.warning("Webhook queue full ({} items)".format(len(background_tasks)))
+        else:
+            await handle_webhook_event(webhook, received_at)
+            accepted = True
+        if not accepted:
+            ci.errors_total.inc(kind = "queue_full")
+            if ci.WEBHOOK_QUEUE_FULL_ACTION == "default_verdict":
+                start_background(send_default_verdicts(webhook, received_at))
+            else:
+                ci.forget_event(webhook) # accept the redelivery
+                return web.Response(status = 503, text = "Busy", headers = {"Retry-After": str(ci.BUSY_RETRY_AFTER)})
+    return web.Response(text = "OK")
+
+async def metrics_endpoint(request):
+    """
+    Processing metrics in the Prometheus text format.
+    """
+    ci.update_token_metrics()
+    ci.update_rate_limit_metrics()
+    ci.update_log_metrics()
+    ci.update_policy_metrics()
+    ci.update_room_cache_metrics()
+    return web.Response(body = metrics.REGISTRY.render().encode(), headers = {"Content-Type": metrics.CONTENT_TYPE})
+
+async def authorize(request):
+    """
+    Start the Webex OAuth grant flow, see compliance_inspect.authorize().
+    """
+    full_redirect_uri = os.getenv("REDIRECT_URI")
+    if full_redirect_uri is None:
+        full_redirect_uri = external_url(request, "/manager")
+    logger.info("Authorize redirect URL: {}".format(full_redirect_uri))
+    raise web.HTTPFound(ci.get_authorize_url(full_redirect_uri))
+
+async def manager(request):
+    """
+    Webex OAuth grant flow redirect URL, see compliance_inspect.manager().
+    """
+    if request.query.get("error"):
+        return web.Response(text = request.query.get("error_description", ""))
+
+    full_redirect_uri = os.getenv("REDIRECT_URI")
+    if full_redirect_uri is None:
+        full_redirect_uri = external_url(request, "/manager")
+    token_key, error = await run_blocking(ci.issue_tokens, request.query.get("code"), full_redirect_uri)
+    if error:
+        return web.Response(text = error)
+
+    # hide the original redirect URL and its parameters from the user's browser
+    raise web.HTTPFound("/authdone?" + urlencode({"org": token_key}) if ci.MULTI_ORG else "/authdone")
+
+async def authdone(request):
+    """
+    Landing page for the OAuth authorization process, see compliance_inspect.authdone().
+    """
+    token_key = ci.get_token_key({"orgId": request.query.get("org")})
+    if not token_key:
+        return web.Response(text = "Missing organization.")
+    return web.Response(text = await run_blocking(ci.register_webhook, external_url(request, "/"), token_key))
+
+async def on_startup(app):
+    global http_session, inflight
+
+    timeout = aiohttp.ClientTimeout(sock_connect = FILE_HTTP_CONNECT_TIMEOUT, sock_read = FILE_HTTP_READ_TIMEOUT)
+    connector = aiohttp.TCPConnector(limit = ASYNC_MAX_INFLIGHT, keepalive_timeout = 60)
+    http_session = aiohttp.ClientSession(connector = connector, timeout = timeout)
+    inflight = asyncio.Semaphore(ASYNC_MAX_INFLIGHT)
+    if not ci.FAST_START:
+        logger.info(f"Creating S3 bucket \"{ci.S3_BUCKET}\"")
+        await run_blocking(ci.create_bucket, ci.S3_BUCKET)
+    ci.start_token_refresher()
+    if ci.POLICY_POLLER:
+        await run_blocking(ci.policy_store.start)
+
+async def on_cleanup(app):
+    if background_tasks:
+        await asyncio.gather(*background_tasks, return_exceptions = True)
+    await http_session.close()
+
+def create_app():
+    app = web.Application()
+    app.router.add_route("GET", "/", spark_webhook)
+    app.router.add_route("POST", "/", spark_webhook)
+    app.router.add_get("/metrics", metrics_endpoint)
+    app.router.add_get("/authorize", authorize)
+    app.router.add_get("/manager", manager)
+    app.router.add_get("/authdone", authdone)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-v', '--verbose', action='count', help="Set logging level by number of -v's, -v=WARN, -vv=INFO, -vvv=DEBUG")
+    parser.add_argument('-p', '--port', type=int, default=ASYNC_PORT, help="TCP port to listen on")
+
+    args = parser.parse_args()
+    if args.verbose:
+        if args.verbose > 2:
+            logging.basicConfig(level=logging.DEBUG)
+        elif args.verbose > 1:
+            logging.basicConfig(level=logging.INFO)
+        if args.verbose > 0:
+            logging.basicConfig(level=logging.WARN)
+
+    web.run_app(create_app(), host="0.0.0.0", port=args.port)
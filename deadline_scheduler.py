@@ -0,0 +1,205 @@
+"""Earliest-deadline-first scheduler with deadline expiration.
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import time
+import heapq
+import logging
+import itertools
+import threading
+
+logger = logging.getLogger(__name__)
+
+WAITING, RUNNING, DONE, EXPIRED = "waiting", "running", "done", "expired"
+
+class ScheduledTask:
+    """
+    A job submitted to the DeadlineScheduler.
+
+    Attributes:
+        job: object passed to the run and expire callbacks
+        deadline (float): clock() time when the job expires
+        groups (tuple): (group, limit) pairs, at most 'limit' jobs of the same group run at the same time
+        state (str): WAITING, RUNNING, DONE or EXPIRED
+    """
+    __slots__ = ("job", "deadline", "groups", "state")
+
+    def __init__(self, job, deadline, groups):
+        self.job = job
+        self.deadline = deadline
+        self.groups = tuple(groups)
+        self.state = WAITING
+
+class DeadlineScheduler:
+    """
+    Run jobs by a pool of worker threads in the order of their deadlines.
+
+    A watchdog thread calls 'expire' for each job which is not finished by its deadline,
+    no matter if it's still waiting or already running. A waiting job which expired
+    is not run at all. A running job can't be interrupted, its thread continues and
+    the job is responsible for ignoring its late result. 'expire' is called
+    by the watchdog thread, so it must not block.
+
+    Jobs can be members of groups (for example all files of a message or of
+    an organization) with a limit of running jobs. A job whose group is at its
+    limit is skipped, so the other groups are not blocked.
+
+    Worker and watchdog threads are daemon threads started by the first submit().
+
+    Attributes:
+        workers (int): number of worker threads
+        run_timeout (float): max seconds a job may run, shortens its deadline when started
+    """
+    def __init__(self, workers, run, expire, run_timeout = None, clock = time.monotonic, name = "scheduler"):
+        self.workers = workers
+        self.run_timeout = run_timeout
+        self.name = name
+        self._run = run
+        self._expire = expire
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self._timer = threading.Condition(self._lock)
+        self._queue = [] # (deadline, seq, task) waiting to run
+        self._timers = [] # (deadline, seq, task) to be checked by the watchdog
+        self._running = {} # group -> number of running jobs
+        self._waiting = {} # group -> number of waiting jobs, None for all
+        self._seq = itertools.count()
+        self._started = False
+
+    def _start(self):
+        if self._started:
+            return
+        for i in range(self.workers):
+            threading.Thread(target = self._worker, name = "{}_worker_{}".format(self.name, i), daemon = True).start()
+        threading.Thread(target = self._watchdog, name = "{}_watchdog".format(self.name), daemon = True).start()
+        self._started = True
+
+    def submit(self, job, deadline, groups = ()):
+        """
+        Schedule a job.
+
+        Parameters:
+            job: object passed to the callbacks
+            deadline (float): clock() time by which the job must be finished
+            groups (iterable): (group, limit) pairs, limit None for no limit
+
+        Returns:
+            ScheduledTask: the scheduled task
+        """
+        task = ScheduledTask(job, deadline, groups)
+        with self._lock:
+            self._start()
+            self._count_waiting(task, 1)
+            seq = next(self._seq)
+            heapq.heappush(self._queue, (deadline, seq, task))
+            heapq.heappush(self._timers, (deadline, seq, task))
+            self._work.notify()
+            self._timer.notify()
+        return task
+
+    def pending(self, group = None):
+        """
+        Returns:
+            int: number of jobs of the group waiting for a worker, of all groups if None
+        """
+        return self._waiting.get(group, 0)
+
+    def _count_waiting(self, task, delta):
+        for key in (None,) + tuple(group for group, limit in task.groups):
+            count = self._waiting.get(key, 0) + delta
+            if count:
+                self._waiting[key] = count
+            else:
+                del self._waiting[key]
+
+    def _is_eligible(self, task):
+        for group, limit in task.groups:
+            if limit is not None and self._running.get(group, 0) >= limit:
+                return False
+        return True
+
+    def _next_task(self):
+        skipped = []
+        try:
+            while self._queue:
+                entry = heapq.heappop(self._queue)
+                task = entry[2]
+                if task.state != WAITING:
+                    continue
+                if not self._is_eligible(task):
+                    skipped.append(entry)
+                    continue
+                return task
+        finally:
+            for entry in skipped:
+                heapq.heappush(self._queue, entry)
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                task = self._next_task()
+                while task is None:
+                    self._work.wait()
+                    task = self._next_task()
+                task.state = RUNNING
+                self._count_waiting(task, -1)
+                for group, limit in task.groups:
+                    self._running[group] = self._running.get(group, 0) + 1
+                if self.run_timeout is not None:
+                    run_deadline = self._clock() + self.run_timeout
+                    if run_deadline < task.deadline:
+                        task.deadline = run_deadline
+                        heapq.heappush(self._timers, (run_deadline, next(self._seq), task))
+                        self._timer.notify()
+            try:
+                self._run(task.job)
+            except Exception as e:
+                logger.exception("Scheduled job failed: {}".format(e))
+            finally:
+                with self._lock:
+                    if task.state == RUNNING:
+                        task.state = DONE
+                    for group, limit in task.groups:
+                        count = self._running[group] - 1
+                        if count:
+                            self._running[group] = count
+                        else:
+                            del self._running[group]
+                    self._work.notify_all() # a group slot may be free
+
+    def _watchdog(self):
+        while True:
+            with self._lock:
+                expired = []
+                while not expired:
+                    now = self._clock()
+                    while self._timers and self._timers[0][0] <= now:
+                        deadline, seq, task = heapq.heappop(self._timers)
+                        if task.state in (WAITING, RUNNING):
+                            if task.state == WAITING:
+                                self._count_waiting(task, -1)
+                            task.state = EXPIRED
+                            expired.append(task)
+                    if not expired:
+                        self._timer.wait(self._timers[0][0] - now if self._timers else None)
+            for task in expired:
+                try:
+                    self._expire(task.job)
+                except Exception as e:
+                    logger.exception("Expiration of a scheduled job failed: {}".format(e))
@@ -0,0 +1,373 @@
+"""DLP policy snapshots, reloaded while the application runs.
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+The policy is a JSON document, its fields override the built-in policy
+of the settings:
+
+    {
+        "mime_mode": "allowlist",
+        "allowed": ["image/.*"],
+        "suspect": ["application/msword", "application/pdf"],
+        "ooxml": "reject",
+        "content_sniff": true,
+        "zip_inspect": true,
+        "zip_max_ratio": 100,
+        "zip_max_uncompressed": 1073741824,
+        "zip_max_members": 10000,
+        "content_scan": true,
+        "keywords": ["project-x"],
+        "description": "any text, not used",
+        "spaces": [
+            {"team_ids": ["<team id>"], "policy": {"allowed": ["image/.*", "application/pdf"]}},
+            {"external": true, "policy": {"allowed": [], "description": "no files from outside"}}
+        ]
+    }
+
+"spaces" are rules selecting another policy for the files of some spaces,
+the first matching rule applies. A rule matches spaces by "room_ids",
+"team_ids" and "external" (the space is owned by another organization),
+all of the given conditions must match. Its "policy" fields override the
+fields of the document. The team and the owner of a space are looked up
+by the Webex API (see room_cache.py), if the lookup fails, only the rules
+by "room_ids" can match, so keep the strict rules in the document and relax
+them for the known spaces.
+
+It's compiled to an immutable PolicySnapshot. The readers take the current
+snapshot without a lock and use it for a whole file, a new snapshot replaces
+it by a single reference assignment. The document is checked by a conditional
+GET, an unchanged policy costs one 304 response and no parsing.
+"""
+
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+
+from mime_policy import MimePolicy, APPROVE, REJECT
+from dlp_scanner import default_rules
+from room_cache import webex_uuid
+
+logger = logging.getLogger(__name__)
+
+MIME_MODES = ("allowlist", "denylist")
+OOXML_POLICIES = ("reject", "inspect")
+BOOLEAN_FIELDS = ("content_sniff", "zip_inspect", "content_scan")
+NUMBER_FIELDS = ("zip_max_ratio", "zip_max_uncompressed", "zip_max_members")
+LIST_FIELDS = ("allowed", "suspect", "keywords")
+IGNORED_FIELDS = ("description",)
+SPACE_RULE_FIELDS = ("room_ids", "team_ids", "external", "policy", "description")
+
+"""
+Compiled DLP policy, never modified after it's created.
+
+Attributes:
+    version (str): short hash of the policy fields, identifies the policy of a verdict
+    etag (str): ETag of the policy document, None for the built-in policy
+    mime_policy (MimePolicy): MIME type decisions
+    dlp_rules (list): content scan rules
+    zip_limits (dict): zip_inspect.inspect_zip() limits
+    content_sniff, zip_inspect, content_scan (bool): inspection stages enabled
+    spaces (tuple): SpaceRule objects, empty in the policies of the rules
+    room_lookup (bool): a rule needs the team or the owner of the space
+"""
+PolicySnapshot = namedtuple("PolicySnapshot", ["version", "etag", "mime_policy", "dlp_rules", "zip_limits",
+    "content_sniff", "zip_inspect", "content_scan", "spaces", "room_lookup"])
+
+"""
+Policy of some spaces.
+
+Attributes:
+    room_ids (frozenset): UUIDs of the spaces, empty for any
+    team_ids (frozenset): UUIDs of the teams, empty for any
+    external (bool): True for the spaces owned by another organization, False for own ones, None for any
+    policy (PolicySnapshot): policy of the matching spaces
+"""
+SpaceRule = namedtuple("SpaceRule", ["room_ids", "team_ids", "external", "policy"])
+
+def build_mime_policy(mode, allowed, suspect, ooxml_policy = "reject"):
+    """
+    Create MIME type policy from the allowed type regexes and the suspect types.
+
+    Parameters:
+        mode (str): "allowlist" or "denylist"
+        allowed (list): types approved in the allowlist mode
+        suspect (list): types rejected in the denylist mode
+        ooxml_policy (str): "reject" or "inspect" - the Office Open XML types are approved, their structure is checked by the inspection
+    """
+    inspected = [mime_type for mime_type in suspect if "openxmlformats" in mime_type] if ooxml_policy == "inspect" else []
+    if mode == "denylist":
+        return MimePolicy(denied = [mime_type for mime_type in suspect if mime_type not in inspected], default = APPROVE)
+    return MimePolicy(allowed = list(allowed) + inspected, default = REJECT)
+
+def validate_policy(fields):
+    """
+    Check the fields of a policy.
+
+    Raises:
+        ValueError: unknown field or a wrong value
+    """
+    known = set(BOOLEAN_FIELDS + NUMBER_FIELDS + LIST_FIELDS + IGNORED_FIELDS + ("mime_mode", "ooxml"))
+    unknown = set(fields) - known
+    if unknown:
+        raise ValueError("unknown policy fields: {}".format(", ".join(sorted(unknown))))
+    if fields.get("mime_mode") not in MIME_MODES:
+        raise ValueError("mime_mode must be one of {}".format(", ".join(MIME_MODES)))
+    if fields.get("ooxml") not in OOXML_POLICIES:
+        raise ValueError("ooxml must be one of {}".format(", ".join(OOXML_POLICIES)))
+    for name in BOOLEAN_FIELDS:
+        if not isinstance(fields.get(name), bool):
+            raise ValueError("{} must be true or false".format(name))
+    for name in NUMBER_FIELDS:
+        value = fields.get(name)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError("{} must be a positive number".format(name))
+    for name in LIST_FIELDS:
+        value = fields.get(name)
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            raise ValueError("{} must be a list of strings".format(name))
+
+def validate_space_rule(rule):
+    """
+    Check a rule of the "spaces" list.
+
+    Raises:
+        ValueError: unknown field, a wrong value or no condition
+    """
+    if not isinstance(rule, dict):
+        raise ValueError("space rule must be a JSON object")
+    unknown = set(rule) - set(SPACE_RULE_FIELDS)
+    if unknown:
+        raise ValueError("unknown space rule fields: {}".format(", ".join(sorted(unknown))))
+    for name in ("room_ids", "team_ids"):
+        value = rule.get(name, [])
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            raise ValueError("{} must be a list of strings".format(name))
+    if rule.get("external") is not None and not isinstance(rule["external"], bool):
+        raise ValueError("external must be true or false")
+    if not (rule.get("room_ids") or rule.get("team_ids") or rule.get("external") is not None):
+        raise ValueError("space rule needs room_ids, team_ids or external")
+    if not isinstance(rule.get("policy"), dict):
+        raise ValueError("space rule needs a policy object")
+
+def compile_fields(fields, etag, spaces = ()):
+    """
+    Compile the validated policy fields.
+
+    Returns:
+        PolicySnapshot: the compiled policy
+    """
+    validate_policy(fields)
+    for name in IGNORED_FIELDS:
+        fields.pop(name, None)
+    try:
+        mime_policy = build_mime_policy(fields["mime_mode"], fields["allowed"], fields["suspect"], fields["ooxml"])
+    except Exception as e:
+        raise ValueError("invalid MIME type rule: {}".format(e))
+    fields["keywords"] = sorted(set(keyword.strip() for keyword in fields["keywords"] if keyword.strip()))
+    versioned = dict(fields, spaces = [[sorted(rule.room_ids), sorted(rule.team_ids), rule.external, rule.policy.version]
+        for rule in spaces]) if spaces else fields
+    version = hashlib.sha256(json.dumps(versioned, sort_keys = True).encode()).hexdigest()[:12]
+    return PolicySnapshot(
+        version = version,
+        etag = etag,
+        mime_policy = mime_policy,
+        dlp_rules = default_rules(fields["keywords"]),
+        zip_limits = {"max_ratio": fields["zip_max_ratio"], "max_uncompressed": fields["zip_max_uncompressed"],
+            "max_members": fields["zip_max_members"]},
+        content_sniff = fields["content_sniff"],
+        zip_inspect = fields["zip_inspect"],
+        content_scan = fields["content_scan"],
+        spaces = tuple(spaces),
+        room_lookup = any(rule.team_ids or rule.external is not None for rule in spaces))
+
+def compile_policy(defaults, document = None, etag = None):
+    """
+    Compile a policy document.
+
+    Parameters:
+        defaults (dict): built-in policy, used for the fields missing in the document
+        document (bytes, str or dict): policy document, None for the built-in policy
+        etag (str): ETag of the document
+
+    Returns:
+        PolicySnapshot: the compiled policy
+
+    Raises:
+        ValueError: the document is not a valid policy
+    """
+    if isinstance(document, (bytes, str)):
+        try:
+            document = json.loads(document)
+        except ValueError as e:
+            raise ValueError("policy is not valid JSON: {}".format(e))
+    if document is not None and not isinstance(document, dict):
+        raise ValueError("policy must be a JSON object")
+    fields = dict(defaults, **(document or {}))
+    rules = fields.pop("spaces", [])
+    if not isinstance(rules, list):
+        raise ValueError("spaces must be a list of rules")
+    spaces = []
+    for index, rule in enumerate(rules):
+        try:
+            validate_space_rule(rule)
+            policy = compile_fields(dict(fields, **rule["policy"]), etag)
+        except ValueError as e:
+            raise ValueError("space rule {}: {}".format(index + 1, e))
+        spaces.append(SpaceRule(frozenset(webex_uuid(room_id) for room_id in rule.get("room_ids", [])),
+            frozenset(webex_uuid(team_id) for team_id in rule.get("team_ids", [])), rule.get("external"), policy))
+    return compile_fields(fields, etag, spaces)
+
+def resolve_space(policy, room_id, room = None, org_id = None):
+    """
+    Select the policy of a space by the "spaces" rules.
+
+    Parameters:
+        policy (PolicySnapshot): the policy of the document
+        room_id (str): space of the file
+        room (RoomInfo): metadata of the space, None if not known
+        org_id (str): organization of the webhook, the spaces of other owners are external
+
+    Returns:
+        PolicySnapshot: policy of the first matching rule, 'policy' if none matches
+    """
+    if not policy.spaces:
+        return policy
+    room_uuid = webex_uuid(room_id)
+    team_uuid = webex_uuid(room.team_id) if room else None
+    external = None
+    if room and room.owner_id and org_id:
+        external = webex_uuid(room.owner_id) != webex_uuid(org_id)
+    for rule in policy.spaces:
+        if rule.room_ids and room_uuid not in rule.room_ids:
+            continue
+        if rule.team_ids and team_uuid not in rule.team_ids:
+            continue
+        if rule.external is not None and external != rule.external:
+            continue
+        return rule.policy
+    return policy
+
+class PolicyStore:
+    """
+    Current DLP policy, reloaded if its document changes.
+
+    The 'load' callback is called with the ETag of the last document seen,
+    it returns (document, ETag), (None, etag) if the document didn't change
+    or (None, None) if there is no document, exceptions are load errors.
+    A document which fails to compile is logged and the current policy stays,
+    it's not parsed again until it changes. When the document is deleted, the
+    built-in policy (the 'defaults') applies again.
+
+    start() checks the document and starts a daemon thread checking it every
+    'interval' seconds. Without the thread (e.g. on AWS Lambda), get() checks
+    it when due in the calling thread, the other threads don't wait for the check.
+
+    Attributes:
+        current (PolicySnapshot): the policy, read it by get(), or directly where a check must not run (no I/O)
+        builtin (PolicySnapshot): the policy of the 'defaults', used while there is no document
+        checks (dict): outcome -> number of checks: "updated", "not_modified", "missing", "invalid", "error"
+        checked_at (float): time.time() of the last successful check, None if not checked yet
+    """
+    def __init__(self, defaults, load = None, interval = 30, clock = time.monotonic, name = "policy_poller"):
+        self.builtin = self.current = compile_policy(defaults)
+        self.checks = {"updated": 0, "not_modified": 0, "missing": 0, "invalid": 0, "error": 0}
+        self.checked_at = None
+        self.interval = interval
+        self.name = name
+        self._defaults = defaults
+        self._load = load
+        self._clock = clock
+        self._etag = None # ETag of the last document seen, valid or not
+        self._next_check = clock()
+        self._check_lock = threading.Lock()
+        self._thread = None
+
+    def get(self):
+        """
+        Returns:
+            PolicySnapshot: the current policy
+        """
+        if self._thread is None and self._load and self._clock() >= self._next_check:
+            if self._check_lock.acquire(blocking = False):
+                try:
+                    self.check()
+                finally:
+                    self._check_lock.release()
+        return self.current
+
+    def swap(self, snapshot):
+        """
+        Make the snapshot the current policy.
+        """
+        self.current = snapshot
+
+    def check(self):
+        """
+        Load the policy document if it changed.
+
+        Returns:
+            str: outcome of the check, see 'checks'
+        """
+        self._next_check = self._clock() + self.interval
+        try:
+            document, etag = self._load(self._etag)
+        except Exception as e:
+            logger.error("Policy load failed, keeping policy %s: %s", self.current.version, e)
+            return self._count("error")
+        self.checked_at = time.time()
+        if document is None:
+            if etag:
+                return self._count("not_modified")
+            if self._etag is not None or not self.checks["missing"]:
+                logger.warning("Policy document not found, using the built-in policy %s, previous policy %s",
+                    self.builtin.version, self.current.version)
+            self._etag = None
+            self.swap(self.builtin)
+            return self._count("missing")
+        self._etag = etag
+        try:
+            snapshot = compile_policy(self._defaults, document, etag)
+        except ValueError as e:
+            logger.error("Policy %s is not valid, keeping policy %s: %s", etag, self.current.version, e)
+            return self._count("invalid")
+        if snapshot.version != self.current.version:
+            logger.info("Policy %s loaded, ETag %s, previous policy %s", snapshot.version, etag, self.current.version)
+        self.swap(snapshot)
+        return self._count("updated")
+
+    def _count(self, outcome):
+        self.checks[outcome] += 1
+        return outcome
+
+    def start(self):
+        """
+        Check the policy now and start the thread checking it every 'interval' seconds.
+        """
+        if self._thread is not None or not self._load:
+            return
+        with self._check_lock:
+            self.check()
+        self._thread = threading.Thread(target = self._run, name = self.name, daemon = True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(max(0, self._next_check - self._clock()))
+            with self._check_lock:
+                self.check()
@@ -0,0 +1,239 @@
+"""Streaming content scanner for the Webex file DLP.
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+The scanner works on the raw file bytes, so it finds the patterns in text-based
+formats (plain text, CSV, HTML, source code, ...) but not inside compressed
+containers like OOXML.
+"""
+
+import re
+import logging
+from collections import namedtuple
+
+try:
+    import ahocorasick # optional, pyahocorasick package
+except ImportError:
+    ahocorasick = None
+
+logger = logging.getLogger(__name__)
+
+SCAN_CHUNK_SIZE = 64 * 1024 # bytes read from the file at once
+LOOKAROUND_GUARD = 8 # bytes of context kept before a match for the regex lookbehind
+
+"""
+A pattern found in the file.
+
+Attributes:
+    rule (str): name of the rule which matched
+    offset (int): position of the match in the file
+"""
+ScanMatch = namedtuple("ScanMatch", ["rule", "offset"])
+
+def luhn_valid(digits):
+    """
+    Check the Luhn checksum of a card number.
+
+    Parameters:
+        digits (str): card number, non-digit characters are ignored
+    """
+    total = 0
+    for i, d in enumerate(reversed([int(c) for c in digits if c.isdigit()])):
+        if i % 2:
+            d *= 2
+            if d > 9:
+                d -= 9
+        total += d
+    return total % 10 == 0
+
+def ssn_valid(ssn):
+    """
+    Check a US Social Security Number is not in the never-assigned ranges.
+    """
+    area, group, serial = ssn.split("-")
+    return area not in ("000", "666") and not area.startswith("9") and group != "00" and serial != "0000"
+
+class RegexRule:
+    """
+    Regular expression with an optional validation of the matched text.
+
+    Attributes:
+        name (str): rule name reported in the ScanMatch
+        regex: compiled bytes regex
+        max_len (int): max length of a match in bytes
+        validator (callable): function(str) -> bool, None if every match counts
+    """
+    def __init__(self, name, pattern, max_len, validator = None, flags = 0):
+        self.name = name
+        self.regex = re.compile(pattern, flags)
+        self.max_len = max_len
+        self.validator = validator
+
+    def finditer(self, window):
+        for m in self.regex.finditer(window):
+            yield m.start(), m.end(), self, m.group()
+
+    def is_valid(self, text):
+        return self.validator is None or self.validator(text.decode("latin-1"))
+
+# the patterns start with a literal class and check the preceding byte by a lookbehind
+# placed after it, that lets the regex engine skip non-digit bytes quickly
+CREDIT_CARD_RULE = RegexRule("credit_card", rb"[0-9](?<![0-9][0-9])(?:[ -]?[0-9]){12,18}(?![0-9])", 37, luhn_valid)
+US_SSN_RULE = RegexRule("us_ssn", rb"[0-9](?<![0-9-][0-9])[0-9]{2}-[0-9]{2}-[0-9]{4}(?![0-9-])", 11, ssn_valid)
+
+class KeywordRule:
+    """
+    Case-insensitive keyword matcher.
+
+    Uses Aho-Corasick automaton if the pyahocorasick package is installed,
+    otherwise all keywords are compiled into a single regex alternation.
+
+    Attributes:
+        name (str): rule name reported in the ScanMatch
+        max_len (int): length of the longest keyword in bytes
+    """
+    def __init__(self, name, keywords):
+        self.name = name
+        words = sorted({k.lower().encode("utf-8") for k in keywords if k}, key = len, reverse = True)
+        self.max_len = max((len(w) for w in words), default = 0)
+        self._automaton = None
+        self._regex = None
+        if not words:
+            return
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for word in words:
+                self._automaton.add_word(word.decode("latin-1"), len(word))
+            self._automaton.make_automaton()
+        else:
+            self._regex = re.compile(b"|".join(re.escape(w) for w in words), re.IGNORECASE)
+
+    def finditer(self, window):
+        if self._automaton is not None:
+            # latin-1 maps bytes 1:1 to characters, so the positions are kept
+            for end, length in self._automaton.iter(window.lower().decode("latin-1")):
+                yield end + 1 - length, end + 1, self, None
+        elif self._regex is not None:
+            for m in self._regex.finditer(window):
+                yield m.start(), m.end(), self, m.group()
+
+    def is_valid(self, text):
+        return True
+
+def default_rules(keywords = ()):
+    """
+    Rules for card numbers, US SSNs and the provided keywords.
+    """
+    rules = [CREDIT_CARD_RULE, US_SSN_RULE]
+    if keywords:
+        rules.append(KeywordRule("keyword", keywords))
+    return rules
+
+class StreamScanner:
+    """
+    Scan a file for DLP patterns chunk by chunk.
+
+    Only the current chunk and a short tail of the previous data are kept,
+    so the memory used is constant no matter how large the file is.
+    Patterns crossing the chunk boundary are found in the tail. A match is
+    accepted only when the data around it is complete, otherwise it's
+    re-evaluated with the next chunk.
+
+    Attributes:
+        rules (list): RegexRule and KeywordRule objects
+        bytes_scanned (int): number of bytes processed so far
+    """
+    def __init__(self, rules):
+        self.rules = rules
+        self.max_len = max((r.max_len for r in rules), default = 0)
+        self._tail_len = 2 * self.max_len + LOOKAROUND_GUARD
+        self._tail = b""
+        self._tail_offset = 0 # file position of the tail start
+        self.bytes_scanned = 0
+
+    def _search(self, window, final):
+        # matches starting in the guard were evaluated with the previous chunk
+        min_start = LOOKAROUND_GUARD if self._tail_offset > 0 else 0
+        # matches ending near the window end may continue in the next chunk
+        max_end = len(window) if final else len(window) - self.max_len
+        for rule in self.rules:
+            for start, end, matched_rule, text in rule.finditer(window):
+                if start < min_start or end > max_end:
+                    continue
+                if text is None or matched_rule.is_valid(text):
+                    return ScanMatch(matched_rule.name, self._tail_offset + start)
+
+    def feed(self, chunk, final = False):
+        """
+        Scan the next chunk of the file.
+
+        Parameters:
+            chunk (bytes): file data
+            final (bool): True if this is the last chunk
+
+        Returns:
+            ScanMatch: the first match or None
+        """
+        window = self._tail + chunk
+        self.bytes_scanned += len(chunk)
+        match = self._search(window, final)
+        if len(window) > self._tail_len:
+            self._tail_offset += len(window) - self._tail_len
+            self._tail = window[-self._tail_len:]
+        else:
+            self._tail = window
+        return match
+
+    def scan(self, chunks):
+        """
+        Scan the file until the first match.
+
+        Parameters:
+            chunks: iterable of bytes
+
+        Returns:
+            ScanMatch: the first match or None
+        """
+        for chunk in chunks:
+            if chunk:
+                match = self.feed(chunk)
+                if match:
+                    return match
+        return self.feed(b"", final = True)
+
+def scan_remote(session, url, rules, chunk_size = SCAN_CHUNK_SIZE):
+    """
+    Stream a remote file through the scanner.
+
+    The download stops at the first match.
+
+    Parameters:
+        session: HTTP session with a requests-like get()
+        url (str): file URL
+        rules (list): scanner rules
+
+    Returns:
+        tuple: (ScanMatch or None, number of bytes read)
+    """
+    scanner = StreamScanner(rules)
+    response = session.get(url, stream = True)
+    try:
+        response.raise_for_status()
+        match = scanner.scan(response.iter_content(chunk_size = chunk_size))
+    finally:
+        response.close()
+    logger.debug("Scanned %s bytes of %s: %s", scanner.bytes_scanned, url, match)
+    return match, scanner.bytes_scanned
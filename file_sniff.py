@@ -0,0 +1,215 @@
+"""File type detection from magic bytes.
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import re
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+SNIFF_STEP = 512 # bytes read from the response before each detection attempt
+
+OLE2_MIME_TYPE = "application/x-ole-storage"
+ZIP_MIME_TYPE = "application/zip"
+UNVERIFIED_MIME_TYPE = "application/octet-stream" # claimed media type not confirmed by the content
+MEDIA_TYPES_RE = re.compile(r"(image|video|audio)/") # claimed types which must be confirmed by a signature
+# text based media types, they have no signature, the claimed type is kept and the content is scanned
+TEXT_MEDIA_TYPES_RE = re.compile(r"(image|video|audio)/(.+\+xml|x-xbitmap|x-xpixmap|(x-|vnd\.apple\.)?mpegurl)$")
+
+# (offset, signature, MIME type)
+MAGIC_SIGNATURES = [
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", OLE2_MIME_TYPE), # legacy MS Office, MSI, Outlook MSG
+    (0, b"PK\x03\x04", ZIP_MIME_TYPE),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"BM", "image/bmp"),
+    (0, b"II*\x00", "image/tiff"),
+    (0, b"MM\x00*", "image/tiff"),
+    (4, b"ftypheic", "image/heic"),
+    (4, b"ftypheix", "image/heic"),
+    (4, b"ftypheim", "image/heic"),
+    (4, b"ftypheis", "image/heic"),
+    (4, b"ftyphevc", "image/heic-sequence"),
+    (4, b"ftyphevx", "image/heic-sequence"),
+    (4, b"ftyphevm", "image/heic-sequence"),
+    (4, b"ftyphevs", "image/heic-sequence"),
+    (4, b"ftypmif1", "image/heif"),
+    (4, b"ftypmif2", "image/heif"),
+    (4, b"ftypmsf1", "image/heif-sequence"),
+    (4, b"ftypavif", "image/avif"),
+    (4, b"ftypavis", "image/avif"),
+    (4, b"ftypM4A ", "audio/mp4"),
+    (4, b"ftypqt  ", "video/quicktime"),
+    (4, b"ftyp", "video/mp4"), # other ISO media brands (mp41, mp42, isom, 3gp...)
+    (0, b"\x00\x00\x01\x00", "image/x-icon"),
+    (0, b"8BPS", "image/vnd.adobe.photoshop"),
+    (0, b"\x1a\x45\xdf\xa3", "video/webm"), # Matroska EBML header
+    (0, b"OggS", "audio/ogg"),
+    (0, b"fLaC", "audio/flac"),
+    (0, b"ID3", "audio/mpeg"),
+    (0, b"\xff\xfb", "audio/mpeg"),
+    (0, b"\xff\xf3", "audio/mpeg"),
+    (0, b"\xff\xf2", "audio/mpeg"),
+    (0, b"\xff\xf1", "audio/aac"),
+    (0, b"\xff\xf9", "audio/aac"),
+    (0, b"\x1f\x8b", "application/gzip"),
+    (0, b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+    (0, b"Rar!\x1a\x07", "application/vnd.rar"),
+    (0, b"MZ", "application/x-msdownload"),
+    (0, b"\x7fELF", "application/x-executable"),
+]
+
+# RIFF container form type
+RIFF_MIME_TYPES = {
+    b"WEBP": "image/webp",
+    b"WAVE": "audio/wav",
+    b"AVI ": "video/x-msvideo",
+}
+
+# top level folder of OOXML package members
+OOXML_FOLDERS = {
+    b"word/": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    b"xl/": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    b"ppt/": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+}
+
+# ZIP local file header: signature, version, flags, compression, time, date, crc, sizes, name and extra length
+ZIP_LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+
+def iter_zip_local_members(data):
+    """
+    Walk the ZIP local file headers found in the beginning of a file.
+
+    Yields:
+        tuple: (member name, compression method, member data offset, compressed size)
+    """
+    offset = 0
+    while offset + ZIP_LOCAL_HEADER.size <= len(data):
+        (signature, version, flags, compression, mtime, mdate, crc,
+            compressed_size, size, name_len, extra_len) = ZIP_LOCAL_HEADER.unpack_from(data, offset)
+        if signature != b"PK\x03\x04":
+            return
+        name_start = offset + ZIP_LOCAL_HEADER.size
+        name = data[name_start:name_start + name_len]
+        if len(name) < name_len:
+            return
+        data_offset = name_start + name_len + extra_len
+        yield name, compression, data_offset, compressed_size
+        if flags & 0x08: # sizes follow the data, the next header position is unknown
+            return
+        offset = data_offset + compressed_size
+
+def sniff_zip(data):
+    """
+    Identify OOXML and OpenDocument packages among ZIP files.
+
+    Returns:
+        str: MIME type, ZIP_MIME_TYPE if the package type is not (yet) known
+    """
+    for name, compression, data_offset, compressed_size in iter_zip_local_members(data):
+        if name == b"mimetype" and compression == 0: # OpenDocument, stored uncompressed as the first member
+            mime_type = data[data_offset:data_offset + compressed_size]
+            if len(mime_type) == compressed_size:
+                return mime_type.decode("ascii", "replace")
+        for folder, mime_type in OOXML_FOLDERS.items():
+            if name.startswith(folder):
+                return mime_type
+    return ZIP_MIME_TYPE
+
+def sniff_mime_type(data):
+    """
+    Detect file type from its first bytes.
+
+    Parameters:
+        data (bytes): beginning of the file
+
+    Returns:
+        str: MIME type or None if not recognized
+    """
+    for offset, signature, mime_type in MAGIC_SIGNATURES:
+        if data[offset:offset + len(signature)] == signature:
+            if mime_type == ZIP_MIME_TYPE:
+                return sniff_zip(data)
+            return mime_type
+    if data[:4] == b"RIFF":
+        return RIFF_MIME_TYPES.get(data[8:12])
+    return None
+
+def checked_mime_type(claimed_type, sniffed_type):
+    """
+    Type of a file decided by the policy after the content sniffing.
+
+    A media type skips the content scan, so a claimed one is trusted only if the
+    content confirms it, otherwise a renamed text file would not be scanned.
+    Text based media types (SVG...) have no signature, they keep the claimed type
+    and, as the content isn't confirmed, they are scanned.
+
+    Parameters:
+        claimed_type (str): normalized Content-Type
+        sniffed_type (str): type detected by sniff_mime_type(), None if not recognized
+
+    Returns:
+        str: the sniffed type if recognized, UNVERIFIED_MIME_TYPE for a binary media type
+            without a known signature, the claimed type otherwise
+    """
+    if sniffed_type:
+        return sniffed_type
+    if MEDIA_TYPES_RE.match(claimed_type) and not TEXT_MEDIA_TYPES_RE.match(claimed_type):
+        return UNVERIFIED_MIME_TYPE
+    return claimed_type
+
+def is_conclusive(mime_type):
+    """
+    Check if more data can't change the detected type.
+    """
+    return mime_type is not None and mime_type != ZIP_MIME_TYPE
+
+def sniff_remote(session, url, max_bytes, step = SNIFF_STEP):
+    """
+    Detect type of a remote file by reading only its beginning.
+
+    The first 'max_bytes' are requested by HTTP Range. Reading stops as soon
+    as the type is known. If the server ignores the Range, the response is
+    closed after 'max_bytes', so the whole file is never transferred.
+
+    Parameters:
+        session: HTTP session with a requests-like get()
+        url (str): file URL
+        max_bytes (int): max number of bytes to read
+
+    Returns:
+        tuple: (MIME type or None, bytes read)
+    """
+    data = b""
+    mime_type = None
+    response = session.get(url, headers = {"Range": "bytes=0-{}".format(max_bytes - 1)}, stream = True)
+    try:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size = step):
+            data += chunk
+            mime_type = sniff_mime_type(data)
+            if is_conclusive(mime_type) or len(data) >= max_bytes:
+                break
+    finally:
+        response.close()
+    logger.debug("Sniffed %s bytes of %s: %s", len(data), url, mime_type)
+    return mime_type, data[:max_bytes]
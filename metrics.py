@@ -0,0 +1,276 @@
+"""Lightweight in-process metrics with Prometheus text exposition.
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+Counters, gauges and fixed-bucket histograms, each update is a dictionary
+lookup and an addition under a lock. The registry renders all metrics
+in the Prometheus text format (version 0.0.4).
+"""
+
+import math
+import time
+import bisect
+import operator
+import threading
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds, from sub-millisecond policy decisions to the webhook timeout
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15)
+QUANTILES = (0.5, 0.95, 0.99)
+
+def format_value(value):
+    if value is None:
+        return "NaN"
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+def format_labels(labelnames, labelvalues):
+    pairs = list(zip(labelnames, labelvalues))
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs) + "}"
+
+class Metric:
+    """
+    Base of the metric types. A metric has a value per combination of its label values.
+
+    Attributes:
+        name (str): metric name
+        help (str): description
+        labelnames (tuple): label names, values are passed as keyword arguments
+    """
+    type = None
+
+    def __init__(self, name, help, labelnames = (), registry = None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        if len(self.labelnames) > 1:
+            self._getter = operator.itemgetter(*self.labelnames)
+        elif self.labelnames:
+            name = self.labelnames[0]
+            self._getter = lambda labels: (labels[name],)
+        else:
+            self._getter = lambda labels: ()
+        self._lock = threading.Lock()
+        self._values = {} # label values -> value
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        try:
+            return self._getter(labels)
+        except KeyError as e:
+            raise ValueError("Missing label {} of {}".format(e, self.name))
+
+    def samples(self):
+        """
+        Returns:
+            list: (suffix, label names, label values, value)
+        """
+        with self._lock:
+            return [("", self.labelnames, key, value) for key, value in sorted(self._values.items())]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        """
+        Increment the gauge for the duration of the block.
+        """
+        self.inc(1, **labels)
+        try:
+            yield
+        finally:
+            self.inc(-1, **labels)
+
+class Histogram(Metric):
+    """
+    Histogram with fixed buckets.
+
+    Besides the standard bucket, sum and count samples, p50/p95/p99 estimated
+    from the buckets are exposed as a gauge named <name>_quantile. The estimate
+    interpolates linearly inside the bucket, the same way as histogram_quantile()
+    in Prometheus, so its precision is given by the bucket bounds.
+    """
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames = (), buckets = DEFAULT_BUCKETS, registry = None):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, help, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0] # counts, sum, count
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels):
+        """
+        Observe the duration of the block in seconds, including the failed ones.
+
+        Returns:
+            context manager
+        """
+        return Timer(self, labels)
+
+    def count(self, **labels):
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def quantile(self, q, **labels):
+        """
+        Estimate a quantile from the bucket counts.
+
+        Returns:
+            float: estimated value, None if there are no observations
+        """
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            counts = list(entry[0]) if entry else None
+        return self._estimate(q, counts)
+
+    def _estimate(self, q, counts):
+        total = sum(counts) if counts else 0
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index]
+                if upper == math.inf:
+                    return lower
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-2]
+
+    def samples(self):
+        with self._lock:
+            entries = [(key, list(counts), total, count) for key, (counts, total, count) in sorted(self._values.items())]
+        result = []
+        for key, counts, total, count in entries:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                result.append(("_bucket", self.labelnames + ("le",), key + (format_value(float(bound)),), cumulative))
+            result.append(("_sum", self.labelnames, key, total))
+            result.append(("_count", self.labelnames, key, count))
+        return result
+
+    def quantile_samples(self):
+        with self._lock:
+            entries = [(key, list(counts)) for key, (counts, total, count) in sorted(self._values.items())]
+        return [(self.labelnames + ("quantile",), key + (str(q),), self._estimate(q, counts))
+            for key, counts in entries for q in QUANTILES]
+
+class Timer:
+    """
+    Context manager observing its duration in a histogram.
+
+    A plain class is used because a @contextmanager generator costs several
+    times more per block.
+    """
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+class Registry:
+    """
+    Collection of metrics rendered together.
+    """
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        """
+        Returns:
+            str: all metrics in the Prometheus text format
+        """
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.help))
+            lines.append("# TYPE {} {}".format(metric.name, metric.type))
+            for suffix, labelnames, labelvalues, value in metric.samples():
+                lines.append("{}{}{} {}".format(metric.name, suffix, format_labels(labelnames, labelvalues), format_value(value)))
+            if isinstance(metric, Histogram):
+                name = metric.name + "_quantile"
+                lines.append("# HELP {} {} (estimated from the buckets)".format(name, metric.help))
+                lines.append("# TYPE {} gauge".format(name))
+                for labelnames, labelvalues, value in metric.quantile_samples():
+                    lines.append("{}{} {}".format(name, format_labels(labelnames, labelvalues), format_value(value)))
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
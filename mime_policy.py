@@ -0,0 +1,89 @@
+"""MIME type policy for the Webex file DLP.
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import re
+import functools
+
+APPROVE = "approve"
+REJECT = "reject"
+
+MIME_CACHE_SIZE = 1024 # max number of memoized Content-Type decisions
+
+# a rule made only of these characters is an exact MIME type, otherwise it's a regex
+EXACT_RULE_RE = re.compile(r"[a-z0-9!#$&^_.+\-]+/[a-z0-9!#$&^_.+\-]+", re.IGNORECASE)
+
+def normalize_mime_type(content_type):
+    """
+    Strip parameters and normalize the case of a Content-Type.
+
+    "Image/PNG; charset=binary" -> "image/png"
+    """
+    return content_type.split(";", 1)[0].strip().lower()
+
+def split_rules(rules):
+    """
+    Split the rules to exact MIME types and regular expressions.
+
+    Returns:
+        tuple: (frozenset of exact types, compiled regex or None)
+    """
+    exact = set()
+    patterns = []
+    for rule in rules:
+        if EXACT_RULE_RE.fullmatch(rule):
+            exact.add(rule.lower())
+        elif rule not in patterns:
+            patterns.append(rule)
+    regex = re.compile("|".join("(?:{})".format(p) for p in patterns), re.IGNORECASE) if patterns else None
+    return frozenset(exact), regex
+
+class MimePolicy:
+    """
+    Compiled allow/deny rules for MIME types.
+
+    Rules are either exact MIME types, checked by a set lookup, or regular
+    expressions, combined into a single compiled regex. The denylist has
+    precedence over the allowlist, a type which matches neither gets the default
+    verdict. Decisions are memoized, so a repeated Content-Type costs a single
+    cache lookup.
+
+    Attributes:
+        default (str): verdict for types not matching any rule
+    """
+    def __init__(self, allowed = (), denied = (), default = REJECT, cache_size = MIME_CACHE_SIZE):
+        self.default = default
+        self._allowed_exact, self._allowed_regex = split_rules(allowed)
+        self._denied_exact, self._denied_regex = split_rules(denied)
+        # decide(content_type) -> "approve" or "reject"
+        self.decide = functools.lru_cache(maxsize = cache_size)(self._decide)
+
+    @staticmethod
+    def _matches(mime_type, exact, regex):
+        return mime_type in exact or (regex is not None and regex.match(mime_type) is not None)
+
+    def _decide(self, content_type):
+        mime_type = normalize_mime_type(content_type)
+        if self._matches(mime_type, self._denied_exact, self._denied_regex):
+            return REJECT
+        if self._matches(mime_type, self._allowed_exact, self._allowed_regex):
+            return APPROVE
+        return self.default
+
+    def cache_info(self):
+        return self.decide.cache_info()
@@ -0,0 +1,280 @@
+"""Adaptive admission of the outbound Webex API calls.
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+Each call class (file download, verdict, webhook management) has a token
+bucket, all classes share a concurrency window and the Retry-After pause.
+The window and the bucket rates follow AIMD: a 429 response cuts them down,
+every successful call adds a little back, so the throughput settles just
+under the platform limit instead of collapsing on it. The 429 responses
+of the calls sent before the pause are one signal, they cut the limits once.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT = os.getenv("RATE_LIMIT", "true").lower() in ("true", "yes", "1") # adaptive admission of the Webex calls
+RATE_FILE_PER_SECOND = float(os.getenv("RATE_FILE_PER_SECOND", 100)) # max file HEAD/GET requests per second
+RATE_VERDICT_PER_SECOND = float(os.getenv("RATE_VERDICT_PER_SECOND", 100)) # max verdict PUT requests per second
+RATE_WEBHOOKS_PER_SECOND = float(os.getenv("RATE_WEBHOOKS_PER_SECOND", 5)) # max webhook management requests per second
+RATE_MAX_CONCURRENCY = int(os.getenv("RATE_MAX_CONCURRENCY", 32)) # max calls in flight, the adaptive window stays below
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", 3)) # retries of a call answered by 429
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", 10)) # max seconds a call waits for the admission or Retry-After
+
+DEFAULT_RETRY_AFTER = 1 # seconds, if a 429 response doesn't say
+MIN_RATE_FRACTION = 0.05 # the bucket rate doesn't drop below this fraction of the configured rate
+DECREASE_FACTOR = 0.7 # a 429 multiplies the window and the bucket rate by this
+RATE_INCREASE_FRACTION = 0.1 # fraction of the configured rate added back per second without 429
+ASYNC_POLL_INTERVAL = 0.01 # seconds between the admission checks of a coroutine waiting for a free slot
+
+# call class -> priority, lower is admitted first
+FILE, VERDICT, WEBHOOKS = "file", "verdict", "webhooks"
+PRIORITIES = {VERDICT: 0, FILE: 1, WEBHOOKS: 2}
+
+def parse_retry_after(value, now = None):
+    """
+    Parse the Retry-After header, seconds or an HTTP date.
+
+    Returns:
+        float: seconds to wait, None if the value is missing or invalid
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - (now or time.time()))
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """
+    Token bucket with an adjustable rate.
+
+    Attributes:
+        max_rate (float): configured tokens per second
+        rate (float): current tokens per second
+        capacity (float): max tokens, the allowed burst
+    """
+    def __init__(self, rate, capacity = None, clock = time.monotonic):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate / 10)
+        self._tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self):
+        """
+        Returns:
+            float: seconds until a token is available, 0 if it is
+        """
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self._tokens -= 1
+
+    def decrease(self):
+        self.rate = max(self.max_rate * MIN_RATE_FRACTION, self.rate * DECREASE_FACTOR)
+        self._tokens = min(self._tokens, 0.0)
+
+    def increase(self):
+        # called per call, so the rate grows by RATE_INCREASE_FRACTION of max_rate per second
+        self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_INCREASE_FRACTION / self.rate)
+
+class RateLimiter:
+    """
+    Admission of the calls to one upstream (the Webex API with one Access Token).
+
+    A call is admitted when the Retry-After pause is over, its class bucket
+    has a token and the concurrency window has a free slot. The calls of a class
+    wait in their own queue, in the order of arrival. A free slot of the window
+    goes by the priority of the class, so verdicts go before file downloads
+    and those before the webhook management, but a class whose bucket is empty
+    doesn't hold the calls of the other classes.
+
+    Attributes:
+        buckets (dict): call class -> TokenBucket
+        max_concurrency (int): upper bound of the window
+        window (float): current max number of calls in flight
+        throttled (dict): call class -> number of 429 responses
+    """
+    def __init__(self, rates, max_concurrency, on_throttle = None, clock = time.monotonic):
+        self.buckets = {call_class: TokenBucket(rate, clock = clock) for call_class, rate in rates.items()}
+        self.max_concurrency = max_concurrency
+        self.window = float(max_concurrency)
+        self.throttled = {call_class: 0 for call_class in rates}
+        self._on_throttle = on_throttle
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._waiting = {call_class: deque() for call_class in rates} # call class -> tickets of the waiting calls
+        self._classes = sorted(rates, key = lambda call_class: PRIORITIES.get(call_class, len(PRIORITIES)))
+        self._in_flight = 0
+        self._paused_until = 0.0
+
+    def acquire(self, call_class, timeout = RATE_LIMIT_MAX_WAIT):
+        """
+        Wait for the admission of a call, release() must follow.
+
+        Returns:
+            bool: False if the call wasn't admitted within the timeout
+        """
+        queue = self._waiting[call_class]
+        ticket = object()
+        deadline = None if timeout is None else self._clock() + timeout
+        with self._lock:
+            queue.append(ticket)
+            try:
+                while True:
+                    now = self._clock()
+                    wait = self._admit(call_class, ticket, now)
+                    if wait == 0:
+                        return True
+                    if deadline is not None:
+                        if now >= deadline:
+                            return False
+                        wait = deadline - now if wait is None else min(wait, deadline - now)
+                    self._changed.wait(wait)
+            finally:
+                queue.remove(ticket)
+                self._changed.notify_all()
+
+    async def acquire_async(self, call_class, timeout = RATE_LIMIT_MAX_WAIT):
+        """
+        acquire() for the asyncio server, waits without blocking the event loop.
+
+        The call waits in the class queue together with the threads, as the event
+        loop can't wait on the condition, it checks its admission when the bucket
+        has a token or every ASYNC_POLL_INTERVAL while the window is full.
+
+        Returns:
+            bool: False if the call wasn't admitted within the timeout
+        """
+        queue = self._waiting[call_class]
+        ticket = object()
+        deadline = None if timeout is None else self._clock() + timeout
+        with self._lock:
+            queue.append(ticket)
+        try:
+            while True:
+                with self._lock:
+                    now = self._clock()
+                    wait = self._admit(call_class, ticket, now)
+                if wait == 0:
+                    return True
+                wait = ASYNC_POLL_INTERVAL if wait is None else wait
+                if deadline is not None:
+                    if now >= deadline:
+                        return False
+                    wait = min(wait, deadline - now)
+                await asyncio.sleep(wait)
+        finally:
+            with self._lock:
+                queue.remove(ticket)
+                self._changed.notify_all()
+
+    def _admit(self, call_class, ticket, now):
+        """
+        Admit the call if it's its turn, called with the lock held.
+
+        Returns:
+            float: 0 if admitted, otherwise seconds to wait, None to wait for a release
+        """
+        if self._paused_until > now:
+            return self._paused_until - now
+        if self._waiting[call_class][0] is not ticket:
+            return None
+        bucket = self.buckets[call_class]
+        wait = bucket.wait_time()
+        if wait:
+            return wait
+        if self._in_flight < max(1, int(self.window)) and not self._preferred(call_class):
+            bucket.take()
+            self._in_flight += 1
+            return 0
+        return None # until a slot is free or the preferred call is admitted
+
+    def _preferred(self, call_class):
+        """
+        Check if a call of a higher priority class is ready for the next free slot.
+        """
+        for other in self._classes:
+            if other == call_class:
+                return False
+            if self._waiting[other] and not self.buckets[other].wait_time():
+                return True
+        return False
+
+    def release(self, call_class, status = None, retry_after = None):
+        """
+        Finish a call and adapt the limits by its result.
+
+        A streamed response holds its slot of the window until its body is
+        read or closed, release it then, see webex_http.WebexFileSession.
+
+        Parameters:
+            status (int): HTTP status, None if the call failed without a response
+            retry_after (float): seconds from the Retry-After header of a 429 response
+        """
+        throttled = status == 429
+        with self._lock:
+            self._in_flight -= 1
+            bucket = self.buckets[call_class]
+            if throttled:
+                self.throttled[call_class] += 1
+                now = self._clock()
+                pause = DEFAULT_RETRY_AFTER if retry_after is None else retry_after
+                if now >= self._paused_until:
+                    self.window = max(1.0, self.window * DECREASE_FACTOR)
+                    bucket.decrease()
+                self._paused_until = max(self._paused_until, now + pause)
+                logger.warning("Rate limited on {} calls, window {:.1f}, rate {:.1f}/s, pause {:.1f}s".format(
+                    call_class, self.window, bucket.rate, pause))
+            elif status is not None and status < 500:
+                self.window = min(self.max_concurrency, self.window + 1 / self.window)
+                bucket.increase()
+            self._changed.notify_all()
+        if throttled and self._on_throttle:
+            self._on_throttle(call_class)
+
+    def in_flight(self):
+        return self._in_flight
+
+def default_limiter(on_throttle = None):
+    """
+    Create a limiter of the Webex call classes configured by the environment, None if RATE_LIMIT is off.
+    """
+    if not RATE_LIMIT:
+        return None
+    return RateLimiter({FILE: RATE_FILE_PER_SECOND, VERDICT: RATE_VERDICT_PER_SECOND, WEBHOOKS: RATE_WEBHOOKS_PER_SECOND},
+        RATE_MAX_CONCURRENCY, on_throttle)
@@ -0,0 +1,200 @@
+"""Cache of the Webex space (room) metadata used by the per-space DLP policy.
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+A file of a known space costs a memory lookup. The first file of a space
+waits for one Webex API call, the concurrent files of the same space wait
+for the same call. Spaces which are not found are cached for a shorter time,
+so that a burst of messages in them doesn't repeat the call. Entries used
+by the traffic are refreshed in the background before they expire.
+"""
+
+import time
+import base64
+import logging
+import binascii
+import functools
+import threading
+import concurrent.futures
+from collections import namedtuple
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+ROOM_CACHE_SIZE = 10000
+ROOM_CACHE_TTL = 3600
+ROOM_CACHE_NEGATIVE_TTL = 300
+UUID_CACHE_SIZE = 4096 # memoized webex_uuid() results, the same spaces, teams and organizations repeat
+REFRESH_AHEAD = 0.8 # fraction of the TTL after which a used entry is refreshed in the background
+
+_NOT_FOUND = object() # cached value of a space which doesn't exist or isn't accessible
+
+"""
+Metadata of a Webex space.
+
+Attributes:
+    room_id (str): space id
+    room_type (str): "group" or "direct"
+    team_id (str): team of the space, None if it's not in a team
+    owner_id (str): organization owning the space
+"""
+RoomInfo = namedtuple("RoomInfo", ["room_id", "room_type", "team_id", "owner_id"])
+
+def parse_room(data):
+    """
+    Returns:
+        RoomInfo: metadata from the Webex API room details
+    """
+    return RoomInfo(data.get("id"), data.get("type"), data.get("teamId"), data.get("ownerId"))
+
+@functools.lru_cache(maxsize = UUID_CACHE_SIZE)
+def webex_uuid(webex_id):
+    """
+    Returns:
+        str: the UUID part of a Webex id ("ciscospark://us/ORGANIZATION/<uuid>" base64 encoded),
+        so that ids of the same object from different APIs compare equal, the id itself if it's not encoded
+    """
+    if not webex_id:
+        return webex_id
+    try:
+        decoded = base64.urlsafe_b64decode(webex_id + "=" * (-len(webex_id) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return webex_id
+    if not decoded.startswith("ciscospark://"):
+        return webex_id
+    return decoded.rsplit("/", 1)[-1]
+
+class RoomCache:
+    """
+    TTL and LRU bounded cache of the space metadata with coalesced lookups.
+
+    The 'lookup' callback is called as lookup(token_key, room_id), it returns
+    RoomInfo, None if the space doesn't exist or isn't accessible (cached for
+    'negative_ttl') or raises an exception (not cached). With an 'executor' the
+    lookups run in it, so that get() can stop waiting after its timeout.
+
+    Attributes:
+        stats (dict): "hits", "misses", "coalesced" (misses which waited for another lookup),
+            "lookups", "not_found", "errors", "refreshes"
+    """
+    def __init__(self, lookup, maxsize = ROOM_CACHE_SIZE, ttl = ROOM_CACHE_TTL, negative_ttl = ROOM_CACHE_NEGATIVE_TTL,
+        refresh_ahead = True, executor = None, clock = time.monotonic):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.refresh_ahead = refresh_ahead
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "lookups": 0, "not_found": 0, "errors": 0, "refreshes": 0}
+        self._lookup = lookup
+        self._executor = executor
+        self._clock = clock
+        self._cache = TTLCache(maxsize, ttl, clock) # room id -> (time looked up, RoomInfo or _NOT_FOUND)
+        self._inflight = {} # room id -> Future of the running lookup
+        self._lock = threading.Lock()
+
+    def peek(self, room_id):
+        """
+        Get the cached metadata without a lookup.
+
+        Returns:
+            tuple: (True, RoomInfo or None if not found) if cached, (False, None) if not
+        """
+        entry = self._cache.get(room_id)
+        if entry is None:
+            return False, None
+        return True, self._value(room_id, entry)
+
+    def get(self, room_id, token_key, timeout = None):
+        """
+        Get the metadata of a space, look it up if it's not cached.
+
+        Parameters:
+            timeout (float): max seconds to wait for the lookup, None to wait until it's done
+
+        Returns:
+            RoomInfo: metadata, None if the space is not found, the lookup failed or didn't finish in time
+        """
+        entry = self._cache.get(room_id)
+        if entry is not None:
+            self._count("hits")
+            return self._value(room_id, entry, token_key)
+        self._count("misses")
+        future, started = self._start(room_id, token_key)
+        if not started:
+            self._count("coalesced")
+        elif self._executor is not None:
+            self._executor.submit(self._run, future, room_id, token_key)
+        else:
+            self._run(future, room_id, token_key)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            logger.warning("Lookup of space %s not finished in %ss", room_id, timeout)
+            return None
+
+    def prefetch(self, room_id, token_key):
+        """
+        Start the lookup of a space in the executor if it's not cached, e.g. when its webhook arrives.
+        """
+        if self._executor is None or room_id in self._cache:
+            return
+        future, started = self._start(room_id, token_key)
+        if started:
+            self._executor.submit(self._run, future, room_id, token_key)
+
+    def _value(self, room_id, entry, token_key = None):
+        looked_up, value = entry
+        if token_key and self.refresh_ahead and self._executor and self._clock() - looked_up > self.ttl * REFRESH_AHEAD:
+            future, started = self._start(room_id, token_key)
+            if started:
+                self._count("refreshes")
+                self._executor.submit(self._run, future, room_id, token_key)
+        return None if value is _NOT_FOUND else value
+
+    def _count(self, stat):
+        with self._lock: # the worker threads count concurrently
+            self.stats[stat] += 1
+
+    def _start(self, room_id, token_key):
+        with self._lock:
+            future = self._inflight.get(room_id)
+            if future is not None:
+                return future, False
+            future = self._inflight[room_id] = concurrent.futures.Future()
+            return future, True
+
+    def _run(self, future, room_id, token_key):
+        room = None
+        try:
+            self._count("lookups")
+            room = self._lookup(token_key, room_id)
+            if room is None:
+                self._count("not_found")
+                self._cache.put(room_id, (self._clock(), _NOT_FOUND), self.negative_ttl)
+            else:
+                self._cache.put(room_id, (self._clock(), room))
+        except Exception as e:
+            self._count("errors")
+            logger.warning("Lookup of space %s failed: %s", room_id, e)
+        finally:
+            with self._lock:
+                self._inflight.pop(room_id, None)
+            future.set_result(room)
+
+    def clear(self):
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
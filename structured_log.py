@@ -0,0 +1,205 @@
+"""Log output which doesn't hold the request threads.
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+The request thread only creates the log record and puts it in a bounded
+queue. The message arguments are merged, the record formatted and written
+by a background thread, a record which doesn't fit the queue is dropped
+and counted. The log arguments must not be modified after the call.
+
+Records get the correlation ids of the event and the file being processed
+(see log_context()), the JSON formatter writes them with the message as
+a compact JSON object per line. High-volume lines can be limited by
+RateLimitFilter, the suppressed records are counted in the next passed one.
+"""
+
+import json
+import time
+import queue
+import atexit
+import hashlib
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+QUEUE_SIZE = 10000
+CLOSE_TIMEOUT = 2 # seconds the exit waits for the queued records to be written
+
+log_ids = contextvars.ContextVar("log_ids", default = {}) # correlation ids added to the records
+# attributes of every LogRecord, the others are extra fields
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+def short_id(value):
+    """
+    Returns:
+        str: short stable hash of the value, used as a correlation id
+    """
+    return hashlib.sha1(str(value).encode()).hexdigest()[:12]
+
+@contextmanager
+def log_context(**ids):
+    """
+    Add the correlation ids (e.g. event, file) to the records logged in the block.
+    """
+    token = log_ids.set(dict(log_ids.get(), **ids))
+    try:
+        yield
+    finally:
+        log_ids.reset(token)
+
+def install_record_factory():
+    """
+    Add the correlation ids of the current context to every record, in the thread which logs it.
+    """
+    factory = logging.getLogRecordFactory()
+
+    def create_record(*args, **kwargs):
+        record = factory(*args, **kwargs)
+        ids = log_ids.get()
+        if ids:
+            record.__dict__.update(ids)
+        return record
+
+    logging.setLogRecordFactory(create_record)
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format a record as a compact JSON object, with the correlation ids and other extra fields.
+    """
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "src": "{}:{}".format(record.funcName, record.lineno),
+            "msg": record.getMessage(),
+        }
+        for name, value in record.__dict__.items():
+            if name not in RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, separators = (",", ":"), default = str)
+
+class RateLimitFilter(logging.Filter):
+    """
+    Pass at most 'rate' records per second below WARNING, by a token bucket.
+
+    Attributes:
+        suppressed (int): total records not passed
+    """
+    def __init__(self, rate, clock = time.monotonic):
+        super().__init__()
+        self.rate = rate
+        self.suppressed = 0
+        self._clock = clock
+        self._tokens = rate
+        self._updated = clock()
+        self._pending = 0 # suppressed since the last passed record
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                self._pending += 1
+                self.suppressed += 1
+                return False
+            self._tokens -= 1
+            pending, self._pending = self._pending, 0
+        if pending:
+            record.suppressed = pending
+        return True
+
+class LogWriter:
+    """
+    Background thread handling the records queued by the AsyncHandlers.
+
+    Attributes:
+        dropped (int): records dropped because the queue was full
+    """
+    def __init__(self, queue_size = QUEUE_SIZE):
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize = queue_size)
+        self._thread = threading.Thread(target = self._run, name = "log_writer", daemon = True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, handler, record):
+        try:
+            self._queue.put_nowait((handler, record))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            handler, record = item
+            handler.handle(record)
+
+    def close(self):
+        """
+        Write the queued records, called at the interpreter exit. The records
+        not written in CLOSE_TIMEOUT (e.g. stuck output) are counted as dropped.
+        """
+        try:
+            self._queue.put(None, timeout = CLOSE_TIMEOUT)
+            self._thread.join(CLOSE_TIMEOUT)
+        except queue.Full:
+            pass
+        if self._thread.is_alive():
+            self.dropped += self._queue.qsize()
+
+class AsyncHandler(logging.Handler):
+    """
+    Pass the records to another handler by the LogWriter thread.
+    """
+    def __init__(self, target, writer):
+        super().__init__(target.level)
+        self.target = target
+        self.writer = writer
+
+    def handle(self, record):
+        # no handler lock, the queue is thread-safe
+        if self.filter(record):
+            self.writer.put(self.target, record)
+        return record
+
+    def emit(self, record):
+        self.writer.put(self.target, record)
+
+def write_in_background(loggers, queue_size = QUEUE_SIZE):
+    """
+    Move the output of the handlers of the loggers to a LogWriter thread.
+
+    Parameters:
+        loggers (list): loggers whose handlers are replaced by AsyncHandlers
+
+    Returns:
+        LogWriter: the writer
+    """
+    writer = LogWriter(queue_size)
+    for logger in loggers:
+        logger.handlers = [handler if isinstance(handler, AsyncHandler) else AsyncHandler(handler, writer)
+            for handler in logger.handlers]
+    return writer
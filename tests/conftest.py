@@ -0,0 +1,6 @@
+"""The application modules are top level files of the repository."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
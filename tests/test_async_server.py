@@ -0,0 +1,90 @@
+"""The aiohttp server inspects the files of a webhook and sends the verdict PUT."""
+
+import asyncio
+import itertools
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer, TestClient
+
+import compliance_inspect as ci
+import compliance_inspect_async as cia
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 2000
+CARD_NUMBERS_CSV = b"name,card\n" + b"John Doe,4111111111111111\n" * 20
+
+message_ids = itertools.count()
+
+class FakeFiles:
+    """Webex file host stand-in: HEAD and GET of the files, verdict PUTs are recorded."""
+    def __init__(self, files, throttle_puts = 0):
+        self.files = files # file id -> (Content-Type, data)
+        self.verdicts = []
+        self.throttle_puts = throttle_puts # number of verdict PUTs answered by 429
+
+    async def handle(self, request):
+        file_id = request.match_info["id"].split(",")[0]
+        content_type, data = self.files[file_id]
+        if request.method == "PUT":
+            if self.throttle_puts:
+                self.throttle_puts -= 1
+                return web.Response(status = 429, headers = {"Retry-After": "0"})
+            self.verdicts.append((file_id, request.query["result"]))
+            return web.Response(status = 204)
+        headers = {"Content-Type": content_type}
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(data))
+            return web.Response(headers = headers)
+        return web.Response(body = data, headers = headers)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_route("*", "/v1/contents/{id}", self.handle)
+        return app
+
+def webhook(file_urls):
+    return {"resource": "messages", "event": "created", "orgId": "org-1",
+        "data": {"id": "async-message-{}".format(next(message_ids)), "roomId": "room-1", "roomType": "group", "files": file_urls}}
+
+@pytest.fixture
+def server_mode(monkeypatch):
+    monkeypatch.setattr(ci, "FAST_START", True)
+    monkeypatch.setattr(ci, "POLICY_POLLER", False)
+    monkeypatch.setattr(ci, "WEBHOOK_ASYNC", False)
+    monkeypatch.setattr(ci, "VERDICT_CACHE", False)
+    monkeypatch.setattr(ci, "start_token_refresher", lambda: None)
+    monkeypatch.setattr(ci, "org_sessions", {})
+    cache = ci.WebexClientCache()
+    cache.store(ci.wxt_token_key, ci.AccessTokenAbs({"access_token": "access", "refresh_token": "refresh",
+        "expires_in": 14 * 24 * 3600, "refresh_token_expires_in": 90 * 24 * 3600}))
+    monkeypatch.setattr(ci, "webex_client_cache", cache)
+
+async def post_webhook(files, payload_files):
+    async with TestServer(files.app()) as file_server, TestClient(TestServer(cia.create_app())) as client:
+        urls = [str(file_server.make_url("/v1/contents/{}".format(file_id))) for file_id in payload_files]
+        response = await client.post("/", json = webhook(urls))
+        return response.status
+
+def test_webhook_files_get_verdicts(server_mode):
+    files = FakeFiles({"image-1": ("image/png", PNG), "csv-1": ("image/png", CARD_NUMBERS_CSV)})
+    assert asyncio.run(post_webhook(files, ["image-1", "csv-1"])) == 200
+    assert sorted(files.verdicts) == [("csv-1", "reject"), ("image-1", "approve")]
+
+def test_invalid_webhook_is_refused(server_mode):
+    async def post():
+        async with TestClient(TestServer(cia.create_app())) as client:
+            response = await client.post("/", json = {"resource": "messages"})
+            return response.status
+    assert asyncio.run(post()) == 400
+
+def test_requests_go_through_the_rate_limiter(server_mode):
+    files = FakeFiles({"image-1": ("image/png", PNG)}, throttle_puts = 1)
+    assert asyncio.run(post_webhook(files, ["image-1"])) == 200
+    assert files.verdicts == [("image-1", "approve")] # retried after the 429
+    limiter = ci.org_sessions[ci.wxt_token_key].limiter
+    assert limiter.throttled == {"file": 0, "verdict": 1, "webhooks": 0}
+    assert limiter.window < limiter.max_concurrency
+    assert limiter.in_flight() == 0
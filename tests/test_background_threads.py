@@ -0,0 +1,31 @@
+"""The background threads start with the first request of every process, not only from __main__."""
+
+import pytest
+
+import compliance_inspect as ci
+
+@pytest.fixture
+def started(monkeypatch):
+    started = []
+    monkeypatch.setattr(ci, "background_threads_started", False)
+    monkeypatch.setattr(ci, "FAST_START", True)
+    monkeypatch.setattr(ci, "start_token_refresher", lambda: started.append("tokens"))
+    monkeypatch.setattr(ci.thread_executor, "submit", lambda fn, *args: started.append(fn))
+    return started
+
+def run_first_request_hooks():
+    for hook in ci.flask_app.before_first_request_funcs:
+        hook()
+
+def test_first_request_starts_background_threads(started, monkeypatch):
+    monkeypatch.setattr(ci, "POLICY_POLLER", True)
+    run_first_request_hooks()
+    assert started == ["tokens", ci.policy_store.start]
+    # start_runner() of the development server starts them again
+    ci.start_background_threads()
+    assert started == ["tokens", ci.policy_store.start]
+
+def test_policy_poller_off(started, monkeypatch):
+    monkeypatch.setattr(ci, "POLICY_POLLER", False)
+    run_first_request_hooks()
+    assert started == ["tokens"]
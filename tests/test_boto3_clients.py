@@ -0,0 +1,46 @@
+"""Boto3 clients are created once per service, region and endpoint and reused."""
+
+import threading
+
+import pytest
+
+pytest.importorskip("boto3")
+
+import compliance_inspect as ci
+
+@pytest.fixture
+def endpoint(monkeypatch):
+    monkeypatch.setattr(ci, "ENDPOINT_URL", "http://127.0.0.1:9000")
+    monkeypatch.setattr(ci, "AWS_REGION", "us-east-1")
+    monkeypatch.setattr(ci, "AWS_PROFILE", None)
+    monkeypatch.setattr(ci, "BOTO_POOL_SIZE", 7)
+    ci.reset_boto3_clients()
+    yield
+    ci.reset_boto3_clients()
+
+def test_client_is_reused(endpoint):
+    s3 = ci.get_boto3_client("s3")
+    assert ci.get_boto3_client("s3") is s3
+    assert ci.get_boto3_client("dynamodb") is not s3
+    assert s3.meta.endpoint_url == "http://127.0.0.1:9000"
+    assert s3.meta.config.max_pool_connections == 7
+
+def test_concurrent_callers_get_one_client(endpoint):
+    clients = []
+    threads = [threading.Thread(target = lambda: clients.append(ci.get_boto3_client("s3"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(client) for client in clients}) == 1
+
+def test_endpoint_selects_client(endpoint, monkeypatch):
+    s3 = ci.get_boto3_client("s3")
+    monkeypatch.setattr(ci, "ENDPOINT_URL", "http://127.0.0.1:9001")
+    assert ci.get_boto3_client("s3") is not s3
+
+def test_reset(endpoint):
+    s3 = ci.get_boto3_client("s3")
+    ci.reset_boto3_clients()
+    assert ci.boto3_session is None
+    assert ci.get_boto3_client("s3") is not s3
@@ -0,0 +1,37 @@
+"""Serverless cold start: the imports and the work before the first webhook."""
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+import compliance_inspect as ci
+
+from test_webex_client_cache import tokens, FakeRefresher
+
+REPOSITORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def test_import_skips_the_sdks():
+    environment = dict(os.environ, FAST_START = "true", LOG_FORMAT = "text")
+    code = ("import sys, compliance_inspect; "
+        "print(' '.join(name for name in ('webexteamssdk', 'boto3', 'botocore', 'coloredlogs') if name in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code], cwd = REPOSITORY, env = environment,
+        capture_output = True, text = True, timeout = 60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ""
+
+def test_client_is_created_by_first_use(monkeypatch):
+    monkeypatch.setattr(ci, "load_tokens", lambda token_key, etag = None: (tokens(14 * 86400), "etag-1"))
+    cache = ci.WebexClientCache(safe_delta = 300, refresher = FakeRefresher())
+    assert cache.get_tokens("org").access_token == "access" # the file inspection needs only the tokens
+    assert cache._entries["org"]["client"] is None
+    client = cache.get_client("org")
+    assert client.access_token == "access"
+    assert cache.get_client("org") is client
+
+def test_fast_start_skips_the_bucket_check(monkeypatch):
+    monkeypatch.setattr(ci, "FAST_START", True)
+    monkeypatch.setattr(ci, "start_background_threads", lambda: None)
+    monkeypatch.setattr(ci, "create_bucket", lambda name: pytest.fail("bucket checked on the first request"))
+    ci.startup()
@@ -0,0 +1,102 @@
+"""Deadline scheduler: earliest deadline first, group limits and expiration."""
+
+import time
+import threading
+
+from deadline_scheduler import DeadlineScheduler, DONE, EXPIRED
+
+TIMEOUT = 5
+
+class Recorder:
+    """Run and expire callbacks, the job "block" holds its worker until released."""
+    def __init__(self):
+        self.ran = []
+        self.expired = []
+        self.release = threading.Event()
+        self.blocked = threading.Event()
+        self.condition = threading.Condition()
+
+    def run(self, job):
+        if job == "block":
+            self.blocked.set()
+            self.release.wait(TIMEOUT)
+        with self.condition:
+            self.ran.append(job)
+            self.condition.notify_all()
+
+    def expire(self, job):
+        with self.condition:
+            self.expired.append(job)
+            self.condition.notify_all()
+
+    def wait_for(self, predicate):
+        with self.condition:
+            assert self.condition.wait_for(predicate, TIMEOUT)
+
+def test_earliest_deadline_runs_first():
+    recorder = Recorder()
+    scheduler = DeadlineScheduler(1, recorder.run, recorder.expire)
+    now = time.monotonic()
+    scheduler.submit("block", now + 60)
+    assert recorder.blocked.wait(TIMEOUT)
+    for job, seconds in (("late", 50), ("early", 20), ("middle", 30)):
+        scheduler.submit(job, now + seconds)
+    assert scheduler.pending() == 3
+    recorder.release.set()
+    recorder.wait_for(lambda: len(recorder.ran) == 4)
+    assert recorder.ran == ["block", "early", "middle", "late"]
+    assert recorder.expired == []
+    assert scheduler.pending() == 0
+
+def test_group_at_its_limit_does_not_block_others():
+    recorder = Recorder()
+    scheduler = DeadlineScheduler(2, recorder.run, recorder.expire)
+    now = time.monotonic()
+    scheduler.submit("block", now + 60, [("org-a", 1)])
+    assert recorder.blocked.wait(TIMEOUT)
+    waiting = scheduler.submit("org-a second", now + 10, [("org-a", 1)])
+    scheduler.submit("org-b", now + 20, [("org-b", 1)])
+    recorder.wait_for(lambda: "org-b" in recorder.ran)
+    assert "org-a second" not in recorder.ran
+    assert scheduler.pending("org-a") == 1
+    recorder.release.set()
+    recorder.wait_for(lambda: "org-a second" in recorder.ran)
+    assert waiting.state == DONE
+
+def test_waiting_job_expires_without_running():
+    recorder = Recorder()
+    scheduler = DeadlineScheduler(1, recorder.run, recorder.expire)
+    now = time.monotonic()
+    scheduler.submit("block", now + 60)
+    assert recorder.blocked.wait(TIMEOUT)
+    task = scheduler.submit("too late", now + 0.05)
+    recorder.wait_for(lambda: recorder.expired == ["too late"])
+    assert task.state == EXPIRED
+    assert scheduler.pending() == 0
+    recorder.release.set()
+    recorder.wait_for(lambda: recorder.ran == ["block"])
+    time.sleep(0.05)
+    assert "too late" not in recorder.ran
+
+def test_run_timeout_expires_running_job():
+    recorder = Recorder()
+    scheduler = DeadlineScheduler(1, recorder.run, recorder.expire, run_timeout = 0.05)
+    task = scheduler.submit("block", time.monotonic() + 60)
+    assert recorder.blocked.wait(TIMEOUT)
+    recorder.wait_for(lambda: recorder.expired == ["block"])
+    assert task.state == EXPIRED
+    recorder.release.set()
+    recorder.wait_for(lambda: recorder.ran == ["block"])
+    assert task.state == EXPIRED # the late result doesn't make it done
+
+def test_failing_job_does_not_stop_the_worker():
+    recorder = Recorder()
+    def run(job):
+        if job == "fail":
+            raise ValueError("job failed")
+        recorder.run(job)
+    scheduler = DeadlineScheduler(1, run, recorder.expire)
+    now = time.monotonic()
+    scheduler.submit("fail", now + 10)
+    scheduler.submit("next", now + 20)
+    recorder.wait_for(lambda: recorder.ran == ["next"])
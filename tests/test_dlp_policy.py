@@ -0,0 +1,153 @@
+"""Policy compilation, space rules and the policy reload."""
+
+import json
+
+import pytest
+
+from dlp_policy import compile_policy, resolve_space, PolicyStore
+from mime_policy import APPROVE, REJECT
+from room_cache import RoomInfo
+
+DEFAULTS = {
+    "mime_mode": "allowlist",
+    "allowed": ["image/.*"],
+    "suspect": ["application/msword", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", "application/pdf"],
+    "ooxml": "reject",
+    "content_sniff": True,
+    "zip_inspect": True,
+    "zip_max_ratio": 100,
+    "zip_max_uncompressed": 1024 * 1024 * 1024,
+    "zip_max_members": 10000,
+    "content_scan": False,
+    "keywords": [],
+}
+
+def test_builtin_policy():
+    policy = compile_policy(DEFAULTS)
+    assert policy.mime_policy.decide("image/png") == APPROVE
+    assert policy.mime_policy.decide("application/pdf") == REJECT
+    assert policy.spaces == ()
+    assert not policy.room_lookup
+
+def test_document_overrides_defaults():
+    policy = compile_policy(DEFAULTS, json.dumps({"mime_mode": "denylist", "ooxml": "inspect"}).encode(), "etag-1")
+    assert policy.etag == "etag-1"
+    assert policy.mime_policy.decide("text/plain") == APPROVE
+    assert policy.mime_policy.decide("application/pdf") == REJECT
+    assert policy.mime_policy.decide("application/vnd.openxmlformats-officedocument.wordprocessingml.document") == APPROVE
+
+def test_version_depends_on_fields_only():
+    assert compile_policy(DEFAULTS).version == compile_policy(DEFAULTS, {"description": "same"}, "etag-2").version
+    assert compile_policy(DEFAULTS).version != compile_policy(DEFAULTS, {"keywords": ["project-x"]}).version
+    assert compile_policy(DEFAULTS, {"keywords": ["b", "a"]}).version == compile_policy(DEFAULTS, {"keywords": ["a", " b "]}).version
+
+@pytest.mark.parametrize("document, error", [
+    (b"{not json", "not valid JSON"),
+    ("[1, 2]", "must be a JSON object"),
+    ({"mime_type": "allowlist"}, "unknown policy fields: mime_type"),
+    ({"mime_mode": "allow"}, "mime_mode must be one of"),
+    ({"ooxml": "scan"}, "ooxml must be one of"),
+    ({"content_scan": "yes"}, "content_scan must be true or false"),
+    ({"zip_max_ratio": 0}, "zip_max_ratio must be a positive number"),
+    ({"zip_max_members": True}, "zip_max_members must be a positive number"),
+    ({"keywords": "project-x"}, "keywords must be a list of strings"),
+    ({"allowed": ["image/("]}, "invalid MIME type rule"),
+    ({"spaces": {}}, "spaces must be a list of rules"),
+    ({"spaces": ["room"]}, "space rule 1: space rule must be a JSON object"),
+    ({"spaces": [{"room_ids": ["r1"]}]}, "space rule 1: space rule needs a policy object"),
+    ({"spaces": [{"policy": {}}]}, "space rule 1: space rule needs room_ids, team_ids or external"),
+    ({"spaces": [{"external": "yes", "policy": {}}]}, "space rule 1: external must be true or false"),
+    ({"spaces": [{"room_ids": ["r1"], "owner": "o", "policy": {}}]}, "space rule 1: unknown space rule fields: owner"),
+    ({"spaces": [{"room_ids": ["r1"], "policy": {}}, {"team_ids": ["t1"], "policy": {"zip_max_ratio": -1}}]},
+        "space rule 2: zip_max_ratio must be a positive number"),
+])
+def test_invalid_documents(document, error):
+    with pytest.raises(ValueError, match = error.replace("(", r"\(").replace("[", r"\[")):
+        compile_policy(DEFAULTS, document)
+
+def test_space_rules():
+    policy = compile_policy(DEFAULTS, {"spaces": [
+        {"room_ids": ["r1"], "policy": {"allowed": ["image/.*", "application/pdf"]}},
+        {"team_ids": ["t1"], "policy": {"mime_mode": "denylist"}},
+        {"external": True, "policy": {"allowed": []}},
+    ]})
+    assert policy.room_lookup
+    assert policy.version != compile_policy(DEFAULTS).version
+    assert resolve_space(policy, "r1").mime_policy.decide("application/pdf") == APPROVE
+    assert resolve_space(policy, "r2") is policy
+    # the team and owner rules need the space metadata
+    in_team = RoomInfo("r2", "group", "t1", "org-1")
+    assert resolve_space(policy, "r2", in_team, "org-1").mime_policy.decide("text/plain") == APPROVE
+    external = RoomInfo("r3", "group", None, "org-2")
+    assert resolve_space(policy, "r3", external, "org-1").mime_policy.decide("image/png") == REJECT
+    own = RoomInfo("r3", "group", None, "org-1")
+    assert resolve_space(policy, "r3", own, "org-1") is policy
+
+class FakeLoad:
+    """
+    Policy document source, answers by the ETag like S3 conditional GET.
+    """
+    def __init__(self, document = None, etag = None):
+        self.document = document
+        self.etag = etag
+        self.calls = 0
+        self.error = None
+
+    def __call__(self, etag):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        if self.document is None:
+            return None, None
+        if etag == self.etag:
+            return None, etag
+        return self.document, self.etag
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_policy_store_checks():
+    load = FakeLoad({"keywords": ["project-x"]}, "e1")
+    store = PolicyStore(DEFAULTS, load, interval = 30, clock = FakeClock())
+    builtin = store.current.version
+    assert store.check() == "updated"
+    assert store.current.version != builtin
+    assert store.check() == "not_modified"
+    load.document, load.etag = b"{broken", "e2"
+    assert store.check() == "invalid"
+    assert store.current.etag == "e1"
+    # an invalid document is not parsed again until it changes
+    assert store.check() == "not_modified"
+    load.error = OSError("S3 down")
+    assert store.check() == "error"
+    assert store.current.etag == "e1"
+    assert store.checks == {"updated": 1, "not_modified": 2, "missing": 0, "invalid": 1, "error": 1}
+
+def test_policy_store_checks_inline_when_due():
+    clock = FakeClock()
+    load = FakeLoad({"keywords": ["project-x"]}, "e1")
+    store = PolicyStore(DEFAULTS, load, interval = 30, clock = clock)
+    store.get()
+    store.get()
+    assert load.calls == 1
+    clock.now = 31
+    store.get()
+    assert load.calls == 2
+
+def test_deleted_document_restores_builtin_policy():
+    load = FakeLoad({"mime_mode": "denylist"}, "e1")
+    store = PolicyStore(DEFAULTS, load, interval = 30, clock = FakeClock())
+    builtin = store.current
+    assert store.check() == "updated"
+    assert store.current.mime_policy.decide("text/plain") == APPROVE
+    load.document = None
+    assert store.check() == "missing"
+    assert store.current is builtin
+    assert store.current.mime_policy.decide("text/plain") == REJECT
+    load.document, load.etag = {"mime_mode": "denylist"}, "e2"
+    assert store.check() == "updated"
+    assert store.current.etag == "e2"
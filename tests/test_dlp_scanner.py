@@ -0,0 +1,88 @@
+"""Streaming content scanner: validators, keywords and the chunk boundaries."""
+
+import pytest
+
+import dlp_scanner
+from dlp_scanner import StreamScanner, KeywordRule, default_rules, luhn_valid, ssn_valid, ScanMatch
+
+def chunked(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+def scan_all_splits(data, rules, sizes = (1, 2, 3, 5, 7, 13, 64)):
+    """
+    Scan the data with every chunk size, the results must not depend on it.
+    """
+    results = {StreamScanner(rules).scan(chunked(data, size)) for size in sizes}
+    results.add(StreamScanner(rules).scan([data]))
+    assert len(results) == 1, results
+    return results.pop()
+
+def test_luhn():
+    assert luhn_valid("4111 1111 1111 1111")
+    assert luhn_valid("5500-0000-0000-0004")
+    assert not luhn_valid("4111111111111112")
+
+def test_ssn_ranges():
+    assert ssn_valid("123-45-6789")
+    assert not ssn_valid("000-45-6789")
+    assert not ssn_valid("666-45-6789")
+    assert not ssn_valid("912-45-6789")
+    assert not ssn_valid("123-00-6789")
+    assert not ssn_valid("123-45-0000")
+
+@pytest.mark.parametrize("text, rule, found", [
+    (b"card 4111111111111111 exp", "credit_card", b"4111"),
+    (b"card 4111 1111 1111 1111 exp", "credit_card", b"4111"),
+    (b"card 4111-1111-1111-1111", "credit_card", b"4111"),
+    (b"ssn: 123-45-6789.", "us_ssn", b"123"),
+])
+def test_patterns(text, rule, found):
+    prefix = b"x" * 100
+    match = scan_all_splits(prefix + text, default_rules())
+    assert match == ScanMatch(rule, len(prefix) + text.index(found))
+
+@pytest.mark.parametrize("text", [
+    b"order 4111111111111112 total", # Luhn fails
+    b"id 94111111111111111 x", # part of a longer number
+    b"41111111111111110000", # too long
+    b"ssn 000-45-6789", # never assigned
+    b"phone 123-45-67890", # longer group
+    b"",
+])
+def test_no_false_positives(text):
+    assert scan_all_splits(b"prefix " + text + b" suffix", default_rules()) is None
+
+def test_match_across_every_boundary():
+    text = b"lorem ipsum " * 10 + b"4111111111111111" + b" dolor" * 10
+    offset = text.index(b"4111")
+    for size in range(1, 40):
+        assert StreamScanner(default_rules()).scan(chunked(text, size)) == ScanMatch("credit_card", offset), size
+
+def test_number_continued_in_next_chunk_is_not_cut():
+    # a valid 16-digit prefix followed by more digits in the next chunk is not a card number
+    scanner = StreamScanner(default_rules())
+    assert scanner.feed(b"x" * 50 + b"4111111111111111") is None
+    assert scanner.feed(b"23 end") is None
+    assert scanner.feed(b"", final = True) is None
+
+def test_bounded_memory():
+    scanner = StreamScanner(default_rules(["project-x"]))
+    for _ in range(1000):
+        scanner.feed(b"a" * 4096)
+    assert len(scanner._tail) <= scanner._tail_len
+    assert scanner.bytes_scanned == 4096 * 1000
+
+@pytest.mark.parametrize("automaton", [True, False])
+def test_keywords(monkeypatch, automaton):
+    if not automaton:
+        monkeypatch.setattr(dlp_scanner, "ahocorasick", None)
+    elif dlp_scanner.ahocorasick is None:
+        pytest.skip("pyahocorasick not installed")
+    rules = [KeywordRule("keyword", ["Project-X", "falcon"])]
+    text = b"notes about the PROJECT-x launch"
+    assert scan_all_splits(text, rules) == ScanMatch("keyword", text.index(b"PROJECT"))
+    assert scan_all_splits(b"nothing to see", rules) is None
+
+def test_no_keywords():
+    assert KeywordRule("keyword", []).max_len == 0
+    assert len(default_rules()) == 2
@@ -0,0 +1,84 @@
+"""The deadline fallback runs on the scheduler watchdog, it must not wait for any I/O."""
+
+import pytest
+
+import compliance_inspect as ci
+from dlp_policy import PolicyStore
+from mime_policy import APPROVE, REJECT
+
+class NoLoad:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, etag):
+        self.calls += 1
+        raise AssertionError("policy loaded on the fallback path")
+
+class RecordingExecutor:
+    def __init__(self):
+        self.tasks = []
+
+    def submit(self, fn, *args):
+        self.tasks.append((fn, args))
+
+@pytest.fixture
+def store(monkeypatch):
+    load = NoLoad()
+    # no poller thread and the check is due, get() would load the document
+    monkeypatch.setattr(ci, "policy_store", PolicyStore(ci.builtin_policy(), load, interval = 30))
+    monkeypatch.setattr(ci, "DEFAULT_VERDICT", "policy")
+    return load
+
+def test_fallback_verdict_uses_current_policy(store):
+    file_verdict = ci.FileVerdict("https://files/1")
+    assert ci.fallback_verdict(file_verdict) == REJECT # HEAD not finished
+    file_verdict.content_type = "image/png"
+    assert ci.fallback_verdict(file_verdict) == APPROVE
+    assert store.calls == 0
+
+def test_expire_file_defers_the_fallback(store, monkeypatch):
+    executor = RecordingExecutor()
+    monkeypatch.setattr(ci, "fallback_executor", executor)
+    sent = []
+    file_verdict = ci.FileVerdict("https://files/1")
+    monkeypatch.setattr(file_verdict, "send", lambda result, source: sent.append((result, source)))
+    monkeypatch.setattr(ci, "fallback_verdict", lambda file_verdict: pytest.fail("fallback decided on the watchdog"))
+    ci.expire_file(file_verdict)
+    assert sent == []
+    assert executor.tasks == [(ci.send_fallback_verdict, (file_verdict, "deadline"))]
+
+def test_token_error_sends_the_fallback(store, monkeypatch):
+    def token_storage_down(token_key):
+        raise RuntimeError("S3 down")
+    monkeypatch.setattr(ci, "get_org_session", token_storage_down)
+    monkeypatch.setattr(ci, "DEFAULT_VERDICT", "reject")
+    sent = []
+    file_verdict = ci.FileVerdict("https://files/1")
+    monkeypatch.setattr(file_verdict, "send", lambda result, source: sent.append((result, source)))
+    ci.inspect_and_send(file_verdict)
+    assert sent == [(REJECT, "error")]
+
+def test_send_survives_token_error(monkeypatch):
+    def token_storage_down(token_key):
+        raise RuntimeError("S3 down")
+    monkeypatch.setattr(ci, "get_org_session", token_storage_down)
+    file_verdict = ci.FileVerdict("https://files/1")
+    assert file_verdict.send(REJECT, "error")
+    assert file_verdict.done.is_set()
+    assert not file_verdict.send(APPROVE, "deadline") # only the first verdict
+
+def test_no_token_sends_default_verdict(store, monkeypatch):
+    monkeypatch.setattr(ci, "get_org_session", lambda token_key: None)
+    monkeypatch.setattr(ci, "DEFAULT_VERDICT", "approve")
+    sent = []
+    file_verdict = ci.FileVerdict("https://files/1", event_key = ("messages", "created", "m1"))
+    ci.seen_events.add(file_verdict.event_key)
+    monkeypatch.setattr(file_verdict, "send", lambda result, source: sent.append((result, source)))
+    ci.inspect_and_send(file_verdict)
+    assert sent == [(APPROVE, "token")]
+    assert ci.seen_events.add(file_verdict.event_key) # the redelivery is accepted
+
+def test_fallback_and_room_lookups_have_own_executors():
+    executors = {ci.thread_executor, ci.fallback_executor, ci.room_executor}
+    assert len(executors) == 3
+    assert ci.room_cache._executor is ci.room_executor
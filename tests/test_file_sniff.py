@@ -0,0 +1,103 @@
+"""Content sniffing and the type decided by the policy."""
+
+import io
+import zipfile
+
+import pytest
+
+from file_sniff import (sniff_mime_type, checked_mime_type, sniff_remote, is_conclusive,
+    UNVERIFIED_MIME_TYPE, ZIP_MIME_TYPE, OLE2_MIME_TYPE)
+
+CARD_NUMBERS_CSV = b"name,card\nJohn Doe,4111111111111111\nJane Doe,5500000000000004\n"
+
+def docx_bytes():
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as package:
+        package.writestr("[Content_Types].xml", "<Types/>")
+        package.writestr("word/document.xml", "<document/>")
+    return data.getvalue()
+
+@pytest.mark.parametrize("data, mime_type", [
+    (b"%PDF-1.7\n", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n\x00\x00", "image/png"),
+    (b"\xff\xd8\xff\xe0\x00\x10JFIF", "image/jpeg"),
+    (b"GIF89a\x01\x00", "image/gif"),
+    (b"RIFF\x00\x00\x00\x00WEBPVP8 ", "image/webp"),
+    (b"RIFF\x00\x00\x00\x00WAVEfmt ", "audio/wav"),
+    (b"\x00\x00\x00\x18ftypheic", "image/heic"),
+    (b"\x00\x00\x00\x18ftypheix", "image/heic"),
+    (b"\x00\x00\x00\x18ftyphevc", "image/heic-sequence"),
+    (b"\x00\x00\x00\x18ftypmsf1", "image/heif-sequence"),
+    (b"\x00\x00\x00\x18ftypmp42", "video/mp4"),
+    (b"ID3\x04\x00", "audio/mpeg"),
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", OLE2_MIME_TYPE),
+    (CARD_NUMBERS_CSV, None),
+])
+def test_sniff_signatures(data, mime_type):
+    assert sniff_mime_type(data) == mime_type
+
+def test_sniff_ooxml_package():
+    data = docx_bytes()
+    assert sniff_mime_type(data) == "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+    # the first member is not yet known from the first bytes
+    assert sniff_mime_type(data[:4]) == ZIP_MIME_TYPE
+    assert not is_conclusive(ZIP_MIME_TYPE)
+
+def test_claimed_media_type_without_signature_is_unverified():
+    # a CSV renamed to .png must not keep the image type, which skips the content scan
+    assert checked_mime_type("image/png", sniff_mime_type(CARD_NUMBERS_CSV)) == UNVERIFIED_MIME_TYPE
+    assert checked_mime_type("video/mp4", None) == UNVERIFIED_MIME_TYPE
+    assert checked_mime_type("audio/mpeg", None) == UNVERIFIED_MIME_TYPE
+
+def test_text_media_type_keeps_claimed_type():
+    # SVG has no binary signature, it keeps its type and is scanned
+    assert checked_mime_type("image/svg+xml", None) == "image/svg+xml"
+    assert checked_mime_type("audio/x-mpegurl", None) == "audio/x-mpegurl"
+    assert checked_mime_type("image/svg+xml", "application/pdf") == "application/pdf"
+
+def test_checked_type_prefers_sniffed_type():
+    assert checked_mime_type("image/png", "image/png") == "image/png"
+    assert checked_mime_type("image/png", "application/pdf") == "application/pdf"
+    assert checked_mime_type("text/csv", None) == "text/csv"
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+        self.closed = False
+        self.read = 0
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.data), chunk_size):
+            self.read += chunk_size
+            yield self.data[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+class FakeSession:
+    def __init__(self, data):
+        self.response = FakeResponse(data)
+        self.headers = None
+
+    def get(self, url, headers = None, stream = False):
+        self.headers = headers
+        return self.response
+
+def test_sniff_remote_stops_at_conclusive_type():
+    session = FakeSession(b"\x89PNG\r\n\x1a\n" + b"\x00" * 100000)
+    mime_type, head = sniff_remote(session, "https://files/1", 4096, step = 512)
+    assert mime_type == "image/png"
+    assert session.headers == {"Range": "bytes=0-4095"}
+    assert session.response.read == 512
+    assert session.response.closed
+    assert len(head) == 512
+
+def test_sniff_remote_ignored_range_reads_max_bytes():
+    session = FakeSession(CARD_NUMBERS_CSV * 1000)
+    mime_type, head = sniff_remote(session, "https://files/1", 4096, step = 512)
+    assert mime_type is None
+    assert len(head) == 4096
+    assert session.response.read == 4096
@@ -0,0 +1,115 @@
+"""Verdicts of compliance_inspect.inspect_file() for spoofed file types."""
+
+import re
+
+import pytest
+
+import compliance_inspect as ci
+from dlp_policy import compile_policy
+from mime_policy import APPROVE, REJECT
+from verdict_cache import VerdictCache
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 2000
+CARD_NUMBERS_CSV = b"name,card\n" + b"John Doe,4111111111111111\n" * 20
+HEIC = b"\x00\x00\x00\x18ftypheix\x00\x00\x00\x00mif1heic" + b"\x00" * 2000
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg"><text>%s</text></svg>'
+
+class FakeResponse:
+    def __init__(self, data, headers = None):
+        self.data = data
+        self.headers = headers or {}
+        self.status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.data), chunk_size):
+            yield self.data[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+class FakeFileSession:
+    """
+    Serve one file with the claimed Content-Type, with Range support.
+    """
+    def __init__(self, data, content_type):
+        self.data = data
+        self.content_type = content_type
+        self.gets = 0
+
+    def head(self, url):
+        return FakeResponse(b"", {"Content-Type": self.content_type, "Content-Length": str(len(self.data))})
+
+    def get(self, url, headers = None, stream = False):
+        self.gets += 1
+        data = self.data
+        match = re.match(r"bytes=(\d+)-(\d*)", (headers or {}).get("Range", ""))
+        if match:
+            end = int(match.group(2)) + 1 if match.group(2) else len(data)
+            data = data[int(match.group(1)):end]
+        return FakeResponse(data)
+
+@pytest.fixture
+def policy(monkeypatch):
+    def use(**document):
+        snapshot = compile_policy(ci.builtin_policy(), dict(document, content_scan = True))
+        monkeypatch.setattr(ci.policy_store, "get", lambda: snapshot)
+    monkeypatch.setattr(ci, "VERDICT_CACHE", False)
+    return use
+
+def test_real_image_is_approved_without_scan(policy):
+    policy()
+    session = FakeFileSession(PNG, "image/png")
+    assert ci.inspect_file("https://files/1", session) == APPROVE
+    assert session.gets == 1 # only the sniffing
+
+def test_csv_claimed_as_image_is_rejected_by_allowlist(policy):
+    policy(mime_mode = "allowlist")
+    assert ci.inspect_file("https://files/1", FakeFileSession(CARD_NUMBERS_CSV, "image/png")) == REJECT
+
+def test_csv_claimed_as_image_is_scanned_by_denylist(policy):
+    policy(mime_mode = "denylist")
+    session = FakeFileSession(CARD_NUMBERS_CSV, "image/png")
+    assert ci.inspect_file("https://files/1", session) == REJECT
+    assert session.gets == 2 # sniffing and the content scan
+
+def test_claimed_image_is_scanned_without_sniffing(policy):
+    policy(mime_mode = "denylist", content_sniff = False)
+    assert ci.inspect_file("https://files/1", FakeFileSession(CARD_NUMBERS_CSV, "image/png")) == REJECT
+
+def test_heic_brand_is_approved_by_allowlist(policy):
+    policy(mime_mode = "allowlist")
+    assert ci.inspect_file("https://files/1", FakeFileSession(HEIC, "image/heic")) == APPROVE
+
+def test_svg_keeps_type_and_is_scanned(policy):
+    policy(mime_mode = "allowlist")
+    session = FakeFileSession(SVG % b"logo", "image/svg+xml")
+    assert ci.inspect_file("https://files/1", session) == APPROVE
+    assert session.gets == 2 # sniffing and the content scan
+    assert ci.inspect_file("https://files/1", FakeFileSession(SVG % CARD_NUMBERS_CSV, "image/svg+xml")) == REJECT
+
+def text_file(middle):
+    # the same size, beginning and end, only the middle differs
+    return b"a" * 10000 + middle.ljust(200, b" ") + b"z" * 10000
+
+def test_changed_middle_is_not_a_cache_hit(policy, monkeypatch):
+    policy(mime_mode = "denylist")
+    monkeypatch.setattr(ci, "VERDICT_CACHE", True)
+    monkeypatch.setattr(ci, "VERDICT_CACHE_PERSIST", False)
+    monkeypatch.setattr(ci, "verdict_cache", VerdictCache(1024 * 1024))
+    assert ci.inspect_file("https://files/1", FakeFileSession(text_file(b"template"), "text/plain")) == APPROVE
+    filled = FakeFileSession(text_file(b"card 4111111111111111"), "text/plain")
+    assert ci.inspect_file("https://files/2", filled) == REJECT
+
+def test_rejection_is_cached(policy, monkeypatch):
+    policy(mime_mode = "denylist")
+    monkeypatch.setattr(ci, "VERDICT_CACHE", True)
+    monkeypatch.setattr(ci, "VERDICT_CACHE_PERSIST", False)
+    monkeypatch.setattr(ci, "verdict_cache", VerdictCache(1024 * 1024))
+    data = text_file(b"card 4111111111111111")
+    assert ci.inspect_file("https://files/1", FakeFileSession(data, "text/plain")) == REJECT
+    copy = FakeFileSession(data, "text/plain")
+    assert ci.inspect_file("https://files/2", copy) == REJECT
+    assert copy.gets == 2 # sniffing and the tail sample, no scan
@@ -0,0 +1,68 @@
+"""Counters, gauges and histograms rendered in the Prometheus text format."""
+
+import pytest
+
+import compliance_inspect as ci
+from metrics import Registry, Counter, Gauge, Histogram
+
+def test_counter_and_gauge():
+    registry = Registry()
+    verdicts = Counter("verdicts_total", "Verdicts", ["result"], registry = registry)
+    in_flight = Gauge("in_flight", "Files in flight", registry = registry)
+    verdicts.inc(result = "approve")
+    verdicts.inc(2, result = "reject")
+    with in_flight.track_inprogress():
+        assert in_flight.get() == 1
+    assert in_flight.get() == 0
+    assert verdicts.get(result = "reject") == 2
+    assert registry.render() == "\n".join([
+        "# HELP verdicts_total Verdicts",
+        "# TYPE verdicts_total counter",
+        'verdicts_total{result="approve"} 1',
+        'verdicts_total{result="reject"} 2',
+        "# HELP in_flight Files in flight",
+        "# TYPE in_flight gauge",
+        "in_flight 0",
+    ]) + "\n"
+
+def test_missing_label():
+    counter = Counter("errors_total", "Errors", ["kind"], registry = Registry())
+    with pytest.raises(ValueError):
+        counter.inc()
+
+def test_label_value_is_escaped():
+    registry = Registry()
+    Counter("events_total", "Events", ["name"], registry = registry).inc(name = 'a "b"\n')
+    assert 'events_total{name="a \\"b\\"\\n"} 1' in registry.render()
+
+def test_histogram_buckets_and_quantiles():
+    registry = Registry()
+    stage = Histogram("stage_seconds", "Stages", ["stage"], buckets = (0.1, 1), registry = registry)
+    for value in (0.05, 0.05, 0.5, 5):
+        stage.observe(value, stage = "head")
+    assert stage.count(stage = "head") == 4
+    assert stage.quantile(0.5, stage = "head") == 0.1
+    assert stage.quantile(0.99, stage = "head") == 1 # the +Inf bucket reports its lower bound
+    assert stage.quantile(0.5, stage = "put") is None
+    text = registry.render()
+    assert 'stage_seconds_bucket{stage="head",le="0.1"} 2' in text
+    assert 'stage_seconds_bucket{stage="head",le="1"} 3' in text
+    assert 'stage_seconds_bucket{stage="head",le="+Inf"} 4' in text
+    assert 'stage_seconds_sum{stage="head"} 5.6' in text
+    assert 'stage_seconds_quantile{stage="head",quantile="0.5"} 0.1' in text
+
+def test_timer_observes_failed_block():
+    stage = Histogram("timed_seconds", "Timed", ["stage"], registry = Registry())
+    with pytest.raises(RuntimeError):
+        with stage.time(stage = "scan"):
+            raise RuntimeError("failed")
+    assert stage.count(stage = "scan") == 1
+
+def test_metrics_route():
+    with ci.flask_app.test_request_context("/metrics"):
+        response = ci.metrics_endpoint()
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    text = response.get_data(as_text = True)
+    assert "# TYPE dlp_stage_seconds histogram" in text
+    assert "dlp_file_queue_depth" in text
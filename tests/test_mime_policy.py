@@ -0,0 +1,32 @@
+"""Compiled MIME allow/deny rules."""
+
+from mime_policy import MimePolicy, normalize_mime_type, split_rules, APPROVE, REJECT
+
+def test_normalize_mime_type():
+    assert normalize_mime_type("Image/PNG; charset=binary") == "image/png"
+    assert normalize_mime_type(" text/plain ") == "text/plain"
+
+def test_split_rules():
+    exact, regex = split_rules(["image/png", "Text/Plain", "video/.*", "video/.*"])
+    assert exact == {"image/png", "text/plain"}
+    assert regex.pattern == "(?:video/.*)"
+    assert split_rules(["image/png"])[1] is None
+
+def test_deny_has_precedence():
+    policy = MimePolicy(allowed = ["image/.*", "text/plain"], denied = ["image/svg\\+xml"])
+    assert policy.decide("image/png") == APPROVE
+    assert policy.decide("TEXT/PLAIN; charset=utf-8") == APPROVE
+    assert policy.decide("image/svg+xml") == REJECT
+    assert policy.decide("application/pdf") == REJECT
+
+def test_default_verdict():
+    policy = MimePolicy(denied = ["application/x-msdownload"], default = APPROVE)
+    assert policy.decide("application/pdf") == APPROVE
+    assert policy.decide("application/x-msdownload") == REJECT
+
+def test_decisions_are_memoized():
+    policy = MimePolicy(allowed = ["image/.*"])
+    for _ in range(3):
+        policy.decide("image/png")
+    info = policy.cache_info()
+    assert (info.hits, info.misses) == (2, 1)
@@ -0,0 +1,50 @@
+"""Tokens, sessions and concurrency limits per Webex organization."""
+
+import pytest
+
+import compliance_inspect as ci
+
+@pytest.fixture
+def multi_org(monkeypatch):
+    monkeypatch.setattr(ci, "MULTI_ORG", True)
+    monkeypatch.setattr(ci, "org_sessions", {})
+
+def test_token_key_is_the_organization(multi_org):
+    assert ci.get_token_key({"orgId": "Y2lzY29zcGFyazovL3VzL09SR0FOSVpBVElPTi8x"}) == "Y2lzY29zcGFyazovL3VzL09SR0FOSVpBVElPTi8x"
+    assert ci.get_token_key({"orgId": "../../other"}) is None # not usable as a storage key
+    assert ci.get_token_key({}) is None
+    assert not ci.is_valid_webhook({"resource": "messages", "data": {"roomId": "room-1"}})
+
+def test_single_org_key(monkeypatch):
+    monkeypatch.setattr(ci, "MULTI_ORG", False)
+    assert ci.get_token_key({"orgId": "org-1"}) == ci.wxt_token_key
+
+def test_tokens_are_stored_per_org():
+    assert ci.get_webex_token_file("org-1") != ci.get_webex_token_file("org-2")
+    assert ci.get_webex_token_file("org-1").endswith("org-1.json")
+
+def test_session_and_limiter_per_org(multi_org):
+    first = ci.get_file_session("org-1")
+    assert ci.get_file_session("org-1") is first
+    second = ci.get_file_session("org-2")
+    assert second is not first
+    if first.limiter:
+        assert second.limiter is not first.limiter
+
+class RecordingScheduler:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, job, deadline, groups = ()):
+        self.submitted.append((job, tuple(groups)))
+
+def test_files_are_limited_per_org(multi_org, monkeypatch):
+    scheduler = RecordingScheduler()
+    monkeypatch.setattr(ci, "file_scheduler", scheduler)
+    monkeypatch.setattr(ci, "ORG_FILE_CONCURRENCY", 3)
+    monkeypatch.setattr(ci, "prefetch_room", lambda room_id, token_key: None)
+    ci.inspect_files(["https://files/org-1/1", "https://files/org-1/2"], token_key = "org-1")
+    ci.inspect_files(["https://files/org-2/1"], token_key = "org-2")
+    groups = [groups for job, groups in scheduler.submitted]
+    assert [group[1] for group in groups] == [("org-1", 3), ("org-1", 3), ("org-2", 3)]
+    assert groups[0][0] == groups[1][0] != groups[2][0] # the files of a message share its group
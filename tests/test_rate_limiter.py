@@ -0,0 +1,203 @@
+"""Admission of the Webex calls: per-class queues, priorities, AIMD and the streamed bodies."""
+
+import gc
+import time
+import asyncio
+import threading
+
+from rate_limiter import RateLimiter, TokenBucket, parse_retry_after, FILE, VERDICT, WEBHOOKS
+from webex_http import WebexFileSession, release_with_body
+
+def start_acquire(limiter, call_class, admitted, timeout = 5):
+    def run():
+        if limiter.acquire(call_class, timeout):
+            admitted.append(call_class)
+    thread = threading.Thread(target = run, daemon = True)
+    thread.start()
+    return thread
+
+def wait_for(condition, timeout = 2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+def test_parse_retry_after():
+    assert parse_retry_after("2") == 2
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Mon, 18 Oct 2021 07:00:10 GMT", now = 1634540400) == 10
+
+def test_empty_bucket_does_not_block_other_classes():
+    limiter = RateLimiter({FILE: 100, VERDICT: 1, WEBHOOKS: 1}, 8)
+    assert limiter.acquire(VERDICT, 0) # the only verdict token
+    admitted = []
+    waiting_verdict = start_acquire(limiter, VERDICT, admitted, timeout = 0.5)
+    wait_for(lambda: limiter._waiting[VERDICT])
+    started = time.monotonic()
+    assert limiter.acquire(FILE, 0.2)
+    assert time.monotonic() - started < 0.1
+    waiting_verdict.join()
+
+def test_free_slot_goes_by_priority():
+    limiter = RateLimiter({FILE: 100, VERDICT: 100, WEBHOOKS: 100}, 1)
+    assert limiter.acquire(FILE, 0)
+    admitted = []
+    threads = [start_acquire(limiter, WEBHOOKS, admitted)]
+    wait_for(lambda: limiter._waiting[WEBHOOKS])
+    threads.append(start_acquire(limiter, FILE, admitted))
+    wait_for(lambda: limiter._waiting[FILE])
+    threads.append(start_acquire(limiter, VERDICT, admitted))
+    wait_for(lambda: limiter._waiting[VERDICT])
+    for expected in ([VERDICT], [VERDICT, FILE], [VERDICT, FILE, WEBHOOKS]):
+        limiter.release(FILE, 200)
+        wait_for(lambda: admitted == expected)
+    for thread in threads:
+        thread.join()
+
+def test_class_queue_is_fifo():
+    limiter = RateLimiter({FILE: 100, VERDICT: 100, WEBHOOKS: 100}, 1)
+    assert limiter.acquire(FILE, 0)
+    order = []
+    threads = []
+    for index in range(3):
+        thread = threading.Thread(target = lambda index = index: limiter.acquire(FILE, 5) and order.append(index), daemon = True)
+        thread.start()
+        threads.append(thread)
+        wait_for(lambda: len(limiter._waiting[FILE]) == index + 1)
+    for index in range(3):
+        limiter.release(FILE, 200)
+        wait_for(lambda: len(order) == index + 1)
+    assert order == [0, 1, 2]
+
+def test_async_acquire_waits_for_free_slot():
+    limiter = RateLimiter({FILE: 100, VERDICT: 100, WEBHOOKS: 100}, 1)
+    assert limiter.acquire(FILE, 0)
+    threading.Timer(0.05, limiter.release, (FILE, 200)).start()
+    started = time.monotonic()
+    assert asyncio.run(limiter.acquire_async(VERDICT, 2))
+    assert time.monotonic() - started >= 0.04
+    assert limiter.in_flight() == 1
+    assert not limiter._waiting[VERDICT]
+
+def test_async_acquire_timeout():
+    limiter = RateLimiter({FILE: 100, VERDICT: 100, WEBHOOKS: 100}, 1)
+    assert limiter.acquire(FILE, 0)
+    assert not asyncio.run(limiter.acquire_async(FILE, 0.05))
+    assert not limiter._waiting[FILE]
+
+def test_async_waiter_keeps_class_order():
+    limiter = RateLimiter({FILE: 100, VERDICT: 100, WEBHOOKS: 100}, 1)
+    assert limiter.acquire(FILE, 0)
+    admitted = []
+    async def wait_async():
+        if await limiter.acquire_async(FILE, 2):
+            admitted.append("async")
+    def run_async():
+        asyncio.run(wait_async())
+    first = threading.Thread(target = run_async, daemon = True)
+    first.start()
+    wait_for(lambda: limiter._waiting[FILE])
+    second = start_acquire(limiter, FILE, admitted, timeout = 2)
+    wait_for(lambda: len(limiter._waiting[FILE]) == 2)
+    limiter.release(FILE, 200)
+    wait_for(lambda: admitted == ["async"])
+    limiter.release(FILE, 200)
+    wait_for(lambda: admitted == ["async", FILE])
+    first.join()
+    second.join()
+
+def test_throttle_cuts_window_and_rate_once_per_pause():
+    now = [0.0]
+    limiter = RateLimiter({FILE: 100, VERDICT: 100}, 32, clock = lambda: now[0])
+    for _ in range(3):
+        assert limiter.acquire(FILE, 0)
+    limiter.release(FILE, 429, 2)
+    limiter.release(FILE, 429, 2) # sent before the pause, the same signal
+    assert limiter.window == 32 * 0.7
+    assert limiter.buckets[FILE].rate == 100 * 0.7
+    assert limiter.throttled[FILE] == 2
+    assert not limiter.acquire(VERDICT, 0) # paused
+    now[0] = 2.5
+    limiter.release(FILE, 200)
+    assert limiter.window > 32 * 0.7
+    assert limiter.acquire(VERDICT, 0)
+
+def test_token_bucket_refill():
+    now = [0.0]
+    bucket = TokenBucket(10, capacity = 1, clock = lambda: now[0])
+    assert bucket.wait_time() == 0
+    bucket.take()
+    assert abs(bucket.wait_time() - 0.1) < 1e-9
+    now[0] = 0.1
+    assert bucket.wait_time() == 0
+
+class FakeResponse:
+    def __init__(self, status_code = 200, headers = None, chunks = (b"data",)):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.chunks = chunks
+        self.closed = False
+
+    def iter_content(self, chunk_size = 1):
+        yield from self.chunks
+
+    def close(self):
+        self.closed = True
+
+class FakeRequests:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+
+    def request(self, method, url, **kwargs):
+        return self.responses.pop(0)
+
+def limited_session(*responses):
+    limiter = RateLimiter({FILE: 100, VERDICT: 100, WEBHOOKS: 100}, 8)
+    session = WebexFileSession(limiter = limiter, rate_limit_retries = 1)
+    session._session = FakeRequests(*responses)
+    return session, limiter
+
+def test_streamed_body_holds_the_window_until_closed():
+    session, limiter = limited_session(FakeResponse())
+    response = session.get("https://files/1", stream = True)
+    assert limiter.in_flight() == 1
+    response.close()
+    assert response.closed
+    assert limiter.in_flight() == 0
+    response.close()
+    assert limiter.in_flight() == 0
+
+def test_streamed_body_released_when_read():
+    session, limiter = limited_session(FakeResponse(chunks = (b"a", b"b")))
+    response = session.get("https://files/1", stream = True)
+    assert b"".join(response.iter_content(1)) == b"ab"
+    assert limiter.in_flight() == 0
+
+def test_dropped_response_is_released():
+    session, limiter = limited_session(FakeResponse())
+    session.get("https://files/1", stream = True)
+    gc.collect()
+    assert limiter.in_flight() == 0
+
+def test_plain_request_released_at_once():
+    session, limiter = limited_session(FakeResponse())
+    assert session.put("https://files/1?result=approve").status_code == 200
+    assert limiter.in_flight() == 0
+
+def test_throttled_stream_is_retried(monkeypatch):
+    throttled = FakeResponse(429, {"Retry-After": "0"})
+    session, limiter = limited_session(throttled, FakeResponse())
+    response = session.get("https://files/1", stream = True)
+    assert throttled.closed
+    assert response.status_code == 200
+    assert limiter.in_flight() == 1
+    response.close()
+    assert limiter.in_flight() == 0
+
+def test_release_with_body_calls_once():
+    calls = []
+    response = release_with_body(FakeResponse(), lambda: calls.append(1))
+    list(response.iter_content())
+    response.close()
+    assert calls == [1]
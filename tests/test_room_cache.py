@@ -0,0 +1,124 @@
+"""Space metadata cache: coalesced lookups, negative caching, refresh ahead and the stats."""
+
+import base64
+import threading
+import concurrent.futures
+
+from room_cache import RoomCache, RoomInfo, parse_room, webex_uuid
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class SlowLookup:
+    """
+    Room lookup which waits until released, counts the calls.
+    """
+    def __init__(self, rooms = None):
+        self.rooms = rooms if rooms is not None else {"r1": RoomInfo("r1", "group", "t1", "o1")}
+        self.calls = 0
+        self.release = threading.Event()
+        self.release.set()
+        self.error = None
+
+    def __call__(self, token_key, room_id):
+        self.calls += 1
+        self.release.wait(5)
+        if self.error:
+            raise self.error
+        return self.rooms.get(room_id)
+
+def test_webex_uuid():
+    room_id = base64.urlsafe_b64encode(b"ciscospark://us/ROOM/5b5702f0-2ba5-11ec").decode().rstrip("=")
+    assert webex_uuid(room_id) == "5b5702f0-2ba5-11ec"
+    assert webex_uuid("plain-id") == "plain-id"
+    assert webex_uuid(None) is None
+
+def test_parse_room():
+    assert parse_room({"id": "r1", "type": "group", "teamId": "t1", "ownerId": "o1", "title": "x"}) == RoomInfo("r1", "group", "t1", "o1")
+
+def test_concurrent_misses_share_one_lookup():
+    lookup = SlowLookup()
+    lookup.release.clear()
+    cache = RoomCache(lookup)
+    with concurrent.futures.ThreadPoolExecutor(8) as pool:
+        futures = [pool.submit(cache.get, "r1", "token", 5) for _ in range(8)]
+        while cache.stats["misses"] < 8:
+            pass
+        lookup.release.set()
+        results = [future.result() for future in futures]
+    assert all(result == RoomInfo("r1", "group", "t1", "o1") for result in results)
+    assert lookup.calls == 1
+    assert cache.stats["coalesced"] == 7
+    assert cache.get("r1", "token").team_id == "t1"
+    assert cache.stats["hits"] == 1
+
+def test_not_found_is_cached_for_negative_ttl():
+    clock = FakeClock()
+    lookup = SlowLookup()
+    cache = RoomCache(lookup, ttl = 3600, negative_ttl = 300, clock = clock)
+    assert cache.get("missing", "token") is None
+    assert cache.get("missing", "token") is None
+    assert lookup.calls == 1
+    assert cache.peek("missing") == (True, None)
+    clock.now = 301
+    assert cache.peek("missing") == (False, None)
+    assert cache.get("missing", "token") is None
+    assert lookup.calls == 2
+    assert cache.stats["not_found"] == 2
+
+def test_errors_are_not_cached():
+    lookup = SlowLookup()
+    lookup.error = OSError("Webex down")
+    cache = RoomCache(lookup)
+    assert cache.get("r1", "token") is None
+    lookup.error = None
+    assert cache.get("r1", "token").room_id == "r1"
+    assert lookup.calls == 2
+    assert cache.stats["errors"] == 1
+
+def test_lookup_timeout():
+    lookup = SlowLookup()
+    lookup.release.clear()
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        cache = RoomCache(lookup, executor = executor)
+        assert cache.get("r1", "token", timeout = 0.05) is None
+        lookup.release.set()
+    assert cache.peek("r1")[1].room_id == "r1"
+
+def test_refresh_ahead_and_prefetch():
+    clock = FakeClock()
+    lookup = SlowLookup()
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        cache = RoomCache(lookup, ttl = 100, executor = executor, clock = clock)
+        cache.prefetch("r1", "token")
+        executor.submit(lambda: None).result()
+        while "r1" not in cache._cache:
+            pass
+        assert lookup.calls == 1
+        clock.now = 81 # past REFRESH_AHEAD of the TTL
+        assert cache.get("r1", "token").room_id == "r1"
+    assert lookup.calls == 2
+    assert cache.stats["refreshes"] == 1
+
+def test_lru_bound():
+    lookup = SlowLookup({room_id: RoomInfo(room_id, "group", None, "o1") for room_id in ("r1", "r2", "r3")})
+    cache = RoomCache(lookup, maxsize = 2)
+    for room_id in ("r1", "r2", "r3"):
+        cache.get(room_id, "token")
+    assert len(cache) == 2
+    assert cache.peek("r1") == (False, None)
+
+def test_stats_are_exact_under_concurrency():
+    cache = RoomCache(SlowLookup())
+    cache.get("r1", "token")
+    threads = [threading.Thread(target = lambda: [cache.get("r1", "token") for _ in range(2000)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.stats["hits"] == 8 * 2000
+    assert cache.stats["misses"] == 1
@@ -0,0 +1,108 @@
+"""JSON log lines, correlation ids, rate limit and the background writer."""
+
+import sys
+import json
+import logging
+import threading
+
+import pytest
+
+from structured_log import JsonFormatter, RateLimitFilter, LogWriter, AsyncHandler, install_record_factory, \
+    log_context, write_in_background
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.written = threading.Event()
+
+    def emit(self, record):
+        self.records.append(record)
+        self.written.set()
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def record_factory():
+    factory = logging.getLogRecordFactory()
+    install_record_factory()
+    yield
+    logging.setLogRecordFactory(factory)
+
+def make_record(message, *args, level = logging.INFO, **extra):
+    return logging.getLogger("test").makeRecord("test", level, "test.py", 10, message, args, None, extra = extra)
+
+def test_json_line():
+    line = json.loads(JsonFormatter().format(make_record("file %s size %d", "a.txt", 12, event = "e1")))
+    assert line["msg"] == "file a.txt size 12"
+    assert line["level"] == "INFO" and line["logger"] == "test"
+    assert line["event"] == "e1"
+    assert "args" not in line and "exc" not in line
+
+def test_json_line_with_exception():
+    try:
+        raise ValueError("broken")
+    except ValueError:
+        record = logging.getLogger("test").makeRecord("test", logging.ERROR, "test.py", 10, "failed", (),
+            sys.exc_info())
+    line = json.loads(JsonFormatter().format(record))
+    assert "ValueError: broken" in line["exc"]
+
+def test_context_ids(record_factory):
+    with log_context(event = "e1"):
+        with log_context(file = "f1"):
+            inner = make_record("inner")
+        outer = make_record("outer")
+    after = make_record("after")
+    assert (inner.event, inner.file) == ("e1", "f1")
+    assert outer.event == "e1" and not hasattr(outer, "file")
+    assert not hasattr(after, "event")
+
+def test_context_ids_per_thread(record_factory):
+    records = []
+    with log_context(event = "e1"):
+        thread = threading.Thread(target = lambda: records.append(make_record("other thread")))
+        thread.start()
+        thread.join()
+    assert not hasattr(records[0], "event")
+
+def test_rate_limit_counts_suppressed():
+    clock = FakeClock()
+    limit = RateLimitFilter(2, clock = clock)
+    passed = [limit.filter(make_record("line")) for _ in range(5)]
+    assert passed == [True, True, False, False, False]
+    assert limit.filter(make_record("warning", level = logging.WARNING)) # never suppressed
+    clock.now = 1.0
+    record = make_record("line")
+    assert limit.filter(record)
+    assert record.suppressed == 3
+    assert limit.suppressed == 3
+
+def test_background_writer():
+    target = ListHandler()
+    logger = logging.getLogger("test.background")
+    logger.handlers = [target]
+    logger.propagate = False
+    writer = write_in_background([logger], queue_size = 10)
+    assert isinstance(logger.handlers[0], AsyncHandler)
+    assert write_in_background([logger]) and isinstance(logger.handlers[0].target, ListHandler) # not wrapped twice
+    logger.warning("queued %s", "line")
+    assert target.written.wait(5)
+    assert target.records[0].getMessage() == "queued line"
+    writer.close()
+
+def test_full_queue_drops():
+    stuck = threading.Event()
+    target = ListHandler()
+    target.handle = lambda record: stuck.wait(5) # the output doesn't keep up
+    writer = LogWriter(queue_size = 1)
+    for _ in range(5):
+        writer.put(target, make_record("line"))
+    stuck.set()
+    assert writer.dropped >= 3 # one in the queue, one being written
+    writer.close()
@@ -0,0 +1,34 @@
+"""Election of the process which refreshes the tokens."""
+
+import os
+
+from token_lease import FileLease, Lease
+
+def test_file_lease_directory_created_on_first_hold(tmp_path):
+    directory = str(tmp_path / "leases")
+    lease = FileLease(directory)
+    assert not os.path.exists(directory)
+    with lease.hold("tokens") as acquired:
+        assert acquired
+    assert os.path.isdir(directory)
+
+def test_file_lease_is_exclusive(tmp_path):
+    first, second = FileLease(str(tmp_path)), FileLease(str(tmp_path))
+    with first.hold("tokens") as acquired:
+        assert acquired
+        with second.hold("tokens") as other:
+            assert not other
+        with first.hold("tokens") as same_process:
+            assert not same_process
+    with second.hold("tokens") as acquired:
+        assert acquired
+
+def test_failing_acquire_is_not_held(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    with FileLease(str(blocker / "leases")).hold("tokens") as acquired:
+        assert not acquired
+
+def test_no_lease_always_acquired():
+    with Lease().hold("tokens") as acquired:
+        assert acquired
@@ -0,0 +1,79 @@
+"""Background token refresher: refresh ahead of the expiration, backoff of the failures."""
+
+import time
+import threading
+
+from token_refresher import TokenRefresher
+
+class Refresh:
+    """Refresh callback returning the next prepared result."""
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = []
+        self.condition = threading.Condition()
+
+    def __call__(self, token_key):
+        with self.condition:
+            self.calls.append((token_key, time.time()))
+            self.condition.notify_all()
+            return self.results.pop(0) if self.results else True
+
+    def wait_for(self, count):
+        with self.condition:
+            assert self.condition.wait_for(lambda: len(self.calls) >= count, 5)
+
+def wait_for(condition, timeout = 5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.005)
+
+def test_refresh_ahead_of_expiration():
+    refresh = Refresh()
+    refresher = TokenRefresher(refresh, ahead = 60, retry = 1, retry_max = 60)
+    scheduled = time.time()
+    refresher.schedule("org", scheduled + 60.1)
+    refresh.wait_for(1)
+    assert refresh.calls[0][0] == "org"
+    assert refresh.calls[0][1] - scheduled >= 0.09
+    status = refresher.status()["org"]
+    assert status.last_success and status.failures == 0
+
+def test_same_expiration_keeps_schedule():
+    refresh = Refresh()
+    refresher = TokenRefresher(refresh, ahead = 60, retry = 1, retry_max = 60)
+    expires_at = time.time() + 3600
+    refresher.schedule("org", expires_at)
+    next_refresh_at = refresher.status()["org"].next_refresh_at
+    refresher.schedule("org", expires_at)
+    assert refresher.status()["org"].next_refresh_at == next_refresh_at
+    refresher.refresh_soon("org")
+    refresh.wait_for(1)
+
+def test_failure_is_retried_with_backoff():
+    refresh = Refresh(False, False, True)
+    refresher = TokenRefresher(refresh, ahead = 60, retry = 0.05, retry_max = 0.1)
+    refresher.schedule("org", None)
+    refresh.wait_for(3)
+    first, second, third = (called for token_key, called in refresh.calls)
+    assert second - first >= 0.025 # retry / 2 at least
+    assert third - second >= 0.05 # doubled
+    wait_for(lambda: refresher.status()["org"].last_success)
+    assert refresher.status()["org"].failures == 0
+
+def test_retry_delay_is_capped_and_jittered():
+    refresher = TokenRefresher(Refresh(), ahead = 60, retry = 30, retry_max = 600)
+    for failures, delay in ((1, 30), (2, 60), (10, 600)):
+        for _ in range(20):
+            assert delay / 2 <= refresher._retry_delay(failures) <= delay
+
+def test_exception_counts_as_failure():
+    calls = []
+    def refresh(token_key):
+        calls.append(token_key)
+        raise RuntimeError("OAuth down")
+    refresher = TokenRefresher(refresh, ahead = 60, retry = 60, retry_max = 600)
+    refresher.schedule("org", None)
+    wait_for(lambda: refresher.status()["org"].failures == 1)
+    assert calls == ["org"]
+    assert refresher.status()["org"].last_success is False
@@ -0,0 +1,51 @@
+"""Bounded LRU cache with time-to-live."""
+
+from ttl_cache import TTLCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_entry_expires():
+    clock = FakeClock()
+    cache = TTLCache(10, ttl = 5, clock = clock)
+    cache.put("a", 1)
+    cache.put("b", 2, ttl = 20)
+    assert cache.get("a") == 1
+    clock.now = 5
+    assert cache.get("a") is None
+    assert "a" not in cache
+    assert cache.get("b") == 2
+    assert cache.items() == [("b", 2)]
+
+def test_least_recently_used_is_evicted():
+    cache = TTLCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1 # "b" is now the least recently used
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert [key for key, value in cache.items()] == ["a", "c"]
+    assert len(cache) == 2
+
+def test_add_stores_only_once():
+    clock = FakeClock()
+    cache = TTLCache(10, ttl = 60, clock = clock)
+    assert cache.add("webhook-1")
+    assert not cache.add("webhook-1") # redelivered
+    clock.now = 60
+    assert cache.add("webhook-1") # expired, a new delivery
+    assert cache.pop("webhook-1") is True
+    assert cache.add("webhook-1")
+
+def test_stats():
+    cache = TTLCache(4)
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("b")
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 1, "maxsize": 4}
+    cache.clear()
+    assert len(cache) == 0
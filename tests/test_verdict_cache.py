@@ -0,0 +1,78 @@
+"""Content verdict cache keyed by the sample digest and the policy version."""
+
+from verdict_cache import VerdictCache, sample_digest, compute_digest, VERDICT_ENTRY_BYTES
+
+class RangeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for offset in range(0, len(self.data), chunk_size):
+            yield self.data[offset:offset + chunk_size]
+
+    def close(self):
+        pass
+
+class RangeSession:
+    """Serves the byte ranges of a file, records the requested ranges."""
+    def __init__(self, data):
+        self.data = data
+        self.ranges = []
+
+    def get(self, url, headers, stream):
+        range_spec = headers["Range"][len("bytes="):]
+        self.ranges.append(range_spec)
+        start, end = range_spec.split("-")
+        if not start:
+            return RangeResponse(self.data[-int(end):])
+        return RangeResponse(self.data[int(start):int(end) + 1])
+
+def test_small_file_is_read_completely():
+    data = b"x" * 100
+    session = RangeSession(data)
+    assert sample_digest(session, "url", len(data), "text/plain", sample = 64) == compute_digest(100, "text/plain", data)
+    assert session.ranges == ["0-99"]
+
+def test_large_file_head_and_tail():
+    data = bytes(range(256)) * 4
+    session = RangeSession(data)
+    digest = sample_digest(session, "url", len(data), "application/pdf", sample = 64)
+    assert digest == compute_digest(len(data), "application/pdf", data[:64], data[-64:])
+    assert session.ranges == ["0-63", "-64"]
+    assert sample_digest(session, "url", len(data), "application/pdf", head = data[:100], sample = 64) == digest
+    assert session.ranges[2:] == ["-64"] # the head is not read again
+
+def test_digest_covers_size_and_type():
+    assert compute_digest(10, "text/plain", b"a") != compute_digest(11, "text/plain", b"a")
+    assert compute_digest(10, "text/plain", b"a") != compute_digest(10, "text/csv", b"a")
+
+def test_verdict_of_other_policy_version_is_not_used():
+    cache = VerdictCache(100 * VERDICT_ENTRY_BYTES)
+    cache.put("digest", "v1", "reject")
+    assert cache.dirty
+    assert cache.get("digest", "v1") == "reject"
+    assert cache.get("digest", "v2") is None
+
+def test_only_rejection_is_stored():
+    cache = VerdictCache(100 * VERDICT_ENTRY_BYTES)
+    assert not cache.put("digest", "v1", "approve")
+    assert cache.get("digest", "v1") is None
+    assert not cache.dirty
+
+def test_records_survive_restart():
+    cache = VerdictCache(100 * VERDICT_ENTRY_BYTES)
+    cache.put("d1", "v1", "reject")
+    cache.put("d2", "v2", "reject")
+    restarted = VerdictCache(100 * VERDICT_ENTRY_BYTES)
+    assert restarted.load(cache.records(), policy_version = "v2") == 1
+    assert restarted.get("d2", "v2") == "reject"
+    assert restarted.get("d1", "v1") is None
+    assert not restarted.dirty
+
+def test_saved_approval_is_not_loaded():
+    cache = VerdictCache(100 * VERDICT_ENTRY_BYTES)
+    assert cache.load([{"digest": "d1", "policy_version": "v1", "verdict": "approve"}]) == 0
+    assert cache.get("d1", "v1") is None
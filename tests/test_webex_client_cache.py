@@ -0,0 +1,92 @@
+"""Process-wide token cache: one load per lifetime, single-flight, background refresh."""
+
+import time
+import threading
+
+import compliance_inspect as ci
+
+def tokens(expires_in):
+    return ci.AccessTokenAbs({"access_token": "access", "refresh_token": "refresh",
+        "expires_in": expires_in, "refresh_token_expires_in": 7776000})
+
+class SlowLoad:
+    """load_tokens() replacement which holds the loading thread until released."""
+    def __init__(self, expires_in = 3600):
+        self.expires_in = expires_in
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, token_key, etag = None):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        return tokens(self.expires_in), "etag-1"
+
+class FakeRefresher:
+    def __init__(self):
+        self.scheduled = []
+        self.soon = []
+
+    def schedule(self, token_key, expires_at):
+        self.scheduled.append(token_key)
+
+    def refresh_soon(self, token_key):
+        self.soon.append(token_key)
+
+def test_concurrent_requests_load_once(monkeypatch):
+    load = SlowLoad()
+    monkeypatch.setattr(ci, "load_tokens", load)
+    cache = ci.WebexClientCache(safe_delta = 300, refresher = FakeRefresher())
+    results = []
+    threads = [threading.Thread(target = lambda: results.append(cache.get_tokens("org")), daemon = True) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    assert load.started.wait(5)
+    time.sleep(0.05) # the other threads wait for the leader
+    load.release.set()
+    for thread in threads:
+        thread.join(5)
+    assert load.calls == 1
+    assert len(results) == 8 and all(result is results[0] for result in results)
+    assert cache.get_tokens("org") is results[0] # cached, no other load
+    assert load.calls == 1
+    assert cache.etag("org") == "etag-1"
+
+def test_about_to_expire_keeps_tokens_and_asks_the_refresher(monkeypatch):
+    load = SlowLoad(expires_in = 100)
+    load.release.set()
+    monkeypatch.setattr(ci, "load_tokens", load)
+    refresher = FakeRefresher()
+    cache = ci.WebexClientCache(safe_delta = 300, retry_interval = 60, refresher = refresher)
+    assert cache.get_tokens("org") is not None
+    assert refresher.soon == ["org"]
+    assert cache.get_tokens("org") is not None
+    assert load.calls == 1 # used for the retry interval
+
+def test_expired_tokens_are_not_used(monkeypatch):
+    load = SlowLoad(expires_in = -10)
+    load.release.set()
+    monkeypatch.setattr(ci, "load_tokens", load)
+    refresher = FakeRefresher()
+    cache = ci.WebexClientCache(safe_delta = 300, refresher = refresher)
+    assert cache.get_tokens("org") is None
+    assert refresher.soon == ["org"]
+
+def test_failed_load_is_not_cached(monkeypatch):
+    calls = []
+    monkeypatch.setattr(ci, "load_tokens", lambda token_key, etag = None: calls.append(token_key) or (None, None))
+    cache = ci.WebexClientCache(safe_delta = 300, refresher = FakeRefresher())
+    assert cache.get_tokens("org") is None
+    assert cache.get_tokens("org") is None
+    assert len(calls) == 2
+
+def test_store_replaces_tokens_and_schedules_refresh():
+    refresher = FakeRefresher()
+    cache = ci.WebexClientCache(safe_delta = 300, refresher = refresher)
+    new_tokens = tokens(3600)
+    cache.store("org", new_tokens, "etag-2")
+    assert cache.peek("org") is new_tokens
+    assert refresher.scheduled == ["org"]
+    cache.invalidate("org")
+    assert cache.peek("org") is None
@@ -0,0 +1,97 @@
+"""Keep-alive session of the file requests: pooling, bound token, timeouts and retries."""
+
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from webex_http import WebexFileSession
+
+class FileHost:
+    """
+    Local HTTP/1.1 server, 'responses' is a list of status codes answered in turn, then 200.
+    """
+    def __init__(self, responses = (), delay = 0):
+        self.responses = list(responses)
+        self.delay = delay
+        self.requests = [] # (method, client port, Authorization)
+        host = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def handle_method(self):
+                host.requests.append((self.command, self.client_address[1], self.headers.get("Authorization")))
+                time.sleep(host.delay)
+                status = host.responses.pop(0) if host.responses else 200
+                body = b"" if self.command == "HEAD" else b"file content"
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Length", str(len(b"file content")))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except ConnectionError:
+                    pass # the client timed out
+
+            do_HEAD = do_GET = do_PUT = handle_method
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target = self.server.serve_forever, args = (0.05,), daemon = True).start()
+        self.url = "http://127.0.0.1:{}/contents/1".format(self.server.server_address[1])
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def file_host():
+    hosts = []
+    def start(*args, **kwargs):
+        hosts.append(FileHost(*args, **kwargs))
+        return hosts[-1]
+    yield start
+    for host in hosts:
+        host.close()
+
+def test_connection_is_reused(file_host):
+    host = file_host()
+    session = WebexFileSession()
+    for _ in range(5):
+        assert session.head(host.url).status_code == 200
+    assert session.get(host.url).content == b"file content"
+    assert session.put(host.url + "?result=approve").status_code == 200
+    assert len({port for method, port, auth in host.requests}) == 1
+
+def test_token_is_bound_to_the_session(file_host):
+    host = file_host()
+    session = WebexFileSession()
+    session.bind_token("token-1")
+    session.head(host.url)
+    session.bind_token("token-2")
+    session.head(host.url)
+    assert [auth for method, port, auth in host.requests] == ["Bearer token-1", "Bearer token-2"]
+
+def test_server_errors_are_retried(file_host):
+    host = file_host([503, 502])
+    session = WebexFileSession(retries = 2)
+    assert session.get(host.url).status_code == 200
+    assert len(host.requests) == 3
+
+def test_last_server_error_is_returned(file_host):
+    host = file_host([503, 503])
+    assert WebexFileSession(retries = 1).put(host.url).status_code == 503
+    assert len(host.requests) == 2
+
+def test_read_timeout(file_host):
+    host = file_host(delay = 0.5)
+    session = WebexFileSession(read_timeout = 0.1, retries = 0)
+    started = time.monotonic()
+    with pytest.raises(requests.exceptions.ConnectionError):
+        session.head(host.url)
+    assert time.monotonic() - started < 0.4
@@ -0,0 +1,128 @@
+"""Admission of the webhooks: the per-organization limit, the memory queue and the overflow spool."""
+
+import queue
+import itertools
+
+import pytest
+
+import compliance_inspect as ci
+from webhook_spool import WebhookSpool
+
+webhook_ids = itertools.count()
+
+def webhook(org_id = "org-1"):
+    return {"resource": "messages", "event": "created", "orgId": org_id,
+        "data": {"id": "admission-message-{}".format(next(webhook_ids)), "roomId": "room-1", "roomType": "group",
+            "files": ["https://webexapis.com/v1/contents/1"]}}
+
+class FakeScheduler:
+    """file_scheduler with a fixed backlog, nothing runs."""
+    def __init__(self, total = 0, per_group = None):
+        self.total = total
+        self.per_group = per_group or {}
+
+    def pending(self, group = None):
+        return self.total if group is None else self.per_group.get(group, 0)
+
+def post_response(payload):
+    with ci.flask_app.test_request_context("/", method = "POST", json = payload):
+        return ci.flask_app.make_response(ci.spark_webhook())
+
+def post(payload):
+    return post_response(payload).status_code
+
+@pytest.fixture
+def async_mode(monkeypatch):
+    monkeypatch.setattr(ci, "WEBHOOK_ASYNC", True)
+    monkeypatch.setattr(ci, "WEBHOOK_QUEUE_FULL_ACTION", "503")
+    monkeypatch.setattr(ci, "start_webhook_workers", lambda: None)
+    monkeypatch.setattr(ci, "webhook_queue", queue.PriorityQueue(maxsize = 10))
+    monkeypatch.setattr(ci, "ORG_QUEUE_LIMIT", 20)
+    monkeypatch.setattr(ci, "FILE_QUEUE_LIMIT", 100)
+    monkeypatch.setattr(ci, "webhook_spool", None)
+    monkeypatch.setattr(ci, "file_scheduler", FakeScheduler())
+
+@pytest.fixture
+def spool(async_mode, monkeypatch, tmp_path):
+    spool = WebhookSpool(str(tmp_path))
+    monkeypatch.setattr(ci, "webhook_spool", spool)
+    monkeypatch.setattr(ci, "WEBHOOK_SPOOL_ALL", False)
+    return spool
+
+def test_full_scheduler_goes_to_spool(spool, monkeypatch):
+    monkeypatch.setattr(ci, "file_scheduler", FakeScheduler(total = 100))
+    assert [post(webhook()) for _ in range(50)] == [200] * 50
+    assert ci.webhook_queue.qsize() == 0
+    assert spool.backlog() == 50
+
+def test_org_over_limit_goes_to_spool(spool, monkeypatch):
+    monkeypatch.setattr(ci, "file_scheduler", FakeScheduler(total = 20, per_group = {ci.wxt_token_key: 20}))
+    assert [post(webhook()) for _ in range(30)] == [200] * 30
+    assert spool.backlog() == 30
+
+def test_spool_keeps_the_order(spool, monkeypatch):
+    monkeypatch.setattr(ci, "file_scheduler", FakeScheduler())
+    assert [post(webhook()) for _ in range(15)] == [200] * 15
+    assert ci.webhook_queue.qsize() == 10
+    assert spool.backlog() == 5
+    ci.webhook_queue.get_nowait() # a free slot, but the spooled webhooks go first
+    assert post(webhook()) == 200
+    assert ci.webhook_queue.qsize() == 9
+    assert spool.backlog() == 6
+
+def test_sync_mode_processes_inline(monkeypatch):
+    monkeypatch.setattr(ci, "WEBHOOK_ASYNC", False)
+    monkeypatch.setattr(ci, "file_scheduler", FakeScheduler())
+    handled = []
+    monkeypatch.setattr(ci, "handle_webhook_event", lambda webhook, received_at: handled.append(webhook))
+    payload = webhook()
+    assert post(payload) == 200
+    assert handled == [payload]
+
+def test_invalid_and_duplicate_webhooks(async_mode):
+    assert post({"resource": "messages"}) == 400
+    payload = webhook()
+    assert post(payload) == 200
+    assert post(payload) == 200 # redelivery
+    assert ci.webhook_queue.qsize() == 1
+
+def test_full_queue_asks_for_redelivery(async_mode):
+    payloads = [webhook() for _ in range(11)]
+    assert [post(payload) for payload in payloads[:10]] == [200] * 10
+    response = post_response(payloads[10])
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(ci.BUSY_RETRY_AFTER)
+    ci.webhook_queue.get_nowait()
+    assert post(payloads[10]) == 200 # the refused event was forgotten, its redelivery is accepted
+
+def test_full_queue_sends_default_verdicts(async_mode, monkeypatch):
+    monkeypatch.setattr(ci, "WEBHOOK_QUEUE_FULL_ACTION", "default_verdict")
+    sent = []
+    monkeypatch.setattr(ci, "send_default_verdicts", lambda payload, received_at = None: sent.append(payload))
+    for _ in range(10):
+        post(webhook())
+    payload = webhook()
+    assert post(payload) == 200
+    assert sent == [payload]
+
+def test_queue_serves_earliest_webhook_first(async_mode):
+    late, early = webhook(), webhook()
+    assert ci.enqueue_webhook(late, 20.0)
+    assert ci.enqueue_webhook(early, 10.0)
+    assert ci.webhook_queue.get_nowait()[2] is early
+
+def test_org_over_limit_is_refused(async_mode, monkeypatch):
+    monkeypatch.setattr(ci, "MULTI_ORG", True)
+    monkeypatch.setattr(ci, "file_scheduler", FakeScheduler(total = 20, per_group = {"org-busy": 20}))
+    assert post(webhook("org-busy")) == 503
+    assert post(webhook("org-quiet")) == 200 # the other organizations are not affected
+    assert ci.webhook_queue.qsize() == 1
+
+def test_org_limit_applies_without_async(monkeypatch):
+    monkeypatch.setattr(ci, "WEBHOOK_ASYNC", False)
+    monkeypatch.setattr(ci, "WEBHOOK_QUEUE_FULL_ACTION", "503")
+    monkeypatch.setattr(ci, "ORG_QUEUE_LIMIT", 20)
+    monkeypatch.setattr(ci, "webhook_spool", None)
+    monkeypatch.setattr(ci, "file_scheduler", FakeScheduler(total = 20, per_group = {ci.wxt_token_key: 20}))
+    monkeypatch.setattr(ci, "handle_webhook_event", lambda webhook, received_at: pytest.fail("processed over the limit"))
+    assert post(webhook()) == 503
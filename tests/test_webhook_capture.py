@@ -0,0 +1,73 @@
+"""Redaction, writing and reading of the webhook captures."""
+
+import gzip
+import json
+import threading
+
+from webhook_capture import WebhookCapture, redact_webhook, read_capture, hash_value
+
+KEY = b"capture-test-key"
+
+def webhook(message_id = "message-1", at = "2021-01-01T00:00:00.000Z"):
+    return {
+        "id": "webhook-1", "name": "Compliance", "targetUrl": "https://example.com/webhook",
+        "resource": "messages", "event": "created", "orgId": "org-1", "created": at,
+        "data": {"id": message_id, "roomId": "room-1", "roomType": "group", "personId": "person-1",
+            "personEmail": "alice@example.com", "text": "secret plans", "created": at,
+            "files": ["https://webexapis.com/v1/contents/file-1"]}}
+
+def test_identifiers_are_hashed():
+    redacted = redact_webhook(webhook(), KEY)
+    assert redacted["resource"] == "messages" and redacted["event"] == "created"
+    assert redacted["orgId"] == hash_value("org-1", KEY)
+    assert redacted["data"]["roomId"] == hash_value("room-1", KEY)
+    assert redacted["data"]["files"] == [hash_value("https://webexapis.com/v1/contents/file-1", KEY)]
+    assert redacted["data"]["roomType"] == "group"
+    assert redacted["data"]["personEmail"].endswith("@redacted.invalid")
+
+def test_content_is_dropped():
+    text = json.dumps(redact_webhook(webhook(), KEY))
+    for value in ("secret plans", "alice@example.com", "example.com/webhook", "Compliance", "room-1", "file-1"):
+        assert value not in text
+
+def test_hashes_depend_on_the_key():
+    assert hash_value("room-1", KEY) == hash_value("room-1", KEY)
+    assert hash_value("room-1", KEY) != hash_value("room-1", b"other-key")
+    assert hash_value(None, KEY) is None
+
+def test_capture_is_read_back(tmp_path):
+    path = str(tmp_path / "capture" / "webhooks.jsonl.gz")
+    capture = WebhookCapture(path, KEY)
+    assert capture.record(webhook("message-1"), received_at = 100.0)
+    assert capture.record(webhook("message-2"), received_at = 101.5)
+    capture.close()
+    entries = list(read_capture([path]))
+    assert [at for at, _ in entries] == [100.0, 101.5]
+    assert [entry["data"]["id"] for _, entry in entries] == [hash_value("message-1", KEY), hash_value("message-2", KEY)]
+
+def test_captures_are_merged_by_arrival(tmp_path):
+    paths = [str(tmp_path / "worker-1.jsonl.gz"), str(tmp_path / "worker-2.jsonl.gz")]
+    for path, times in zip(paths, ((1.0, 3.0), (2.0, 4.0))):
+        capture = WebhookCapture(path, KEY)
+        for at in times:
+            capture.record(webhook("message-{}".format(at)), received_at = at)
+        capture.close()
+    assert [at for at, _ in read_capture(paths)] == [1.0, 2.0, 3.0, 4.0]
+
+def test_truncated_capture_is_read(tmp_path):
+    path = tmp_path / "webhooks.jsonl.gz"
+    lines = b"".join(json.dumps({"at": at, "webhook": {"resource": "messages"}}).encode() + b"\n" for at in range(100))
+    data = gzip.compress(lines)
+    path.write_bytes(data[:len(data) * 2 // 3]) # the process was killed while writing
+    entries = list(read_capture([str(path)]))
+    assert len(entries) < 100
+    assert [at for at, _ in entries] == list(range(len(entries)))
+
+def test_full_queue_drops(tmp_path):
+    capture = WebhookCapture(str(tmp_path / "webhooks.jsonl.gz"), KEY, queue_size = 1)
+    stuck = threading.Event()
+    capture._write = lambda batch: stuck.wait(5) # the writer doesn't keep up
+    results = [capture.record(webhook()) for _ in range(5)]
+    stuck.set()
+    assert results.count(False) >= 3 # one in the queue, one being written
+    assert capture.dropped == results.count(False)
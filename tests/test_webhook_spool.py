@@ -0,0 +1,102 @@
+"""Disk spool of the webhooks: order, segments, commit and the recovery after a crash."""
+
+import os
+
+from webhook_spool import WebhookSpool, claim_spool_directory, HEADER, SEGMENT_SUFFIX
+
+def read_all(spool):
+    records = []
+    while True:
+        record = spool.read(timeout = 0)
+        if record is None:
+            return records
+        records.append(record)
+
+def payloads(records):
+    return [payload for position, payload in records]
+
+def segment_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+
+def test_fifo_across_segments(tmp_path):
+    spool = WebhookSpool(str(tmp_path), segment_bytes = 100)
+    for index in range(10):
+        spool.append("record {}".format(index).encode() * 3)
+    assert len(segment_files(str(tmp_path))) > 1
+    assert spool.backlog() == 10
+    records = read_all(spool)
+    assert payloads(records) == ["record {}".format(index).encode() * 3 for index in range(10)]
+    assert spool.backlog() == 0
+    assert spool.pending() == 10
+    for position, payload in records:
+        spool.commit(position)
+    assert spool.pending() == 0
+    assert len(segment_files(str(tmp_path))) == 1 # the committed segments are deleted
+
+def test_read_timeout(tmp_path):
+    assert WebhookSpool(str(tmp_path)).read(timeout = 0.01) is None
+
+def test_uncommitted_records_are_read_again_after_restart(tmp_path):
+    spool = WebhookSpool(str(tmp_path), segment_bytes = 64)
+    for index in range(6):
+        spool.append(b"webhook %d" % index)
+    records = read_all(spool)
+    for position, payload in records[:2]:
+        spool.commit(position)
+    spool.close()
+    restarted = WebhookSpool(str(tmp_path), segment_bytes = 64)
+    assert restarted.pending() == 4
+    assert payloads(read_all(restarted)) == [b"webhook %d" % index for index in range(2, 6)]
+    restarted.append(b"webhook 6")
+    assert payloads(read_all(restarted)) == [b"webhook 6"]
+
+def test_out_of_order_commit_keeps_the_cursor(tmp_path):
+    spool = WebhookSpool(str(tmp_path))
+    for index in range(3):
+        spool.append(b"webhook %d" % index)
+    records = read_all(spool)
+    spool.commit(records[2][0])
+    spool.commit(records[0][0]) # before the cursor, ignored
+    spool.close()
+    assert WebhookSpool(str(tmp_path)).pending() == 0
+
+def test_torn_record_is_truncated(tmp_path):
+    spool = WebhookSpool(str(tmp_path))
+    spool.append(b"complete")
+    spool.close()
+    segment = os.path.join(str(tmp_path), segment_files(str(tmp_path))[-1])
+    size = os.path.getsize(segment)
+    with open(segment, "ab") as segment_file:
+        segment_file.write(HEADER.pack(100, 0) + b"torn by a cra") # the crash cut the payload
+    restarted = WebhookSpool(str(tmp_path))
+    assert os.path.getsize(segment) == size
+    assert restarted.pending() == 1
+    restarted.append(b"after restart")
+    assert payloads(read_all(restarted)) == [b"complete", b"after restart"]
+
+def test_corrupted_last_record_is_truncated(tmp_path):
+    spool = WebhookSpool(str(tmp_path))
+    spool.append(b"first")
+    spool.append(b"second")
+    spool.close()
+    segment = os.path.join(str(tmp_path), segment_files(str(tmp_path))[-1])
+    with open(segment, "r+b") as segment_file:
+        segment_file.seek(-1, os.SEEK_END)
+        segment_file.write(b"X") # CRC mismatch
+    restarted = WebhookSpool(str(tmp_path))
+    assert payloads(read_all(restarted)) == [b"first"]
+
+def test_invalid_cursor_reads_from_first_segment(tmp_path):
+    spool = WebhookSpool(str(tmp_path))
+    spool.append(b"first")
+    spool.commit(read_all(spool)[0][0])
+    spool.close()
+    with open(os.path.join(str(tmp_path), "cursor"), "w") as cursor_file:
+        cursor_file.write("garbage")
+    assert payloads(read_all(WebhookSpool(str(tmp_path)))) == [b"first"]
+
+def test_slots_are_exclusive(tmp_path):
+    first = claim_spool_directory(str(tmp_path))
+    second = claim_spool_directory(str(tmp_path))
+    assert first != second
+    assert os.path.basename(first) == "slot-0"
@@ -0,0 +1,176 @@
+"""ZIP structure inspection by ranged reads: clean, macro, OLE, bomb and malformed packages."""
+
+import io
+import re
+import random
+import struct
+import zipfile
+
+import pytest
+
+from zip_inspect import (inspect_zip_remote, is_zip_file, MACROS, EMBEDDED_OBJECT, ENCRYPTED, ZIP_BOMB, MALFORMED,
+    DIRECTORY_SIGNATURE, TAIL_BYTES)
+
+CONTENT_TYPES = b'<?xml version="1.0"?><Types><Default Extension="xml" ContentType="application/xml"/></Types>'
+MACRO_CONTENT_TYPES = (b'<?xml version="1.0"?><Types><Override PartName="/word/data.bin" '
+    b'ContentType="application/vnd.ms-office.vbaProject"/></Types>')
+
+def package(members, comment = b"", prefix = b""):
+    data = io.BytesIO()
+    data.write(prefix)
+    with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in members:
+            archive.writestr(name, content)
+        archive.comment = comment
+    return data.getvalue()
+
+def docx(*extra, content_types = CONTENT_TYPES):
+    return package([("[Content_Types].xml", content_types), ("word/document.xml", b"<document>text</document>" * 20)] + list(extra))
+
+class RangeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.data), chunk_size):
+            yield self.data[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+class RangeSession:
+    """
+    Serve a file by Range requests, records the ranges.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.ranges = []
+
+    def get(self, url, headers = None, stream = False):
+        range_spec = headers["Range"][len("bytes="):]
+        self.ranges.append(range_spec)
+        suffix = re.fullmatch(r"-(\d+)", range_spec)
+        if suffix:
+            return RangeResponse(self.data[-int(suffix.group(1)):])
+        start, end = map(int, range_spec.split("-"))
+        return RangeResponse(self.data[start:end + 1])
+
+def inspect(data, head_bytes = 4096, **limits):
+    session = RangeSession(data)
+    report = inspect_zip_remote(session, "https://files/1", len(data), data[:head_bytes], **limits)
+    return report, session
+
+def kinds(report):
+    return [finding.kind for finding in report.findings]
+
+def test_zip_types():
+    assert is_zip_file("application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+    assert is_zip_file("application/vnd.ms-excel.sheet.macroenabled.12") # normalized by the caller
+    assert not is_zip_file("application/pdf")
+    assert is_zip_file("application/octet-stream", b"PK\x03\x04")
+    assert not is_zip_file("application/zip", b"%PDF-")
+
+IMAGE = ("word/media/image1.png", random.Random(1).randbytes(20000)) # doesn't compress
+
+def test_small_file_read_by_the_sniffing():
+    data = docx()
+    report, session = inspect(data)
+    assert report.findings == []
+    assert [member.name for member in report.members] == ["[Content_Types].xml", "word/document.xml"]
+    assert session.ranges == []
+
+def test_clean_document_reads_only_the_tail():
+    data = docx(IMAGE)
+    report, session = inspect(data)
+    assert report.findings == []
+    assert session.ranges == ["-{}".format(TAIL_BYTES)]
+    assert report.bytes_read == TAIL_BYTES
+    assert report.tail == data[-TAIL_BYTES:]
+
+def test_content_types_fetched_if_not_in_head():
+    report, session = inspect(docx(IMAGE), head_bytes = 0)
+    assert report.findings == []
+    assert len(session.ranges) == 2
+
+@pytest.mark.parametrize("name", ["word/vbaProject.bin", "xl/macrosheets/sheet1.xml", "word/embeddings/report.docm"])
+def test_macros_by_name(name):
+    assert kinds(inspect(docx((name, b"\x00" * 100)))[0]) == [MACROS]
+
+def test_macros_declared_in_content_types():
+    # a renamed VBA project is still declared by its content type
+    report, session = inspect(docx(("word/data.bin", b"\x00" * 100), content_types = MACRO_CONTENT_TYPES))
+    assert kinds(report) == [MACROS]
+
+@pytest.mark.parametrize("name", ["word/embeddings/oleObject1.bin", "word/activeX/activeX1.xml"])
+def test_embedded_objects(name):
+    assert kinds(inspect(docx((name, b"\x00" * 100)))[0]) == [EMBEDDED_OBJECT]
+
+def test_package_embedding_is_fine():
+    assert inspect(docx(("word/embeddings/chart.xlsx", b"\x00" * 100)))[0].findings == []
+
+def test_compression_ratio_bomb():
+    report, session = inspect(package([("zeros.txt", b"\x00" * (4 * 1024 * 1024))]))
+    assert kinds(report) == [ZIP_BOMB]
+    assert "ratio" in report.findings[0].detail
+
+def test_member_count_and_total_size_limits():
+    data = package([("file{}.txt".format(index), b"x" * 1000) for index in range(20)])
+    assert kinds(inspect(data, max_members = 10)[0]) == [ZIP_BOMB]
+    assert kinds(inspect(data, max_uncompressed = 10000)[0]) == [ZIP_BOMB]
+    assert inspect(data)[0].findings == []
+
+def set_directory_field(data, index, offset, fmt, value):
+    """
+    Patch a field of the index-th central directory header.
+    """
+    data = bytearray(data)
+    position = -1
+    for _ in range(index + 1):
+        position = data.index(DIRECTORY_SIGNATURE, position + 1)
+    struct.pack_into(fmt, data, position + offset, value)
+    return bytes(data)
+
+def test_overlapping_members():
+    data = set_directory_field(docx(), 1, 42, "<I", 0) # second member points to the first local header
+    assert ZIP_BOMB in kinds(inspect(data)[0])
+
+def test_encrypted_member():
+    data = set_directory_field(docx(), 1, 8, "<H", 0x0001)
+    assert kinds(inspect(data)[0]) == [ENCRYPTED]
+
+def test_member_outside_of_archive():
+    data = set_directory_field(docx(), 1, 42, "<I", 0x7FFFFFFF)
+    assert kinds(inspect(data)[0]) == [MALFORMED]
+
+@pytest.mark.parametrize("data", [
+    b"PK\x03\x04" + b"\x00" * 100, # no end record
+    docx()[:-30], # truncated end record
+    b"%PDF-1.7 not a zip at all",
+])
+def test_malformed(data):
+    assert kinds(inspect(data)[0]) == [MALFORMED]
+
+def test_corrupted_directory():
+    data = set_directory_field(docx(), 0, 0, "<4s", b"XXXX")
+    assert kinds(inspect(data)[0]) == [MALFORMED]
+
+def test_corrupted_content_types():
+    data = bytearray(docx())
+    start = data.index(b"[Content_Types].xml") + len("[Content_Types].xml")
+    data[start:start + 20] = b"\xff" * 20
+    assert kinds(inspect(bytes(data))[0]) == [MALFORMED]
+
+def test_long_comment_needs_a_second_read():
+    data = package([("[Content_Types].xml", CONTENT_TYPES)], comment = b"c" * (TAIL_BYTES * 2))
+    report, session = inspect(data, head_bytes = 0)
+    assert report.findings == []
+    assert session.ranges[:2] == ["-{}".format(TAIL_BYTES), "-{}".format(len(data))]
+
+def test_prefix_before_archive():
+    # e.g. a self-extracting archive, the member offsets don't count the prefix
+    data = package([("[Content_Types].xml", CONTENT_TYPES), ("readme.txt", b"hello")], prefix = b"MZ" + b"\x00" * 5000)
+    report, session = inspect(data, head_bytes = 0)
+    assert report.findings == []
@@ -0,0 +1,197 @@
+"""Leases electing a single process which refreshes the tokens.
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+When several worker processes share the tokens, only the holder of the lease
+refreshes them, the others pick up the new tokens from the storage.
+Leases are not blocking, a process which doesn't get the lease tries later.
+"""
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+class Lease:
+    """
+    Base of the lease types.
+    """
+    def acquire(self, name):
+        """
+        Returns:
+            bool: True if the lease was acquired
+        """
+        return True
+
+    def release(self, name):
+        pass
+
+    @contextmanager
+    def hold(self, name):
+        """
+        Hold the lease for the duration of the block.
+
+        Yields:
+            bool: True if the lease was acquired, the block must not do the guarded work otherwise
+        """
+        try:
+            acquired = self.acquire(name)
+        except Exception as e:
+            logger.error("Lease {} not acquired: {}".format(name, e))
+            acquired = False
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.release(name)
+
+class FileLease(Lease):
+    """
+    Lease held as an exclusive lock of a local file, for the worker processes of one host.
+
+    The operating system releases the lock if the holder dies. The directory
+    is created by the first acquire(), importing the application has no side effects.
+
+    Attributes:
+        directory (str): directory of the lock files
+    """
+    def __init__(self, directory):
+        import fcntl # not available on Windows
+
+        self._fcntl = fcntl
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._files = {} # name -> locked file
+        self._directory_ready = False
+
+    def acquire(self, name):
+        with self._lock:
+            if name in self._files:
+                return False # held by another thread of this process
+            if not self._directory_ready:
+                os.makedirs(self.directory, exist_ok = True)
+                self._directory_ready = True
+            lock_file = open(os.path.join(self.directory, "{}.lock".format(name)), "a")
+            try:
+                self._fcntl.flock(lock_file, self._fcntl.LOCK_EX | self._fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self._files[name] = lock_file
+            return True
+
+    def release(self, name):
+        with self._lock:
+            lock_file = self._files.pop(name, None)
+        if lock_file:
+            self._fcntl.flock(lock_file, self._fcntl.LOCK_UN)
+            lock_file.close()
+
+class S3Lease(Lease):
+    """
+    Lease held as a marker object in S3, for processes on several hosts.
+
+    The marker is created by a conditional write (If-None-Match: *), so only one
+    process succeeds. A marker older than 'ttl' was left by a dead holder and is
+    deleted by a conditional delete (If-Match) of the same version. Requires
+    S3 conditional writes, boto3 1.35 or newer.
+
+    Attributes:
+        bucket (str): S3 bucket
+        prefix (str): key prefix of the marker objects
+        ttl (float): seconds the lease is held at most
+        owner (str): holder identification stored in the marker
+    """
+    def __init__(self, get_client, bucket, prefix, ttl, owner = None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.ttl = ttl
+        self.owner = owner or "{}:{}".format(socket.gethostname(), os.getpid())
+        self._get_client = get_client
+        self._lock = threading.Lock()
+        self._etags = {} # name -> ETag of the marker written by this process
+
+    def _key(self, name):
+        return "{}/lease_{}.json".format(self.prefix, name)
+
+    def acquire(self, name):
+        with self._lock:
+            if name in self._etags:
+                return False
+        for attempt in range(2):
+            etag = self._create(name)
+            if etag:
+                with self._lock:
+                    self._etags[name] = etag
+                return True
+            if not self._remove_expired(name):
+                return False
+        return False
+
+    def _create(self, name):
+        from botocore.exceptions import ClientError, ParamValidationError
+
+        body = json.dumps({"owner": self.owner, "expires": time.time() + self.ttl})
+        try:
+            response = self._get_client().put_object(Bucket = self.bucket, Key = self._key(name), Body = body, IfNoneMatch = "*")
+            return response["ETag"]
+        except ParamValidationError as e:
+            raise RuntimeError("S3 lease needs S3 conditional writes, upgrade boto3: {}".format(e))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("PreconditionFailed", "ConditionalRequestConflict", "412", "409"):
+                return None
+            raise
+
+    def _remove_expired(self, name):
+        """
+        Returns:
+            bool: True if the marker doesn't exist anymore
+        """
+        from botocore.exceptions import ClientError
+
+        client = self._get_client()
+        try:
+            marker = client.get_object(Bucket = self.bucket, Key = self._key(name))
+            expires = json.loads(marker["Body"].read().decode()).get("expires", 0)
+        except ClientError as e:
+            return e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404")
+        except ValueError:
+            expires = 0
+        if expires > time.time():
+            return False
+        logger.warning("Lease {} expired, taking it over".format(name))
+        try:
+            client.delete_object(Bucket = self.bucket, Key = self._key(name), IfMatch = marker["ETag"])
+            return True
+        except ClientError as e:
+            logger.info("Expired lease {} was taken over by another process: {}".format(name, e))
+            return False
+
+    def release(self, name):
+        from botocore.exceptions import ClientError
+
+        with self._lock:
+            etag = self._etags.pop(name, None)
+        if etag:
+            try:
+                self._get_client().delete_object(Bucket = self.bucket, Key = self._key(name), IfMatch = etag)
+            except ClientError as e:
+                logger.warning("Lease {} release failed, it expires in {}s: {}".format(name, self.ttl, e))
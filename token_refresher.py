@@ -0,0 +1,186 @@
+"""Background renewal of OAuth tokens ahead of their expiration.
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import time
+import heapq
+import random
+import logging
+import itertools
+import threading
+
+logger = logging.getLogger(__name__)
+
+class RefreshStatus:
+    """
+    Refresh state of a token key.
+
+    Attributes:
+        expires_at (float): expiration of the current Access Token, None if not known
+        next_refresh_at (float): time of the next scheduled refresh or check
+        last_refresh_at (float): time of the last refresh attempt or check, None if not attempted yet
+        last_success (bool): result of the last attempt or check, None if not attempted yet
+        failures (int): consecutive failed attempts
+    """
+    __slots__ = ("expires_at", "next_refresh_at", "last_refresh_at", "last_success", "failures", "seq")
+
+    def __init__(self):
+        self.expires_at = None
+        self.next_refresh_at = None
+        self.last_refresh_at = None
+        self.last_success = None
+        self.failures = 0
+        self.seq = None
+
+class TokenRefresher:
+    """
+    Renew tokens by a background thread before they expire.
+
+    A token is refreshed 'ahead' seconds before its expiration. A failed refresh
+    is retried after 'retry' seconds, doubled by every further failure up to
+    'retry_max' and randomized by a jitter, so that instances which failed
+    together don't retry together. The 'refresh' callback must store the new
+    tokens and call schedule() with their expiration, it returns False
+    if the refresh failed or None if it was deferred (for example because
+    another process is refreshing the tokens), then it's called again after
+    'retry' seconds without counting a failure.
+
+    With 'check_interval', the callback is also called at least every
+    'check_interval' seconds, so that it can pick up tokens renewed elsewhere.
+
+    The thread is a daemon thread started by the first schedule().
+
+    Attributes:
+        ahead (float): seconds before the expiration when the token is refreshed
+        retry (float): seconds before the first retry of a failed refresh
+        retry_max (float): max seconds between the retries
+        check_interval (float): max seconds between the callbacks, None to call it only when the refresh is due
+    """
+    def __init__(self, refresh, ahead, retry, retry_max, check_interval = None, clock = time.time, name = "token_refresher"):
+        self.ahead = ahead
+        self.retry = retry
+        self.retry_max = retry_max
+        self.check_interval = check_interval
+        self.name = name
+        self._refresh = refresh
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._queue = [] # (refresh time, seq, token key), entries replaced by a later schedule are skipped
+        self._status = {} # token key -> RefreshStatus
+        self._seq = itertools.count()
+        self._started = False
+
+    def _start(self):
+        if self._started:
+            return
+        threading.Thread(target = self._run, name = self.name, daemon = True).start()
+        self._started = True
+
+    def schedule(self, token_key, expires_at):
+        """
+        Schedule the refresh of a token 'ahead' seconds before its expiration.
+
+        Parameters:
+            token_key (str): key of the tokens
+            expires_at (float): expiration of the Access Token, None to refresh right away
+        """
+        with self._lock:
+            status = self._status.setdefault(token_key, RefreshStatus())
+            if status.seq is not None and expires_at is not None and status.expires_at == expires_at:
+                return # already scheduled, keep the retry backoff
+            status.expires_at = expires_at
+            now = self._clock()
+            refresh_at = now if expires_at is None else expires_at - self.ahead
+            if self.check_interval is not None:
+                refresh_at = min(refresh_at, now + self.check_interval)
+            self._push(token_key, status, refresh_at)
+
+    def refresh_soon(self, token_key):
+        """
+        Move the refresh of a token to now unless it's already due.
+        """
+        with self._lock:
+            status = self._status.setdefault(token_key, RefreshStatus())
+            now = self._clock()
+            if status.next_refresh_at is None or status.next_refresh_at > now:
+                self._push(token_key, status, now)
+
+    def status(self):
+        """
+        Returns:
+            dict: token key -> RefreshStatus
+        """
+        with self._lock:
+            return dict(self._status)
+
+    def _push(self, token_key, status, refresh_at):
+        self._start()
+        status.seq = next(self._seq)
+        status.next_refresh_at = refresh_at
+        heapq.heappush(self._queue, (refresh_at, status.seq, token_key))
+        self._wakeup.notify()
+
+    def _retry_delay(self, failures):
+        delay = min(self.retry_max, self.retry * 2 ** (failures - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _next_due(self):
+        while True:
+            now = self._clock()
+            while self._queue:
+                refresh_at, seq, token_key = self._queue[0]
+                if self._status[token_key].seq != seq:
+                    heapq.heappop(self._queue) # rescheduled
+                    continue
+                if refresh_at > now:
+                    break
+                heapq.heappop(self._queue)
+                return token_key
+            self._wakeup.wait(self._queue[0][0] - now if self._queue else None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                token_key = self._next_due()
+                status = self._status[token_key]
+                seq = status.seq
+            try:
+                success = self._refresh(token_key)
+            except Exception as e:
+                logger.exception("Token refresh for {} failed: {}".format(token_key, e))
+                success = False
+            with self._lock:
+                now = self._clock()
+                if success is None:
+                    self._push(token_key, status, now + self.retry / 2 + random.uniform(0, self.retry / 2))
+                    continue
+                status.last_refresh_at = now
+                status.last_success = bool(success)
+                if success:
+                    status.failures = 0
+                    # check again later if the callback didn't schedule the new tokens
+                    # or if their lifetime is shorter than 'ahead'
+                    interval = self.check_interval or self.retry_max
+                    if status.seq == seq or status.next_refresh_at < now + min(interval, self.retry_max):
+                        self._push(token_key, status, now + interval)
+                else:
+                    status.failures += 1
+                    delay = self._retry_delay(status.failures)
+                    logger.warning("Token refresh for {} failed {} times, retry in {:.0f}s".format(token_key, status.failures, delay))
+                    self._push(token_key, status, status.last_refresh_at + delay)
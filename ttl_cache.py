@@ -0,0 +1,133 @@
+"""Thread-safe LRU cache with time-to-live.
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire after a time-to-live.
+
+    When the cache is full, the least recently used entry is evicted.
+    Expired entries are removed lazily when accessed or evicted.
+
+    Attributes:
+        maxsize (int): max number of entries
+        ttl (float): seconds an entry is valid, None for no expiration
+        hits (int): number of lookups which found a valid entry
+        misses (int): number of lookups which didn't
+    """
+    def __init__(self, maxsize, ttl = None, clock = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._data = OrderedDict() # key -> (expires_at, value)
+
+    def _lookup(self, key, now):
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            return _MISSING
+        if item[0] is not None and item[0] <= now:
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return item[1]
+
+    def _store(self, key, value, now, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = (now + ttl if ttl is not None else None, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last = False)
+
+    def get(self, key, default = None):
+        """
+        Get a valid entry and mark it as recently used.
+        """
+        with self._lock:
+            value = self._lookup(key, self._clock())
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl = None):
+        """
+        Store an entry, optionally with its own time-to-live.
+        """
+        with self._lock:
+            self._store(key, value, self._clock(), ttl)
+
+    def add(self, key, value = True, ttl = None):
+        """
+        Store an entry only if there's no valid entry for the key.
+
+        The check and the store are atomic, so only one of concurrent callers wins.
+
+        Returns:
+            bool: True if the entry was stored, False if the key was already present
+        """
+        with self._lock:
+            now = self._clock()
+            if self._lookup(key, now) is not _MISSING:
+                self.hits += 1
+                return False
+            self.misses += 1
+            self._store(key, value, now, ttl)
+            return True
+
+    def pop(self, key, default = None):
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+            return default if item is _MISSING else item[1]
+
+    def items(self):
+        """
+        Returns:
+            list: (key, value) of valid entries from the least to the most recently used
+        """
+        with self._lock:
+            now = self._clock()
+            return [(key, value) for key, (expires_at, value) in self._data.items()
+                if expires_at is None or expires_at > now]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key, self._clock()) is not _MISSING
+
+    def stats(self):
+        """
+        Returns:
+            dict: hits, misses, current size and max size
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
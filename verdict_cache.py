@@ -0,0 +1,158 @@
+"""Content digest verdict cache for the Webex file DLP.
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+The same file is often posted to many spaces. Its rejection is cached under
+a digest computed from the file size, type and samples of its beginning and end,
+so the copies are not downloaded and scanned again. The digest doesn't cover
+the middle of larger files, a file with the same size, beginning and end but
+sensitive data inserted in the middle would get a cached approval, so only
+the rejections are cached.
+"""
+
+import time
+import hashlib
+import logging
+
+from ttl_cache import TTLCache
+from mime_policy import REJECT
+
+logger = logging.getLogger(__name__)
+
+DIGEST_SAMPLE_BYTES = 4096 # bytes read from the beginning and from the end of the file
+VERDICT_ENTRY_BYTES = 320 # estimated memory used by a cache entry
+
+def fetch_range(session, url, range_spec, max_bytes):
+    """
+    Read a byte range of a remote file.
+
+    Reading stops after 'max_bytes' in case the server ignores the Range.
+    """
+    data = b""
+    response = session.get(url, headers = {"Range": "bytes=" + range_spec}, stream = True)
+    try:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size = max_bytes):
+            data += chunk
+            if len(data) >= max_bytes:
+                break
+    finally:
+        response.close()
+    return data[:max_bytes]
+
+def sample_digest(session, url, size, mime_type, head = b"", sample = DIGEST_SAMPLE_BYTES, tail = b""):
+    """
+    Compute the digest of a remote file from its size, type and head/tail samples.
+
+    Small files are read completely.
+
+    Parameters:
+        session: HTTP session with a requests-like get()
+        url (str): file URL
+        size (int): file size from Content-Length
+        mime_type (str): file type
+        head (bytes): beginning of the file if already read, saves a request
+        tail (bytes): end of the file if already read, saves a request
+
+    Returns:
+        str: hex digest
+    """
+    if size <= 2 * sample:
+        data = head if len(head) >= size else fetch_range(session, url, "0-{}".format(size - 1), size)
+        return compute_digest(size, mime_type, data[:size])
+    data = head if len(head) >= sample else fetch_range(session, url, "0-{}".format(sample - 1), sample)
+    tail = tail[-sample:] if len(tail) >= sample else fetch_range(session, url, "-{}".format(sample), sample)
+    return compute_digest(size, mime_type, data[:sample], tail)
+
+def compute_digest(size, mime_type, head, tail = b""):
+    """
+    Compute the digest from the file samples.
+
+    Parameters:
+        size (int): file size
+        mime_type (str): file type
+        head (bytes): the whole file if size <= 2 * DIGEST_SAMPLE_BYTES, otherwise its first DIGEST_SAMPLE_BYTES
+        tail (bytes): last DIGEST_SAMPLE_BYTES of the file, empty for small files
+
+    Returns:
+        str: hex digest
+    """
+    digest = hashlib.sha256("{}:{}:".format(size, mime_type).encode())
+    digest.update(head)
+    digest.update(tail)
+    return digest.hexdigest()
+
+class VerdictCache:
+    """
+    LRU cache of file rejections keyed by the content digest and the policy version.
+
+    A verdict is reused only if it was produced by the current policy version.
+    Other verdicts than REJECT are not stored, the sampled digest can't prove
+    that the file didn't change.
+    The cache can be saved to and loaded from a list of records, so that
+    the warm state survives a restart.
+
+    Attributes:
+        dirty (bool): True if there are entries not saved yet
+    """
+    def __init__(self, max_bytes, ttl = None):
+        self._cache = TTLCache(max(1, max_bytes // VERDICT_ENTRY_BYTES), ttl)
+        self.dirty = False
+
+    def get(self, digest, policy_version):
+        """
+        Returns:
+            str: cached verdict or None
+        """
+        entry = self._cache.get((digest, policy_version))
+        return entry["verdict"] if entry else None
+
+    def put(self, digest, policy_version, verdict):
+        """
+        Returns:
+            bool: True if the verdict was stored, only REJECT is
+        """
+        if verdict != REJECT:
+            return False
+        self._cache.put((digest, policy_version), {"verdict": verdict, "created": time.time()})
+        self.dirty = True
+        return True
+
+    def records(self):
+        """
+        Returns:
+            list: cached entries from the least to the most recently used
+        """
+        return [{"digest": digest, "policy_version": version, **entry}
+            for (digest, version), entry in self._cache.items()]
+
+    def load(self, records, policy_version = None):
+        """
+        Load saved records, optionally only those of the given policy version.
+
+        Returns:
+            int: number of loaded records
+        """
+        count = 0
+        for record in records:
+            if record["verdict"] == REJECT and (policy_version is None or record["policy_version"] == policy_version):
+                self._cache.put((record["digest"], record["policy_version"]),
+                    {"verdict": record["verdict"], "created": record.get("created", 0)})
+                count += 1
+        return count
+
+    def stats(self):
+        return self._cache.stats()
@@ -0,0 +1,176 @@
+"""Pooled HTTP session for the Webex file DLP requests.
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import os
+import logging
+import weakref
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from rate_limiter import FILE, VERDICT, RATE_LIMIT_RETRIES, RATE_LIMIT_MAX_WAIT, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+FILE_HTTP_POOL_SIZE = int(os.getenv("FILE_HTTP_POOL_SIZE", 20)) # max keep-alive connections per host
+FILE_HTTP_CONNECT_TIMEOUT = float(os.getenv("FILE_HTTP_CONNECT_TIMEOUT", 3.05)) # seconds
+FILE_HTTP_READ_TIMEOUT = float(os.getenv("FILE_HTTP_READ_TIMEOUT", 5)) # seconds
+FILE_HTTP_RETRIES = int(os.getenv("FILE_HTTP_RETRIES", 2)) # retries of connection errors and 502/503/504 responses
+
+# HEAD/GET and the verdict PUT are idempotent, retrying them is safe
+IDEMPOTENT_METHODS = frozenset(["HEAD", "GET", "PUT"])
+RETRY_STATUS = frozenset([502, 503, 504])
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTP adapter which applies a default timeout to every request.
+
+    requests.Session has no default timeout, without it a stalled
+    connection blocks the caller forever.
+    """
+    def __init__(self, *args, timeout = None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, timeout = None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        return super().send(request, timeout = timeout, **kwargs)
+
+class RateLimitTimeout(requests.exceptions.RequestException):
+    """
+    The request wasn't admitted by the rate limiter in time.
+    """
+
+def release_with_body(response, release):
+    """
+    Call 'release' once, when the streamed body of the response is read to its end or closed.
+
+    The response is closed in a "finally" by its users, a response which is
+    dropped without it is released when it's garbage collected.
+    """
+    lock = threading.Lock()
+    released = []
+
+    def release_once():
+        with lock:
+            if released:
+                return
+            released.append(True)
+        release()
+
+    close, iter_content = response.close, response.iter_content
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            release_once()
+
+    def iter_content_and_release(*args, **kwargs):
+        yield from iter_content(*args, **kwargs)
+        release_once()
+
+    response.close = close_and_release
+    response.iter_content = iter_content_and_release
+    weakref.finalize(response, release_once)
+    return response
+
+class WebexFileSession:
+    """
+    Thread-safe keep-alive session for the file HEAD/GET and the verdict PUT.
+
+    All requests in a burst go to the same few hosts, the connection pool
+    saves the TCP and TLS handshake for each file. The Authorization header
+    is bound to the session and updated only if the Access Token changes.
+
+    With a limiter, every request waits for its admission and reports its
+    result back. A streamed response (stream = True) holds its slot of the
+    limiter window until its body is read or closed. A 429 response is retried
+    after its Retry-After up to 'rate_limit_retries' times, the last 429
+    response is returned to the caller.
+
+    Attributes:
+        pool_size (int): max number of pooled connections per host
+        timeout (tuple): connect and read timeout in seconds
+        limiter (RateLimiter): admission of the requests, None to send them right away
+        rate_limit_retries (int): retries of a request answered by 429
+    """
+    def __init__(self, pool_size = FILE_HTTP_POOL_SIZE, connect_timeout = FILE_HTTP_CONNECT_TIMEOUT,
+        read_timeout = FILE_HTTP_READ_TIMEOUT, retries = FILE_HTTP_RETRIES, limiter = None,
+        rate_limit_retries = RATE_LIMIT_RETRIES):
+        self.pool_size = pool_size
+        self.limiter = limiter
+        self.rate_limit_retries = rate_limit_retries
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(total = retries, connect = retries, read = retries, status = retries,
+            backoff_factor = 0.1, allowed_methods = IDEMPOTENT_METHODS,
+            status_forcelist = RETRY_STATUS, raise_on_status = False,
+            respect_retry_after_header = limiter is None) # with a limiter, 429 is handled by _request()
+        adapter = TimeoutHTTPAdapter(timeout = self.timeout, pool_connections = pool_size,
+            pool_maxsize = pool_size, max_retries = retry)
+        self._session = requests.Session()
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._auth = None
+
+    def bind_token(self, access_token):
+        """
+        Set the Access Token used for all requests of the session.
+        """
+        auth = "Bearer " + access_token
+        if auth != self._auth:
+            self._session.headers["Authorization"] = auth
+            self._auth = auth
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault("allow_redirects", False)
+        return self._request(FILE, "HEAD", url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self._request(FILE, "GET", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self._request(VERDICT, "PUT", url, **kwargs)
+
+    def _request(self, call_class, method, url, **kwargs):
+        if not self.limiter:
+            return self._session.request(method, url, **kwargs)
+        stream = kwargs.get("stream", False)
+        for attempt in range(self.rate_limit_retries + 1):
+            if not self.limiter.acquire(call_class, RATE_LIMIT_MAX_WAIT):
+                raise RateLimitTimeout("{} {} not admitted in {}s".format(method, url, RATE_LIMIT_MAX_WAIT))
+            status, retry_after = None, None
+            try:
+                response = self._session.request(method, url, **kwargs)
+                status = response.status_code
+                if status == 429:
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            finally:
+                if not stream or status in (None, 429):
+                    self.limiter.release(call_class, status, retry_after)
+            if stream and status != 429:
+                return release_with_body(response, lambda: self.limiter.release(call_class, status))
+            if status != 429 or attempt == self.rate_limit_retries:
+                return response
+            response.close()
+
+    def close(self):
+        self._session.close()
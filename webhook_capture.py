@@ -0,0 +1,197 @@
+"""Capture of the received webhooks for an offline replay.
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+A capture is a gzip-compressed JSONL file, a line per webhook:
+{"at": <arrival time as time.time()>, "webhook": <redacted payload>}.
+Only the fields which shape the processing are kept. Identifiers are
+replaced by keyed hashes, so the same Space, person or organization gets
+the same hash within a capture, but the original values cannot be recovered
+or guessed without the key. File URLs are replaced by hashes too, the replay
+points them to a stand-in file host. Everything else (message text, names,
+e-mails, webhook target URL) is dropped.
+
+The webhooks are redacted and written by a background thread, the request
+only puts them in a bounded queue. Each process appends a new gzip member
+to the file, the members are flushed after every batch, so a capture is
+readable while the process runs and survives its crash.
+"""
+
+import os
+import json
+import gzip
+import hmac
+import heapq
+import queue
+import atexit
+import hashlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 10000
+BATCH_SIZE = 1000
+
+# fields copied as they are
+PLAIN_FIELDS = ("resource", "event", "status", "ownedBy", "created")
+PLAIN_DATA_FIELDS = ("roomType", "created")
+# fields replaced by the hash
+HASHED_FIELDS = ("id", "orgId", "appId", "createdBy", "actorId")
+HASHED_DATA_FIELDS = ("id", "roomId", "personId", "parentId")
+HASHED_DATA_LISTS = ("files", "mentionedPeople", "mentionedGroups")
+
+def hash_value(value, key):
+    """
+    Returns:
+        str: hex keyed hash of the value, None if the value is None
+    """
+    if value is None:
+        return None
+    return hmac.new(key, str(value).encode(), hashlib.sha256).hexdigest()[:24]
+
+def redact_webhook(webhook, key):
+    """
+    Keep only the fields needed for the replay, hash the identifiers.
+
+    Parameters:
+        webhook (dict): webhook payload
+        key (bytes): key of the hashes
+
+    Returns:
+        dict: redacted webhook
+    """
+    redacted = {name: webhook[name] for name in PLAIN_FIELDS if name in webhook}
+    redacted.update({name: hash_value(webhook[name], key) for name in HASHED_FIELDS if name in webhook})
+    data = webhook.get("data")
+    if isinstance(data, dict):
+        redacted_data = {name: data[name] for name in PLAIN_DATA_FIELDS if name in data}
+        redacted_data.update({name: hash_value(data[name], key) for name in HASHED_DATA_FIELDS if name in data})
+        for name in HASHED_DATA_LISTS:
+            if isinstance(data.get(name), list):
+                redacted_data[name] = [hash_value(value, key) for value in data[name]]
+        if "personEmail" in data:
+            redacted_data["personEmail"] = "{}@redacted.invalid".format(hash_value(data["personEmail"], key))
+        redacted["data"] = redacted_data
+    return redacted
+
+class WebhookCapture:
+    """
+    Append the received webhooks to a capture file.
+
+    Attributes:
+        path (str): capture file
+        dropped (int): webhooks not captured because the writer didn't keep up
+    """
+    def __init__(self, path, key = None, queue_size = QUEUE_SIZE):
+        self.path = path
+        self.dropped = 0
+        key = key or os.urandom(32) # hashes differ between processes without a shared key
+        self._key = key.encode() if isinstance(key, str) else key
+        self._queue = queue.Queue(maxsize = queue_size)
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        self._file = gzip.open(path, "ab")
+        threading.Thread(target = self._run, name = "webhook_capture", daemon = True).start()
+        atexit.register(self.close)
+        logger.info("Capturing webhooks to {}".format(path))
+
+    def record(self, webhook, received_at = None):
+        """
+        Queue a webhook for the capture.
+
+        Parameters:
+            webhook (dict): webhook payload, must not be modified afterwards
+            received_at (float): time.time() of the arrival, now if not set
+
+        Returns:
+            bool: False if the webhook was dropped
+        """
+        try:
+            self._queue.put_nowait((received_at or time.time(), webhook))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                for received_at, webhook in batch:
+                    line = {"at": received_at, "webhook": redact_webhook(webhook, self._key)}
+                    self._file.write(json.dumps(line, separators = (",", ":")).encode() + b"\n")
+                self._file.flush()
+            except (OSError, TypeError, ValueError) as e:
+                self.dropped += len(batch)
+                logger.error("Webhook capture write failed: {}".format(e))
+
+    def close(self):
+        """
+        Write the queued webhooks and finish the gzip member, called at the interpreter exit.
+        """
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._write(batch)
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+def read_capture(paths):
+    """
+    Read webhooks from capture files, for example one per worker process.
+
+    A truncated end of a file (the process was killed) is skipped.
+
+    Parameters:
+        paths (list): capture files
+
+    Returns:
+        iterator: (arrival time, webhook) ordered by the arrival time
+    """
+    def read_file(path):
+        with gzip.open(path, "rt") as capture_file:
+            try:
+                for line in capture_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        logger.warning("Invalid capture line in {} skipped".format(path))
+                        continue
+                    yield record["at"], record["webhook"]
+            except (EOFError, OSError) as e:
+                logger.warning("Capture {} is truncated: {}".format(path, e))
+
+    return heapq.merge(*(read_file(path) for path in paths), key = lambda entry: entry[0])
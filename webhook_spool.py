@@ -0,0 +1,270 @@
+"""Append-only disk spool of records, used for the webhooks which don't fit the memory queue.
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+The spool is a directory of segment files named by their sequence number.
+A record is a 4-byte length and a 4-byte CRC32 followed by the payload.
+Records are appended to the last segment, a new segment is started when
+it grows over the segment size. The cursor file holds the position (segment,
+offset) of the first record not yet committed, segments before it are deleted.
+After a restart the records from the cursor on are read again, a record
+torn by a crash at the end of the last segment is truncated.
+
+A spool directory is used by a single process. Worker processes sharing
+a base directory claim its numbered slots by claim_spool_directory().
+"""
+
+import os
+import struct
+import logging
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_BYTES = 4 * 1024 * 1024
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+HEADER = struct.Struct(">II") # payload length, CRC32 of the payload
+
+SLOT_NAME = "slot-{}"
+
+_claimed_slots = [] # lock files of the claimed slots, kept open for the process lifetime
+
+def claim_spool_directory(base, max_slots = 256):
+    """
+    Claim a spool directory for this process among the slots of a shared base directory.
+
+    The slot is locked for the process lifetime, a process restarted after a crash
+    claims a free slot again and recovers its records. Keep the number of the
+    worker processes stable, the records of a slot nobody claims wait for a process.
+
+    Returns:
+        str: spool directory of the slot
+    """
+    import fcntl # not available on Windows
+
+    os.makedirs(base, exist_ok = True)
+    for slot in range(max_slots):
+        lock_file = open(os.path.join(base, SLOT_NAME.format(slot) + ".lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            continue
+        _claimed_slots.append(lock_file)
+        return os.path.join(base, SLOT_NAME.format(slot))
+    raise OSError("No free spool slot in {}".format(base))
+
+class WebhookSpool:
+    """
+    Persistent FIFO of byte records.
+
+    Records are read in the order they were appended. Reading doesn't remove
+    a record, it's only removed by commit() of its position, so the records
+    read but not committed before a crash are read again after the restart.
+
+    Attributes:
+        directory (str): spool directory
+        segment_bytes (int): size of a segment which starts a new one
+        fsync (bool): fsync every append, otherwise the records survive a process crash but not a system crash
+    """
+    def __init__(self, directory, segment_bytes = SEGMENT_BYTES, fsync = False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._readable = threading.Condition(self._lock)
+        os.makedirs(directory, exist_ok = True)
+        self._cursor = self._load_cursor()
+        self._read_position = self._cursor
+        self._unread = 0
+        self._uncommitted = 0
+        self._recover()
+        self._writer = None
+        self._write_segment = None
+        self._reader = None
+        self._reader_segment = None
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, "{:012d}{}".format(segment, SEGMENT_SUFFIX))
+
+    def _segments(self):
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as cursor_file:
+                segment, offset = cursor_file.read().split()
+                return int(segment), int(offset)
+        except FileNotFoundError:
+            segments = self._segments()
+            return (segments[0] if segments else 0), 0
+        except ValueError as e:
+            logger.error("Invalid spool cursor in {}, reading from the first segment: {}".format(self.directory, e))
+            segments = self._segments()
+            return (segments[0] if segments else 0), 0
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        with open(path + ".tmp", "w") as cursor_file:
+            cursor_file.write("{} {}".format(*self._cursor))
+            if self.fsync:
+                cursor_file.flush()
+                os.fsync(cursor_file.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _recover(self):
+        """
+        Count the records not committed, drop committed segments and truncate a torn last record.
+        """
+        segments = self._segments()
+        for segment in segments:
+            if segment < self._cursor[0]:
+                os.remove(self._segment_path(segment))
+        segments = [segment for segment in segments if segment >= self._cursor[0]]
+        for segment in segments:
+            offset = self._cursor[1] if segment == self._cursor[0] else 0
+            with open(self._segment_path(segment), "rb") as segment_file:
+                segment_file.seek(offset)
+                while True:
+                    payload = self._read_record(segment_file)
+                    if payload is None:
+                        break
+                    offset = segment_file.tell()
+                    self._unread += 1
+                if offset < os.fstat(segment_file.fileno()).st_size:
+                    logger.warning("Spool segment {} has an incomplete record at {}, truncating".format(segment, offset))
+                    os.truncate(self._segment_path(segment), offset)
+        self._uncommitted = self._unread
+        if self._unread:
+            logger.info("Recovered {} spooled records from {}".format(self._unread, self.directory))
+
+    def _read_record(self, segment_file):
+        header = segment_file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return None
+        length, crc = HEADER.unpack(header)
+        payload = segment_file.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return None
+        return payload
+
+    def append(self, payload):
+        """
+        Append a record.
+
+        Parameters:
+            payload (bytes): record content
+        """
+        with self._lock:
+            if self._writer is None or self._writer.tell() >= self.segment_bytes:
+                self._roll()
+            self._writer.write(HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._writer.flush()
+            if self.fsync:
+                os.fsync(self._writer.fileno())
+            self._unread += 1
+            self._uncommitted += 1
+            self._readable.notify()
+
+    def _roll(self):
+        segments = self._segments()
+        if self._writer is None and segments:
+            segment = segments[-1] # continue the last segment after a restart
+        else:
+            segment = max(segments[-1] + 1 if segments else 0, self._read_position[0])
+        if self._writer:
+            self._writer.close()
+        self._writer = open(self._segment_path(segment), "ab")
+        self._write_segment = segment
+        if self._writer.tell() >= self.segment_bytes:
+            self._writer.close()
+            self._write_segment = segment + 1
+            self._writer = open(self._segment_path(self._write_segment), "ab")
+
+    def read(self, timeout = None):
+        """
+        Get the next record, wait for it if there is none.
+
+        Returns:
+            tuple: (position, payload) or None on timeout, pass the position to commit() once the record is processed
+        """
+        with self._lock:
+            while not self._unread:
+                if not self._readable.wait(timeout):
+                    return None
+            while True:
+                segment, offset = self._read_position
+                if self._reader_segment != segment:
+                    if self._reader:
+                        self._reader.close()
+                    self._reader = open(self._segment_path(segment), "rb")
+                    self._reader_segment = segment
+                self._reader.seek(offset)
+                payload = self._read_record(self._reader)
+                if payload is not None:
+                    self._read_position = (segment, self._reader.tell())
+                    self._unread -= 1
+                    return self._read_position, payload
+                # end of the segment, the next record is in a later one
+                later = [s for s in self._segments() if s > segment]
+                if not later:
+                    logger.error("Spool record missing at {}:{}".format(segment, offset))
+                    self._unread = 0
+                    return None
+                self._read_position = (later[0], 0)
+
+    def commit(self, position):
+        """
+        Mark the records up to the position as processed, they are not read again after a restart.
+        """
+        with self._lock:
+            if position <= self._cursor:
+                return
+            self._uncommitted -= 1
+            previous_segment = self._cursor[0]
+            self._cursor = position
+            self._save_cursor()
+            for segment in range(previous_segment, position[0]):
+                path = self._segment_path(segment)
+                if os.path.exists(path):
+                    if self._reader_segment == segment:
+                        self._reader.close()
+                        self._reader, self._reader_segment = None, None
+                    os.remove(path)
+
+    def backlog(self):
+        """
+        Returns:
+            int: number of records not read yet
+        """
+        return self._unread
+
+    def pending(self):
+        """
+        Returns:
+            int: number of records not committed yet
+        """
+        return self._uncommitted
+
+    def close(self):
+        with self._lock:
+            for spool_file in (self._writer, self._reader):
+                if spool_file:
+                    spool_file.close()
+            self._writer, self._reader = None, None
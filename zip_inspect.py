@@ -0,0 +1,383 @@
+"""Structure inspection of ZIP based files (Office Open XML, OpenDocument, ZIP archives).
+
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+Macros, embedded OLE objects, encryption and zip bombs don't show in the
+Content-Type, but they do in the ZIP central directory at the end of the file:
+member names, flags and sizes. Only the end of central directory record and
+the central directory are read by HTTP Range requests, for a typical Office
+document a single 4 KB read of the file end. A member is fetched only if
+a rule needs its content - [Content_Types].xml, which declares the macro and
+OLE parts even if they are renamed, and which is usually the first member,
+already read by the content sniffing.
+
+The inspection is a generator yielding the byte ranges it needs, so that the
+same logic serves the blocking and the asyncio HTTP clients.
+"""
+
+import re
+import zlib
+import struct
+import logging
+from collections import namedtuple
+
+from file_sniff import ZIP_LOCAL_HEADER, ZIP_MIME_TYPE
+from verdict_cache import fetch_range
+
+logger = logging.getLogger(__name__)
+
+TAIL_BYTES = 4096 # bytes read from the file end, covers the central directory of a typical Office document
+MAX_END_SEARCH = 22 + 65535 # the end record is followed by at most a 64 KB comment
+MAX_DIRECTORY_BYTES = 2 * 1024 * 1024 # larger central directories are not read
+MEMBER_MAX_BYTES = 64 * 1024 # max compressed size of a member fetched for a content rule
+MEMBER_MAX_OUTPUT = 1024 * 1024 # max decompressed bytes of such member
+LOCAL_EXTRA_SLACK = 256 # bytes read beyond the member for the local header extra field, which the central directory doesn't give
+
+MAX_RATIO = 100 # max compression ratio of a member
+MAX_UNCOMPRESSED = 1024 * 1024 * 1024 # max total uncompressed size
+MAX_MEMBERS = 10000 # max number of members
+BOMB_MIN_BYTES = 1024 * 1024 # members smaller than this are not checked for the compression ratio
+
+# findings
+MACROS = "macros"
+EMBEDDED_OBJECT = "embedded_object"
+ENCRYPTED = "encrypted"
+ZIP_BOMB = "zip_bomb"
+MALFORMED = "malformed"
+
+ZipMember = namedtuple("ZipMember", ["name", "flags", "compression", "compressed_size", "size", "header_offset"])
+ZipFinding = namedtuple("ZipFinding", ["kind", "detail"])
+# findings (list of ZipFinding), members (list of ZipMember), bytes_read (int), tail (bytes of the file end)
+ZipReport = namedtuple("ZipReport", ["findings", "members", "bytes_read", "tail"])
+
+# end of central directory: signature, disk, directory disk, disk entries, entries, directory size and offset, comment length
+END_RECORD = struct.Struct("<4sHHHHIIH")
+END_SIGNATURE = b"PK\x05\x06"
+# ZIP64 end of central directory locator: signature, disk, ZIP64 end record offset, disks
+ZIP64_LOCATOR = struct.Struct("<4sIQI")
+ZIP64_LOCATOR_SIGNATURE = b"PK\x06\x07"
+# ZIP64 end of central directory: signature, record size, versions, disks, disk entries, entries, directory size and offset
+ZIP64_END_RECORD = struct.Struct("<4sQHHIIQQQQ")
+ZIP64_END_SIGNATURE = b"PK\x06\x06"
+# central directory file header: signature, versions, flags, compression, time, date, crc, sizes,
+# name, extra and comment length, disk, attributes, local header offset
+DIRECTORY_HEADER = struct.Struct("<4sHHHHHHIIIHHHHHII")
+DIRECTORY_SIGNATURE = b"PK\x01\x02"
+ZIP64_EXTRA_ID = 0x0001
+
+FLAG_ENCRYPTED = 0x0001
+FLAG_UTF8 = 0x0800
+STORED, DEFLATED = 0, 8
+
+CONTENT_TYPES_NAME = "[Content_Types].xml"
+
+# MIME types of the ZIP based files
+ZIP_TYPES_RE = re.compile(r"application/(zip|x-zip-compressed|vnd\.openxmlformats-officedocument\..+|"
+    r"vnd\.ms-[a-z]+\..*macroenabled\.12|vnd\.oasis\.opendocument\..+|epub\+zip|java-archive)$")
+
+# VBA project, Word VBA data, Excel 4.0 macro sheets, macro-enabled documents embedded in the package
+MACRO_NAME_RE = re.compile(r"(^|/)(vbaproject\.bin|vbaprojectsignature\.bin|vbadata\.xml)$|"
+    r"^xl/(intl)?macrosheets/|\.(docm|dotm|xlsm|xltm|xlam|pptm|potm|ppsm|ppam)$")
+# OLE objects and ActiveX controls, package embeddings (e.g. charts as .xlsx) are fine
+EMBEDDED_NAME_RE = re.compile(r"(^|/)embeddings/.*\.bin$|(^|/)activex/")
+# parts declared in [Content_Types].xml
+MACRO_CONTENT_RE = re.compile(rb"vbaProject|vbaData|macroEnabled|macrosheet", re.IGNORECASE)
+EMBEDDED_CONTENT_RE = re.compile(rb"oleObject|activeX", re.IGNORECASE)
+
+def is_zip_file(mime_type, head = b""):
+    """
+    Check if a file is ZIP based, by its beginning if read or by its type.
+    """
+    if head:
+        return head.startswith(b"PK\x03\x04")
+    return mime_type == ZIP_MIME_TYPE or ZIP_TYPES_RE.match(mime_type) is not None
+
+def find_end_record(tail):
+    """
+    Find the end of central directory record, the last one whose comment fits in the data.
+
+    Returns:
+        int: position in the tail, -1 if not found
+    """
+    position = tail.rfind(END_SIGNATURE)
+    while position >= 0:
+        if position + END_RECORD.size <= len(tail):
+            comment_len = END_RECORD.unpack_from(tail, position)[-1]
+            if position + END_RECORD.size + comment_len <= len(tail):
+                return position
+        position = tail.rfind(END_SIGNATURE, 0, position)
+    return -1
+
+def read_zip64_extra(extra, size, compressed_size, header_offset):
+    """
+    Take the 64-bit values from the ZIP64 extra field, for those whose 32-bit field is 0xFFFFFFFF.
+    """
+    position = 0
+    while position + 4 <= len(extra):
+        tag, length = struct.unpack_from("<HH", extra, position)
+        if tag == ZIP64_EXTRA_ID:
+            data = extra[position + 4:position + 4 + length]
+            values = []
+            offset = 0
+            for value in (size, compressed_size, header_offset):
+                if value == 0xFFFFFFFF and offset + 8 <= len(data):
+                    value = struct.unpack_from("<Q", data, offset)[0]
+                    offset += 8
+                values.append(value)
+            return values
+        position += 4 + length
+    return size, compressed_size, header_offset
+
+def parse_central_directory(data, entries, prefix = 0):
+    """
+    Parse the central directory.
+
+    Parameters:
+        data (bytes): the central directory
+        entries (int): number of members given by the end record
+        prefix (int): bytes before the archive (e.g. a self-extractor stub), added to the offsets
+
+    Returns:
+        list: ZipMember
+
+    Raises:
+        ValueError: the directory is truncated or corrupted
+    """
+    members = []
+    position = 0
+    for index in range(entries):
+        if position + DIRECTORY_HEADER.size > len(data):
+            raise ValueError("central directory truncated at member {}".format(index))
+        (signature, made_by, needed, flags, compression, mtime, mdate, crc, compressed_size, size,
+            name_len, extra_len, comment_len, disk, internal_attr, external_attr, header_offset) = DIRECTORY_HEADER.unpack_from(data, position)
+        if signature != DIRECTORY_SIGNATURE:
+            raise ValueError("invalid central directory header at {}".format(position))
+        name_start = position + DIRECTORY_HEADER.size
+        name = data[name_start:name_start + name_len].decode("utf-8" if flags & FLAG_UTF8 else "cp437", "replace")
+        extra = data[name_start + name_len:name_start + name_len + extra_len]
+        size, compressed_size, header_offset = read_zip64_extra(extra, size, compressed_size, header_offset)
+        members.append(ZipMember(name, flags, compression, compressed_size, size, header_offset + prefix))
+        position = name_start + name_len + extra_len + comment_len
+    return members
+
+def check_members(members, directory_offset, max_ratio = MAX_RATIO, max_uncompressed = MAX_UNCOMPRESSED, max_members = MAX_MEMBERS):
+    """
+    Apply the rules which need only the central directory.
+
+    Parameters:
+        members (list): ZipMember
+        directory_offset (int): file position of the central directory, the members must be before it
+
+    Returns:
+        list: ZipFinding
+    """
+    findings = []
+    if len(members) > max_members:
+        findings.append(ZipFinding(ZIP_BOMB, "{} members".format(len(members))))
+    total_size = 0
+    offsets = set()
+    for member in members:
+        name = member.name.lower()
+        if member.flags & FLAG_ENCRYPTED:
+            findings.append(ZipFinding(ENCRYPTED, member.name))
+        if MACRO_NAME_RE.search(name):
+            findings.append(ZipFinding(MACROS, member.name))
+        elif EMBEDDED_NAME_RE.search(name):
+            findings.append(ZipFinding(EMBEDDED_OBJECT, member.name))
+        if member.size >= BOMB_MIN_BYTES and member.size > max_ratio * max(1, member.compressed_size):
+            findings.append(ZipFinding(ZIP_BOMB, "{} ratio {:.0f}".format(member.name, member.size / max(1, member.compressed_size))))
+        if member.header_offset in offsets: # overlapping members, a non-recursive zip bomb
+            findings.append(ZipFinding(ZIP_BOMB, "{} overlaps another member".format(member.name)))
+        offsets.add(member.header_offset)
+        if member.header_offset < 0 or member.header_offset + member.compressed_size > directory_offset:
+            findings.append(ZipFinding(MALFORMED, "{} outside of the archive".format(member.name)))
+        total_size += member.size
+    if total_size > max_uncompressed:
+        findings.append(ZipFinding(ZIP_BOMB, "{} bytes uncompressed".format(total_size)))
+    return findings
+
+def check_content_types(content):
+    """
+    Find the macro and OLE parts declared in [Content_Types].xml.
+
+    Returns:
+        list: ZipFinding
+    """
+    findings = []
+    match = MACRO_CONTENT_RE.search(content)
+    if match:
+        findings.append(ZipFinding(MACROS, "{} declares {}".format(CONTENT_TYPES_NAME, match.group().decode())))
+    match = EMBEDDED_CONTENT_RE.search(content)
+    if match:
+        findings.append(ZipFinding(EMBEDDED_OBJECT, "{} declares {}".format(CONTENT_TYPES_NAME, match.group().decode())))
+    return findings
+
+def member_data_offset(data):
+    """
+    Returns:
+        int: position of the member data after its local header, None if the header is not valid
+    """
+    if len(data) < ZIP_LOCAL_HEADER.size:
+        return None
+    fields = ZIP_LOCAL_HEADER.unpack_from(data)
+    if fields[0] != b"PK\x03\x04":
+        return None
+    name_len, extra_len = fields[-2:]
+    return ZIP_LOCAL_HEADER.size + name_len + extra_len
+
+def decompress_member(member, data):
+    """
+    Returns:
+        bytes: member content, at most MEMBER_MAX_OUTPUT bytes
+
+    Raises:
+        zlib.error: corrupted data
+    """
+    if member.compression == STORED:
+        return data[:MEMBER_MAX_OUTPUT]
+    return zlib.decompressobj(-zlib.MAX_WBITS).decompress(data, MEMBER_MAX_OUTPUT)
+
+def inspect_zip(size, head = b"", max_ratio = MAX_RATIO, max_uncompressed = MAX_UNCOMPRESSED, max_members = MAX_MEMBERS):
+    """
+    Inspect the structure of a remote ZIP file.
+
+    A generator, it yields (range spec, max bytes) of the data it needs and
+    gets the bytes back by send(), the report is its return value. See
+    inspect_zip_remote() for a driver.
+
+    Parameters:
+        size (int): file size from Content-Length
+        head (bytes): beginning of the file if already read, saves requests
+
+    Returns:
+        ZipReport: findings empty if the structure is fine
+    """
+    bytes_read = 0
+
+    def report(findings, members = ()):
+        return ZipReport(findings, list(members), bytes_read, tail)
+
+    tail_size = min(size, TAIL_BYTES)
+    if len(head) >= size:
+        tail = head[:size]
+    else:
+        tail = yield "-{}".format(tail_size), tail_size
+        bytes_read += len(tail)
+    end = find_end_record(tail)
+    if end < 0 and len(tail) < min(size, MAX_END_SEARCH): # a long archive comment
+        tail_size = min(size, MAX_END_SEARCH)
+        tail = yield "-{}".format(tail_size), tail_size
+        bytes_read += len(tail)
+        end = find_end_record(tail)
+    if end < 0:
+        return report([ZipFinding(MALFORMED, "no end of central directory")])
+    tail_start = size - len(tail)
+
+    (signature, disk, directory_disk, disk_entries, entries, directory_size, directory_offset,
+        comment_len) = END_RECORD.unpack_from(tail, end)
+    directory_end = tail_start + end
+    locator = end - ZIP64_LOCATOR.size
+    has_locator = locator >= 0 and tail[locator:locator + 4] == ZIP64_LOCATOR_SIGNATURE
+    if not has_locator and (0xFFFF in (disk_entries, entries) or 0xFFFFFFFF in (directory_size, directory_offset)):
+        return report([ZipFinding(MALFORMED, "no ZIP64 end of central directory locator")])
+    if has_locator: # the 32-bit fields may be saturated or not, the ZIP64 record has the values
+        # the record is usually right before the locator, its offset in the locator doesn't count a prefix
+        record_offset = tail_start + locator - ZIP64_END_RECORD.size
+        if record_offset < tail_start or not tail.startswith(ZIP64_END_SIGNATURE, record_offset - tail_start):
+            record_offset = ZIP64_LOCATOR.unpack_from(tail, locator)[2]
+        if tail_start <= record_offset <= len(tail) + tail_start - ZIP64_END_RECORD.size:
+            record = tail[record_offset - tail_start:record_offset - tail_start + ZIP64_END_RECORD.size]
+        else:
+            record = yield "{}-{}".format(record_offset, record_offset + ZIP64_END_RECORD.size - 1), ZIP64_END_RECORD.size
+            bytes_read += len(record)
+        if len(record) < ZIP64_END_RECORD.size or not record.startswith(ZIP64_END_SIGNATURE):
+            return report([ZipFinding(MALFORMED, "invalid ZIP64 end of central directory")])
+        entries, directory_size, directory_offset = ZIP64_END_RECORD.unpack(record)[-3:]
+        directory_end = record_offset
+
+    # the directory ends where the end record starts, a difference to its offset is a prefix before the archive
+    directory_start = directory_end - directory_size
+    if directory_start < 0:
+        return report([ZipFinding(MALFORMED, "central directory outside of the file")])
+    if directory_size > MAX_DIRECTORY_BYTES:
+        return report([ZipFinding(ZIP_BOMB, "central directory of {} bytes".format(directory_size))])
+    if directory_start >= tail_start:
+        directory = tail[directory_start - tail_start:directory_end - tail_start]
+    elif directory_end <= tail_start:
+        directory = yield "{}-{}".format(directory_start, directory_end - 1), directory_size
+        bytes_read += len(directory)
+    else:
+        directory = yield "{}-{}".format(directory_start, tail_start - 1), tail_start - directory_start
+        bytes_read += len(directory)
+        directory += tail[:directory_end - tail_start]
+    try:
+        members = parse_central_directory(directory, entries, directory_start - directory_offset)
+    except ValueError as e:
+        return report([ZipFinding(MALFORMED, str(e))])
+
+    findings = check_members(members, directory_start, max_ratio, max_uncompressed, max_members)
+    content_types = next((member for member in members if member.name == CONTENT_TYPES_NAME), None)
+    if findings or content_types is None or content_types.compression not in (STORED, DEFLATED) \
+        or content_types.compressed_size > MEMBER_MAX_BYTES:
+        return report(findings, members)
+
+    # the local header extra field may differ from the central one, read some bytes more
+    start = content_types.header_offset
+    stop = min(directory_start, start + ZIP_LOCAL_HEADER.size + len(CONTENT_TYPES_NAME) + content_types.compressed_size + LOCAL_EXTRA_SLACK)
+    if stop <= len(head):
+        data = head[start:stop]
+    else:
+        data = yield "{}-{}".format(start, stop - 1), stop - start
+        bytes_read += len(data)
+    data_offset = member_data_offset(data)
+    if data_offset is None:
+        return report([ZipFinding(MALFORMED, "invalid local header of {}".format(CONTENT_TYPES_NAME))], members)
+    data = data[data_offset:data_offset + content_types.compressed_size]
+    if len(data) < content_types.compressed_size:
+        missing = content_types.compressed_size - len(data)
+        rest = yield "{}-{}".format(start + data_offset + len(data), start + data_offset + content_types.compressed_size - 1), missing
+        bytes_read += len(rest)
+        data += rest
+    try:
+        findings = check_content_types(decompress_member(content_types, data))
+    except zlib.error as e:
+        findings = [ZipFinding(MALFORMED, "{}: {}".format(CONTENT_TYPES_NAME, e))]
+    return report(findings, members)
+
+def inspect_zip_remote(session, url, size, head = b"", **limits):
+    """
+    Inspect the structure of a remote ZIP file by HTTP Range requests.
+
+    Parameters:
+        session: HTTP session with a requests-like get()
+        url (str): file URL
+        size (int): file size from Content-Length
+        head (bytes): beginning of the file if already read
+        limits: max_ratio, max_uncompressed and max_members of inspect_zip()
+
+    Returns:
+        ZipReport: findings empty if the structure is fine
+    """
+    steps = inspect_zip(size, head, **limits)
+    data = None
+    try:
+        while True:
+            range_spec, max_bytes = steps.send(data)
+            data = fetch_range(session, url, range_spec, max_bytes)
+    except StopIteration as done:
+        result = done.value
+    logger.debug("ZIP structure of %s: %s members, %s bytes read, findings: %s", url, len(result.members), result.bytes_read, result.findings)
+    return result